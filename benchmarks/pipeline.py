@@ -0,0 +1,341 @@
+"""
+Benchmark of the full logging pipeline: middleware, filter, handler and transport.
+
+A FastAPI application is called in process through ASGI, without any server nor
+network, and its records are sent by ``FastAPILoggingHandler`` to a stub transport
+which builds entries as the background transport does, without calling the API.
+Both the standard ``logging`` and loguru paths of ``example/`` are measured with each
+request logging middleware.
+
+Usage::
+
+    python -m benchmarks.pipeline --output results.json
+    python -m benchmarks.pipeline --compare results.json
+
+The results are written as JSON, to be compared across commits with ``--compare``.
+"""
+import argparse
+import asyncio
+import datetime
+import gc
+import json
+import logging
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional
+
+from fastapi import FastAPI
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.logging import Client
+from google.cloud.logging_v2.handlers.transports.base import Transport
+from google.cloud.logging_v2.resource import Resource
+
+from fastapi_cloud_logging import (
+    ASGIRequestLoggingMiddleware,
+    FastAPILoggingHandler,
+    RequestLoggingMiddleware,
+)
+from fastapi_cloud_logging.request_logging_middleware import _FASTAPI_REQUEST_CONTEXT
+from fastapi_cloud_logging.transports._helpers import build_entry
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+try:
+    from loguru import logger as loguru_logger
+except ImportError:  # pragma: no cover
+    loguru_logger = None
+
+_MIDDLEWARES = {
+    "legacy": RequestLoggingMiddleware,
+    "asgi": ASGIRequestLoggingMiddleware,
+}
+# metrics of the report, and whether a lower value is better
+_METRICS = [
+    ("requests_per_second", False),
+    ("us_per_request", True),
+    ("us_per_record", True),
+    ("allocated_bytes_per_record", True),
+]
+
+
+class StubTransport(Transport):
+    """Transport which builds entries in the same way as the background transport."""
+
+    def __init__(self, client, name, **kwargs):
+        self.entries: List[dict] = []
+        self.keep_entries = False
+        self.count = 0
+
+    def send(self, record, message, **kwargs):
+        entry = build_entry(record, message, **kwargs)
+        self.count += 1
+        if self.keep_entries:
+            self.entries.append(entry)
+
+    def send_batch(self, items):
+        for record, message, kwargs in items:
+            self.send(record, message, **kwargs)
+
+    def flush(self):
+        pass
+
+
+def _create_handler() -> FastAPILoggingHandler:
+    client = Client(
+        project="benchmark", credentials=AnonymousCredentials(), _use_grpc=False
+    )
+    return FastAPILoggingHandler(
+        client, transport=StubTransport, resource=Resource(type="global", labels={})
+    )
+
+
+def _create_app(middleware: str, log: Callable[[int], None], records: int) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(_MIDDLEWARES[middleware])
+
+    @app.get("/users/{user_id}")
+    async def get_user(user_id: int):
+        for index in range(records):
+            log(index)
+        return {"user_id": user_id}
+
+    return app
+
+
+def _http_scope() -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "https",
+        "server": ("example.com", 443),
+        "root_path": "",
+        "path": "/users/1234",
+        "raw_path": b"/users/1234",
+        "query_string": b"page=2",
+        "headers": [
+            (b"host", b"example.com"),
+            (b"user-agent", b"curl/7.77.0"),
+            (b"x-cloud-trace-context", b"105445aa7843bc8bf206b12000100000/1;o=1"),
+        ],
+        "client": ("127.0.0.1", 50000),
+    }
+
+
+async def _call(app) -> None:
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        # BaseHTTPMiddleware waits for a disconnect after the response
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(_http_scope(), receive, send)
+
+
+async def _run_requests(app, requests: int) -> float:
+    _FASTAPI_REQUEST_CONTEXT.set(None)
+    start = time.perf_counter()
+    for _ in range(requests):
+        await _call(app)
+    return time.perf_counter() - start
+
+
+def _measure(app, requests: int, repeat: int) -> float:
+    """The best time of ``repeat`` runs, in seconds."""
+    asyncio.run(_run_requests(app, max(requests // 10, 1)))
+    return min(asyncio.run(_run_requests(app, requests)) for _ in range(repeat))
+
+
+def _measure_allocated(
+    middleware: str,
+    log: Callable[[int], None],
+    transport: StubTransport,
+    requests: int,
+    records: int,
+) -> float:
+    """
+    Bytes allocated per record while the records of a request are logged, from the
+    peak memory traced from the first record to the last one. Entries are kept until
+    the last record, so that all of them count in the peak.
+    """
+    peaks = []
+
+    def traced_log(index: int) -> None:
+        if index == 0:
+            # also resets the peak
+            tracemalloc.clear_traces()
+        log(index)
+        if index == records - 1:
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            transport.entries.clear()
+
+    app = _create_app(middleware, traced_log, records)
+    transport.keep_entries = True
+    gc.collect()
+    tracemalloc.start()
+    try:
+        asyncio.run(_run_requests(app, requests))
+    finally:
+        tracemalloc.stop()
+        transport.keep_entries = False
+    return sum(peaks) / (len(peaks) * records)
+
+
+class _Scenario:
+    def __init__(self, name: str, middleware: str, logger_name: str):
+        self.name = name
+        self.middleware = middleware
+        self.logger_name = logger_name
+
+    def setup(self, handler: FastAPILoggingHandler) -> Callable[[int], None]:
+        if self.logger_name == "loguru":
+            loguru_logger.remove()
+            loguru_logger.add(handler, format="{message}", level="INFO")
+
+            def log(index: int) -> None:
+                loguru_logger.info("Hello {user}", user="Bob", index=index)
+
+            return log
+
+        logger = logging.getLogger("benchmark")
+        logger.handlers = [handler]
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+        def log(index: int) -> None:
+            logger.info("Hello %s", "Bob", extra={"labels": {"index": str(index)}})
+
+        return log
+
+    def teardown(self) -> None:
+        if self.logger_name == "loguru":
+            loguru_logger.remove()
+        else:
+            logging.getLogger("benchmark").handlers = []
+
+    def run(self, requests: int, records: int, repeat: int) -> Dict[str, float]:
+        handler = _create_handler()
+        transport: StubTransport = handler.transport
+        log = self.setup(handler)
+        try:
+            app = _create_app(self.middleware, log, records)
+            baseline_app = _create_app(self.middleware, lambda index: None, records)
+            elapsed = _measure(app, requests, repeat)
+            baseline = _measure(baseline_app, requests, repeat)
+            allocated_bytes = _measure_allocated(
+                self.middleware, log, transport, max(requests // 10, 1), records
+            )
+        finally:
+            self.teardown()
+        assert transport.count > 0, "no record reached the transport"
+        return {
+            "requests_per_second": requests / elapsed,
+            "us_per_request": elapsed / requests * 1e6,
+            "us_per_record": max(elapsed - baseline, 0.0) / (requests * records) * 1e6,
+            "allocated_bytes_per_record": allocated_bytes,
+        }
+
+
+def _scenarios() -> List[_Scenario]:
+    scenarios = []
+    for middleware in _MIDDLEWARES:
+        for logger_name in ["logging", "loguru"]:
+            if logger_name == "loguru" and loguru_logger is None:
+                continue
+            name = f"{middleware}-{logger_name}"
+            scenarios.append(_Scenario(name, middleware, logger_name))
+    return scenarios
+
+
+def _peak_rss_kb() -> Optional[float]:
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # bytes on macOS, kilobytes elsewhere
+    return peak / 1024 if sys.platform == "darwin" else float(peak)
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(requests: int, records: int, repeat: int) -> dict:
+    results = {}
+    for scenario in _scenarios():
+        results[scenario.name] = scenario.run(requests, records, repeat)
+    return {
+        "metadata": {
+            "commit": _git_commit(),
+            "date": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "requests": requests,
+            "records_per_request": records,
+            "repeat": repeat,
+            "peak_rss_kb": _peak_rss_kb(),
+        },
+        "results": results,
+    }
+
+
+def _print_report(report: dict, baseline: Optional[dict] = None) -> None:
+    metadata = report["metadata"]
+    print(
+        f"commit={metadata['commit']} python={metadata['python']} "
+        f"requests={metadata['requests']} "
+        f"records_per_request={metadata['records_per_request']} "
+        f"peak_rss_kb={metadata['peak_rss_kb']}"
+    )
+    for name, values in report["results"].items():
+        print(f"\n{name}")
+        previous = (baseline or {}).get("results", {}).get(name, {})
+        for metric, lower_is_better in _METRICS:
+            value = values[metric]
+            line = f"  {metric:<28}{value:>14,.2f}"
+            if previous.get(metric):
+                change = (value - previous[metric]) / previous[metric] * 100
+                better = change < 0 if lower_is_better else change > 0
+                line += f"  {change:+7.1f}% {'better' if better else 'worse'}"
+            print(line)
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--records-per-request", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results of a JSON file")
+    args = parser.parse_args(argv)
+
+    report = run(args.requests, args.records_per_request, args.repeat)
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    _print_report(report, baseline)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,27 @@
 from .fastapi_cloud_logging_handler import FastAPILoggingHandler
-from .request_logging_middleware import RequestLoggingMiddleware
+from .latency_histogram import RouteLatencyHistograms
+from .queue_handler import (
+    FastAPIQueueHandler,
+    FastAPIQueueListener,
+    setup_queue_logging,
+)
+from .rate_limit import RateLimitFilter
+from .request_logging_middleware import (
+    ASGIRequestLoggingMiddleware,
+    RequestLoggingMiddleware,
+)
+from .sampling import TraceSamplingFilter
+from .structured_log_handler import FastAPIStructuredLogHandler
 
-__all__ = ["FastAPILoggingHandler", "RequestLoggingMiddleware"]
+__all__ = [
+    "ASGIRequestLoggingMiddleware",
+    "FastAPILoggingHandler",
+    "FastAPIQueueHandler",
+    "FastAPIQueueListener",
+    "FastAPIStructuredLogHandler",
+    "RateLimitFilter",
+    "RequestLoggingMiddleware",
+    "RouteLatencyHistograms",
+    "TraceSamplingFilter",
+    "setup_queue_logging",
+]
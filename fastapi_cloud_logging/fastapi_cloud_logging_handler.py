@@ -1,13 +1,27 @@
-import json
-import traceback
+import collections
+import collections.abc
+import functools
+import logging
+import random
+import time
+from typing import Deque, Dict, Optional, Tuple, Union
 
 from google.cloud.logging_v2.handlers import CloudLoggingFilter, CloudLoggingHandler
-from google.cloud.logging_v2.handlers._helpers import _parse_xcloud_trace
-from google.cloud.logging_v2.handlers.handlers import DEFAULT_LOGGER_NAME
-from google.cloud.logging_v2.handlers.transports import BackgroundThreadTransport
+from google.cloud.logging_v2.handlers.handlers import (
+    _GAE_RESOURCE_TYPE,
+    _GAE_TRACE_ID_LABEL,
+    DEFAULT_LOGGER_NAME,
+)
 
+from .json_encoder import get_json_encoder
 from .request_logging_middleware import _FASTAPI_REQUEST_CONTEXT
-from .utils import serialize_json
+from .stats import HandlerStats
+from .tracebacks import exception_fingerprint, format_traceback
+from .transports.bounded import BoundedBackgroundThreadTransport, OverflowPolicy
+from .utils import estimate_json_size, sanitize_json, truncate_json
+
+_EMPTY_JSON = "{}"
+_MAX_CACHED_SOURCE_LOCATIONS = 4096
 
 
 class FastAPILoggingFilter(CloudLoggingFilter):
@@ -22,15 +36,34 @@ class FastAPILoggingFilter(CloudLoggingFilter):
         default_labels=None,
         structured: bool = False,
         traceback_length: int = 100,
+        json_encoder=None,
+        stats: Optional[HandlerStats] = None,
+        string_fields: bool = True,
+        error_fingerprint: bool = False,
+        max_payload_size: Optional[int] = None,
     ):
         super().__init__(project=project, default_labels=default_labels)
         self.structured = structured
         self.traceback_length = traceback_length
+        self.error_fingerprint = error_fingerprint
+        self.max_payload_size = max_payload_size
+        self.json_encoder = get_json_encoder(json_encoder)
+        self.stats = stats
+        # string representations used by the format of StructuredLogHandler
+        self.string_fields = string_fields
+        # shared by records of the same logger, and of the same line
+        self._logger_labels: Dict[str, Tuple[Optional[dict], Optional[str]]] = {}
+        self._source_locations: Dict[
+            Tuple[str, int, str], Tuple[Optional[dict], Optional[str]]
+        ] = {}
 
     def filter(self, record):
         """
         Add new Cloud Logging data to each LogRecord as it comes in
         """
+        stats = self.stats
+        if stats is not None:
+            start = time.perf_counter_ns()
         # infer request data from context_vars
         (
             http_request,
@@ -39,13 +72,13 @@ class FastAPILoggingFilter(CloudLoggingFilter):
             trace_sampled,
         ) = self.get_request_data()
         if trace is not None and self.project is not None:
-            # add full path for detected trace
-            trace = f"projects/{self.project}/traces/{trace}"
+            # add full path for detected trace, which is cached per request
+            trace = _FASTAPI_REQUEST_CONTEXT.get().get_trace_path(self.project)
 
-        setattr(record, "trace", trace)
-        setattr(record, "span_id", span_id)
-        setattr(record, "trace_sampled", trace_sampled)
-        setattr(record, "http_request", http_request)
+        record.trace = trace
+        record.span_id = span_id
+        record.trace_sampled = trace_sampled
+        record.http_request = http_request
 
         if self.structured and isinstance(record.msg, str):
             record.msg = {"message": record.msg}
@@ -53,42 +86,180 @@ class FastAPILoggingFilter(CloudLoggingFilter):
         # for loguru
         if hasattr(record, "extra"):
             extra = getattr(record, "extra", {})
-            record.json_fields = json.loads(json.dumps(extra, default=serialize_json))
+            if stats is None:
+                record.json_fields = sanitize_json(extra)
+            else:
+                sanitize_start = time.perf_counter_ns()
+                record.json_fields = sanitize_json(extra)
+                stats.record_sanitize(time.perf_counter_ns() - sanitize_start)
 
         if record.exc_info is not None:
             error_type, _, exc_trace = record.exc_info
             if error_type is not None:
-                json_fields = getattr(record, "json_fields", {})
+                # copy json_fields not to modify extras given by a caller
+                json_fields = dict(getattr(record, "json_fields", {}))
                 if self.traceback_length > 0:
-                    json_fields["traceback"] = traceback.format_tb(exc_trace)[
-                        : self.traceback_length
-                    ]
+                    json_fields["traceback"] = format_traceback(
+                        exc_trace, self.traceback_length
+                    )
+                if self.error_fingerprint:
+                    json_fields["error_fingerprint"] = exception_fingerprint(
+                        error_type, exc_trace
+                    )
                 record.json_fields = json_fields
             # Avoid unnecessary information
             record.exc_info = None
 
-        return super().filter(record=record)
+        if self.max_payload_size is not None:
+            self._limit_payload_size(record)
+
+        self._set_cloud_logging_data(record)
+        if stats is not None:
+            stats.record_filter(time.perf_counter_ns() - start)
+        return True
+
+    def _limit_payload_size(self, record):
+        """
+        Truncate the message and then ``json_fields`` of a record, so that their
+        estimated size fits in ``max_payload_size``. ``json_fields`` of a truncated
+        record has ``truncated`` set to True.
+        """
+        max_size = self.max_payload_size
+        message = record.msg
+        formatted = isinstance(message, str)
+        if formatted:
+            try:
+                # the size of a message depends on its arguments
+                message = record.getMessage()
+            except Exception:
+                # left to the handler, which reports the error
+                formatted = False
+        message, truncated = truncate_json(message, max_size)
+        if formatted:
+            record.msg = message
+            record.args = None
+        elif truncated:
+            record.msg = message
+
+        json_fields = getattr(record, "json_fields", None)
+        if json_fields:
+            remaining = max(max_size - estimate_json_size(message), 0)
+            json_fields, fields_truncated = truncate_json(json_fields, remaining)
+            truncated = truncated or fields_truncated
+        if truncated:
+            # copy json_fields not to modify extras given by a caller
+            record.json_fields = {**(json_fields or {}), "truncated": True}
+
+    def _set_cloud_logging_data(self, record):
+        """
+        Same as ``CloudLoggingFilter.filter``, except that the string representations
+        for structured logging are written with the JSON encoder of this filter.
+
+        Source locations and labels without user labels are built once and shared
+        by records, with their string representations, so they must not be mutated.
+        """
+        user_labels = getattr(record, "labels", None)
+        # set new record values
+        record._resource = getattr(record, "resource", None)
+        record._trace = record.trace or None
+        record._span_id = record.span_id or None
+        record._trace_sampled = bool(record.trace_sampled)
+        record._http_request = record.http_request
+        if hasattr(record, "source_location"):
+            source_location = record.source_location
+            source_location_str = None
+        else:
+            source_location, source_location_str = self._get_source_location(record)
+        record._source_location = source_location
+        if user_labels:
+            # add logger name as a label if possible
+            logger_label = {"python_logger": record.name} if record.name else {}
+            labels = {**logger_label, **self.default_labels, **user_labels} or None
+            labels_str = None
+        else:
+            labels, labels_str = self._get_logger_labels(record.name)
+        record._labels = labels
+        if not self.string_fields:
+            return
+        # create string representations for structured logging
+        dumps = self.json_encoder.dumps
+        record._trace_str = record._trace or ""
+        record._span_id_str = record._span_id or ""
+        record._trace_sampled_str = "true" if record._trace_sampled else "false"
+        request = _FASTAPI_REQUEST_CONTEXT.get()
+        if record._http_request is None:
+            record._http_request_str = _EMPTY_JSON
+        elif request is not None and record._http_request is request.http_request:
+            record._http_request_str = request.get_http_request_json(self.json_encoder)
+        else:
+            record._http_request_str = dumps(record._http_request)
+        record._source_location_str = (
+            source_location_str
+            if source_location_str is not None
+            else dumps(source_location or {})
+        )
+        record._labels_str = (
+            labels_str if labels_str is not None else dumps(labels or {})
+        )
+
+    def _get_source_location(self, record) -> Tuple[Optional[dict], Optional[str]]:
+        key = (record.pathname, record.lineno, record.funcName)
+        cached = self._source_locations.get(key)
+        if cached is None:
+            if len(self._source_locations) >= _MAX_CACHED_SOURCE_LOCATIONS:
+                self._source_locations.clear()
+            source_location = CloudLoggingFilter._infer_source_location(record)
+            source_location_str = (
+                self.json_encoder.dumps(source_location or {})
+                if self.string_fields
+                else None
+            )
+            cached = self._source_locations[key] = (
+                source_location,
+                source_location_str,
+            )
+        return cached
+
+    def _get_logger_labels(self, name: str) -> Tuple[Optional[dict], Optional[str]]:
+        cached = self._logger_labels.get(name)
+        if cached is None:
+            # add logger name as a label if possible
+            logger_label = {"python_logger": name} if name else {}
+            labels = {**logger_label, **self.default_labels} or None
+            labels_str = (
+                self.json_encoder.dumps(labels or {}) if self.string_fields else None
+            )
+            cached = self._logger_labels[name] = (labels, labels_str)
+        return cached
 
     def get_request_data(self):
         request = _FASTAPI_REQUEST_CONTEXT.get()
         if request is None:
             return None, None, None, False
 
-        # build up http request data
-        http_request = {
-            "requestMethod": request.request_method,
-            "requestUrl": request.request_url,
-            "requestSize": request.content_length,
-            "userAgent": request.user_agent,
-            "remoteIp": request.remote_ip,
-            "referer": request.referer,
-            "protocol": request.protocol,
-        }
+        # http request data and trace data are built once per request
+        trace_id, span_id, trace_sampled = request.trace_data
+        return request.http_request, trace_id, span_id, trace_sampled
 
-        trace_id, span_id, trace_sampled = _parse_xcloud_trace(
-            request.cloud_trace_content
-        )
-        return http_request, trace_id, span_id, trace_sampled
+
+class _RequestLogBuffer:
+    """Records of a request held by a handler until the request completes."""
+
+    def __init__(self, max_held: int):
+        # records to send when the request completes
+        self.records: list = []
+        # records below WARNING kept only by tail sampling
+        self.held: Deque[tuple] = collections.deque(maxlen=max_held)
+        self.error_logged = False
+
+    def take_records(self) -> list:
+        records, self.records = self.records, []
+        return records
+
+    def take_held(self) -> list:
+        held = list(self.held)
+        self.held.clear()
+        return held
 
 
 class FastAPILoggingHandler(CloudLoggingHandler):
@@ -102,12 +273,25 @@ class FastAPILoggingHandler(CloudLoggingHandler):
         client,
         *,
         name=DEFAULT_LOGGER_NAME,
-        transport=BackgroundThreadTransport,
+        transport=BoundedBackgroundThreadTransport,
         resource=None,
         labels=None,
         stream=None,
         structured: bool = False,
         traceback_length: int = 100,
+        json_encoder=None,
+        max_queue_entries: Optional[int] = None,
+        max_queue_bytes: Optional[int] = None,
+        overflow_policy: Union[str, OverflowPolicy] = OverflowPolicy.BLOCK,
+        request_buffering: bool = False,
+        request_buffer_size: int = 100,
+        request_buffer_flush_level: Optional[int] = None,
+        tail_sampling: bool = False,
+        tail_sampling_latency: Optional[float] = None,
+        tail_sampling_keep_rate: float = 0.0,
+        collect_stats: bool = False,
+        error_fingerprint: bool = False,
+        max_payload_size: Optional[int] = None,
     ):
         """
         Args:
@@ -121,14 +305,66 @@ class FastAPILoggingHandler(CloudLoggingHandler):
                 Class for creating new transport objects. It should
                 extend from the base :class:`.Transport` type and
                 implement :meth`.Transport.send`. Defaults to
-                :class:`.BackgroundThreadTransport`. The other
-                option is :class:`.SyncTransport`.
+                :class:`.BoundedBackgroundThreadTransport`, which works as
+                :class:`.BackgroundThreadTransport` without queue limits.
+                Other options are :class:`.SyncTransport` and
+                :class:`.AsyncBatchTransport`.
             resource (~logging_v2.resource.Resource):
                 Resource for this Handler. If not given, will be inferred from the environment.
             labels (Optional[dict]): Additional labels to attach to logs.
             stream (Optional[IO]): Stream to be used by the handler.
             structured (bool): Treat every message as structured message.
+            traceback_length (int): Maximum number of traceback entries of an error.
+            json_encoder (Optional[Union[str, JSONEncoder]]): JSON encoder for structured
+                payloads, "json" or "orjson". Defaults to orjson when it is installed.
+            max_queue_entries (Optional[int]): The maximum number of entries queued
+                in the transport. Requires a :class:`.BoundedBackgroundThreadTransport`.
+            max_queue_bytes (Optional[int]): The maximum estimated size of entries queued
+                in the transport. Requires a :class:`.BoundedBackgroundThreadTransport`.
+            overflow_policy (Union[str, OverflowPolicy]): What to do with an entry when
+                the queue is full, "block", "drop_newest", "drop_oldest" or
+                "drop_below_warning". Defaults to "block".
+            request_buffering (bool): Hold records logged during a request, and send
+                them to the transport at once when the response completes.
+                Requires a request logging middleware.
+            request_buffer_size (int): The maximum number of records held per request.
+                The held records are sent early when the buffer is full.
+            request_buffer_flush_level (Optional[int]): A record of this level or above
+                is sent immediately, together with the records held before it,
+                such as ``logging.WARNING``. Defaults to holding records of any level.
+            tail_sampling (bool): Hold records below WARNING until a request completes,
+                and send them only if the status is 500 or above, the latency is over
+                ``tail_sampling_latency``, or an ERROR is logged during the request.
+                At most ``request_buffer_size`` records are held per request.
+                Requires a request logging middleware.
+            tail_sampling_latency (Optional[float]): Latency in seconds from which
+                the held records of a request are sent.
+            tail_sampling_keep_rate (float): Rate of the other requests whose held records
+                are sent anyway, from 0.0 to 1.0. Defaults to 0.0.
+            collect_stats (bool): Measure the time spent by this handler into
+                ``stats``, a :class:`.HandlerStats`.
+            error_fingerprint (bool): Add ``error_fingerprint``, a stable hash of
+                the type and the frames of an error, to records with an error.
+            max_payload_size (Optional[int]): Truncate long strings and collections
+                of the message and ``json_fields`` of a record, so that their size
+                estimated in characters fits in it. Defaults to no limit.
         """
+        if max_queue_entries is not None or max_queue_bytes is not None:
+            if not (
+                isinstance(transport, type)
+                and issubclass(transport, BoundedBackgroundThreadTransport)
+            ):
+                raise ValueError(
+                    "max_queue_entries and max_queue_bytes require "
+                    "BoundedBackgroundThreadTransport"
+                )
+            transport = functools.partial(
+                transport,
+                max_queue_entries=max_queue_entries,
+                max_queue_bytes=max_queue_bytes,
+                overflow_policy=overflow_policy,
+            )
+
         super().__init__(
             client,
             name=name,
@@ -143,10 +379,193 @@ class FastAPILoggingHandler(CloudLoggingHandler):
             if isinstance(default_filter, CloudLoggingFilter):
                 self.removeFilter(default_filter)
 
+        self.stats = HandlerStats() if collect_stats else None
+        set_handler_stats = getattr(self.transport, "set_handler_stats", None)
+        if self.stats is not None and set_handler_stats is not None:
+            set_handler_stats(self.stats)
+
         log_filter = FastAPILoggingFilter(
             project=self.project_id,
             default_labels=labels,
             structured=structured,
             traceback_length=traceback_length,
+            json_encoder=json_encoder,
+            stats=self.stats,
+            error_fingerprint=error_fingerprint,
+            max_payload_size=max_payload_size,
         )
+        self.json_encoder = log_filter.json_encoder
         self.addFilter(log_filter)
+        self.request_buffering = request_buffering
+        self.request_buffer_size = request_buffer_size
+        self.request_buffer_flush_level = request_buffer_flush_level
+        self.tail_sampling = tail_sampling
+        self.tail_sampling_latency = tail_sampling_latency
+        self.tail_sampling_keep_rate = tail_sampling_keep_rate
+
+    def emit(self, record):
+        """
+        Same as ``CloudLoggingHandler.emit``, except that a message is parsed
+        with the JSON encoder of this handler.
+        """
+        resource = record._resource or self.resource
+        labels = record._labels
+        message = self._format_and_parse_message(record)
+
+        if resource.type == _GAE_RESOURCE_TYPE and record._trace is not None:
+            # add GAE-specific label
+            labels = {_GAE_TRACE_ID_LABEL: record._trace, **(labels or {})}
+        kwargs = {
+            "resource": resource,
+            "labels": labels,
+            "trace": record._trace,
+            "span_id": record._span_id,
+            "trace_sampled": record._trace_sampled,
+            "http_request": record._http_request,
+            "source_location": record._source_location,
+        }
+        if (self.request_buffering or self.tail_sampling) and self._buffer_record(
+            record, message, kwargs
+        ):
+            return
+        # send off request
+        if self.stats is None:
+            self.transport.send(record, message, **kwargs)
+        else:
+            start = time.perf_counter_ns()
+            self.transport.send(record, message, **kwargs)
+            self.stats.record_enqueue(time.perf_counter_ns() - start)
+
+    def _buffer_record(self, record, message, kwargs) -> bool:
+        """
+        Hold a record in the buffer of the current request.
+
+        Returns:
+            bool: False if the record is to be sent as usual.
+        """
+        request = _FASTAPI_REQUEST_CONTEXT.get()
+        if request is None:
+            return False
+        buffer = request.get_log_buffer(
+            self, lambda: _RequestLogBuffer(self.request_buffer_size)
+        )
+        if buffer is None:
+            return False
+        item = (record, message, kwargs)
+        if record.levelno >= logging.ERROR:
+            buffer.error_logged = True
+        elif (
+            self.tail_sampling
+            and record.levelno < logging.WARNING
+            and not buffer.error_logged
+        ):
+            buffer.held.append(item)
+            return True
+
+        if self.request_buffering:
+            buffer.records.append(item)
+            items = []
+            if len(buffer.records) >= self.request_buffer_size or (
+                self.request_buffer_flush_level is not None
+                and record.levelno >= self.request_buffer_flush_level
+            ):
+                items = buffer.take_records()
+        elif buffer.error_logged and buffer.held:
+            items = [item]
+        else:
+            return False
+        if buffer.error_logged and buffer.held:
+            # an error keeps the held records of the request
+            items = buffer.take_held() + items
+        if items:
+            self.flush_request_buffer(items)
+        return True
+
+    def complete_request(self, request, buffer: _RequestLogBuffer) -> None:
+        """
+        Send the records held for a request when it completes.
+        The lock of the handler waits for a record being added to the buffer on
+        another thread, and records handled after this are sent as usual.
+        """
+        with self.lock:
+            items = buffer.take_records()
+            if buffer.held and self._keep_held_records(request, buffer):
+                items = buffer.take_held() + items
+            if items:
+                self.flush_request_buffer(items)
+
+    def _keep_held_records(self, request, buffer: _RequestLogBuffer) -> bool:
+        if buffer.error_logged:
+            return True
+        # a request without a response status has failed with an error
+        if request.status_code is None or request.status_code >= 500:
+            return True
+        if (
+            self.tail_sampling_latency is not None
+            and request.latency_ns is not None
+            and request.latency_ns >= self.tail_sampling_latency * 1e9
+        ):
+            return True
+        return random.random() < self.tail_sampling_keep_rate
+
+    def flush_request_buffer(self, items):
+        """
+        Send records held for a request to the transport at once.
+        A transport without ``send_batch`` is given the records one by one.
+
+        Args:
+            items (List[Tuple[logging.LogRecord, Any, dict]]): Records, messages
+                and additional arguments of ``Transport.send``.
+        """
+        start = time.perf_counter_ns() if self.stats is not None else 0
+        try:
+            send_batch = getattr(self.transport, "send_batch", None)
+            if send_batch is not None:
+                send_batch(items)
+            else:
+                for record, message, kwargs in items:
+                    self.transport.send(record, message, **kwargs)
+        except Exception:
+            self.handleError(items[0][0])
+        if self.stats is not None:
+            self.stats.record_enqueue(time.perf_counter_ns() - start)
+
+    def _format_and_parse_message(self, record):
+        return _format_and_parse_message(record, self, self.json_encoder)
+
+
+def _format_and_parse_message(record, formatter, json_encoder):
+    """
+    Apply formatting to a LogRecord message, and attempt to parse encoded JSON
+    into a dictionary object, such as ``_format_and_parse_message`` of Cloud Logging.
+    The message is formatted by ``formatter``, and parsed by ``json_encoder``.
+    """
+    passed_json_fields = getattr(record, "json_fields", {})
+    # if message is a dictionary, use dictionary directly
+    if isinstance(record.msg, collections.abc.Mapping):
+        payload = record.msg
+        # attach any extra json fields if present
+        if passed_json_fields and isinstance(
+            passed_json_fields, collections.abc.Mapping
+        ):
+            payload = {**payload, **passed_json_fields}
+        return payload
+    # format message string based on superclass
+    message = formatter.format(record)
+    if message[:1] == "{":
+        try:
+            # attempt to parse encoded json into dictionary
+            json_message = json_encoder.loads(message)
+            if isinstance(json_message, collections.abc.Mapping):
+                message = json_message
+        except ValueError:
+            # log string is not valid json
+            pass
+    # if json_fields was set, create a dictionary using that
+    if passed_json_fields and isinstance(passed_json_fields, collections.abc.Mapping):
+        passed_json_fields = passed_json_fields.copy()
+        if message != "None":
+            passed_json_fields["message"] = message
+        return passed_json_fields
+    # if formatted message contains no content, return None
+    return message if message != "None" else None
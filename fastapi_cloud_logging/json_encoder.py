@@ -0,0 +1,102 @@
+import json
+from abc import ABC, abstractmethod
+from typing import Any, Optional, Union
+
+from .utils import serialize_json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONEncoder(ABC):
+    """
+    Base class of JSON encoders used for structured payloads.
+
+    Every encoder writes compact JSON in UTF-8 without escaping non-ASCII characters,
+    and converts values which are not JSON-native with ``serialize_json``.
+    """
+
+    name: str = ""
+
+    @abstractmethod
+    def dumps(self, obj: Any) -> str:
+        """Encode a value into a JSON string."""
+
+    @abstractmethod
+    def loads(self, data: Union[str, bytes]) -> Any:
+        """Decode a JSON string or bytes."""
+
+
+class StdlibJSONEncoder(JSONEncoder):
+    """JSON encoder based on the standard ``json`` module."""
+
+    name = "json"
+
+    def dumps(self, obj: Any) -> str:
+        return json.dumps(
+            obj, ensure_ascii=False, separators=(",", ":"), default=serialize_json
+        )
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return json.loads(data)
+
+
+class OrjsonJSONEncoder(JSONEncoder):
+    """
+    JSON encoder based on `orjson <https://github.com/ijl/orjson>`_.
+
+    Values which orjson cannot encode, such as integers over 64 bits, fall back to
+    the standard ``json`` module. The output is not byte-identical to
+    ``StdlibJSONEncoder`` for some floats: non-finite floats are written as ``null``
+    instead of ``NaN``, and exponents have no ``+`` sign, such as ``1e16``.
+    Other values are encoded in the same way.
+    """
+
+    name = "orjson"
+
+    # datetimes and dataclasses go through serialize_json, as with the json module
+    _OPTIONS = (
+        orjson.OPT_NON_STR_KEYS
+        | orjson.OPT_PASSTHROUGH_DATETIME
+        | orjson.OPT_PASSTHROUGH_DATACLASS
+        if orjson is not None
+        else 0
+    )
+
+    def __init__(self):
+        if orjson is None:
+            raise ImportError("orjson is required to use OrjsonJSONEncoder")
+        self._fallback = StdlibJSONEncoder()
+
+    def dumps(self, obj: Any) -> str:
+        try:
+            return orjson.dumps(
+                obj, default=serialize_json, option=self._OPTIONS
+            ).decode("utf-8")
+        except TypeError:
+            return self._fallback.dumps(obj)
+
+    def loads(self, data: Union[str, bytes]) -> Any:
+        return orjson.loads(data)
+
+
+def get_json_encoder(encoder: Optional[Union[str, JSONEncoder]] = None) -> JSONEncoder:
+    """
+    Resolve a JSON encoder.
+
+    Args:
+        encoder (Optional[Union[str, JSONEncoder]]): An encoder instance, or the name
+            of a backend, "json" or "orjson". If not given, orjson is used when it is
+            installed, and the standard ``json`` module otherwise.
+    """
+    if isinstance(encoder, JSONEncoder):
+        return encoder
+    if encoder is None:
+        return OrjsonJSONEncoder() if orjson is not None else StdlibJSONEncoder()
+    if encoder == StdlibJSONEncoder.name:
+        return StdlibJSONEncoder()
+    if encoder == OrjsonJSONEncoder.name:
+        return OrjsonJSONEncoder()
+    raise ValueError(f"Unknown JSON encoder: {encoder}")
@@ -0,0 +1,186 @@
+import logging
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, Optional, Tuple
+
+# 2 ** _SUB_BUCKET_BITS buckets per power of two, so values are within about 3 %
+_SUB_BUCKET_BITS = 5
+_LINEAR_LIMIT = 1 << (_SUB_BUCKET_BITS + 1)
+_DEFAULT_PERCENTILES = (50.0, 90.0, 99.0)
+_UNMATCHED_ROUTE = "<unmatched>"
+
+_SUMMARY_LOGGER = logging.getLogger("fastapi_cloud_logging.latency")
+
+
+def _bucket_index(value: int) -> int:
+    if value < _LINEAR_LIMIT:
+        return value
+    shift = value.bit_length() - (_SUB_BUCKET_BITS + 1)
+    return (shift << _SUB_BUCKET_BITS) + (value >> shift)
+
+
+def _bucket_upper_bound(index: int) -> int:
+    if index < _LINEAR_LIMIT:
+        return index
+    shift = (index >> _SUB_BUCKET_BITS) - 1
+    mantissa = index - (shift << _SUB_BUCKET_BITS)
+    return ((mantissa + 1) << shift) - 1
+
+
+class LatencyHistogram:
+    """
+    Log-linear histogram of latencies in microseconds.
+
+    Each power of two is split into 32 linear buckets, so a percentile is reported
+    within about 3 % of the recorded value, with a fixed number of buckets
+    up to ``max_latency``. Latencies above it are counted in the last bucket.
+    """
+
+    def __init__(self, max_latency: float = 3600.0):
+        """
+        Args:
+            max_latency (float): The highest latency to track precisely, in seconds.
+        """
+        self._max_value = int(max_latency * 1_000_000)
+        self._counts = array("Q", [0]) * (_bucket_index(self._max_value) + 1)
+        self.count = 0
+        self.max_ns = 0
+
+    def record(self, latency_ns: int) -> None:
+        """Record a latency in nanoseconds."""
+        value = min(latency_ns // 1000, self._max_value)
+        self._counts[_bucket_index(value)] += 1
+        self.count += 1
+        if latency_ns > self.max_ns:
+            self.max_ns = latency_ns
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """Latency in seconds below which ``percentile`` % of the latencies fall."""
+        if self.count == 0:
+            return None
+        rank = max(1, -(-self.count * percentile // 100))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                break
+        if index == len(self._counts) - 1:
+            # the last bucket also counts latencies over max_latency
+            return self.max_ns / 1e9
+        return min(_bucket_upper_bound(index) * 1000, self.max_ns) / 1e9
+
+    def snapshot(
+        self, percentiles: Iterable[float] = _DEFAULT_PERCENTILES
+    ) -> Dict[str, Optional[float]]:
+        """
+        Returns:
+            dict: ``count``, ``max`` and the percentiles such as ``p50``, in seconds.
+        """
+        snapshot = {"count": self.count, "max": self.max_ns / 1e9}
+        for percentile in percentiles:
+            snapshot[f"p{percentile:g}"] = self.percentile(percentile)
+        return snapshot
+
+
+class RouteLatencyHistograms:
+    """
+    Latency histograms of requests, keyed by method, route template and status class.
+
+    Give it to a request logging middleware, which records the latency of every
+    request. The route template is taken from the route matched by FastAPI, such as
+    ``/users/{user_id}``, so the number of histograms does not grow with raw URLs.
+    With ``summary_interval``, a summary of the histograms is logged to the
+    ``fastapi_cloud_logging.latency`` logger at that interval, and they are reset.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_latency: float = 3600.0,
+        percentiles: Iterable[float] = _DEFAULT_PERCENTILES,
+        summary_interval: Optional[float] = None,
+    ):
+        """
+        Args:
+            max_latency (float): The highest latency to track precisely, in seconds.
+            percentiles (Iterable[float]): Percentiles of snapshots.
+                Defaults to 50, 90 and 99.
+            summary_interval (Optional[float]): Seconds between summary log entries.
+                Defaults to no summary.
+        """
+        self.max_latency = max_latency
+        self.percentiles = tuple(percentiles)
+        self.summary_interval = summary_interval
+        self._histograms: Dict[Tuple[str, str, str], LatencyHistogram] = {}
+        self._lock = threading.Lock()
+        self._next_summary = (
+            time.monotonic() + summary_interval
+            if summary_interval is not None
+            else None
+        )
+
+    def record(
+        self,
+        method: str,
+        route: Optional[str],
+        status_code: Optional[int],
+        latency_ns: int,
+    ) -> None:
+        """Record the latency of a request in nanoseconds."""
+        # a request without a response has failed with an error
+        status_class = f"{status_code // 100}xx" if status_code else "5xx"
+        key = (method, route or _UNMATCHED_ROUTE, status_class)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = LatencyHistogram(self.max_latency)
+            histogram.record(latency_ns)
+
+        if self._next_summary is not None and time.monotonic() >= self._next_summary:
+            self._next_summary = time.monotonic() + self.summary_interval
+            self.log_summary(reset=True)
+
+    def record_request(self, context) -> None:
+        """Record the latency of a completed request from its request context."""
+        if context.latency_ns is None:
+            return
+        route = context.route_template
+        self.record(
+            context.request_method, route, context.status_code, context.latency_ns
+        )
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Dict[str, Optional[float]]]:
+        """
+        Percentiles of latencies by ``"{method} {route} {status class}"``,
+        such as ``"GET /users/{user_id} 2xx"``.
+
+        Args:
+            reset (bool): Clear the histograms after taking the snapshot.
+        """
+        with self._lock:
+            snapshot = {
+                " ".join(key): histogram.snapshot(self.percentiles)
+                for key, histogram in sorted(self._histograms.items())
+            }
+            if reset:
+                self._histograms = {}
+        return snapshot
+
+    def log_summary(self, reset: bool = False, level: int = logging.INFO) -> None:
+        """Write a snapshot of the histograms as a structured log entry."""
+        # imported here, as the middleware module imports this one
+        from .request_logging_middleware import _FASTAPI_REQUEST_CONTEXT
+
+        snapshot = self.snapshot(reset=reset)
+        if snapshot and _SUMMARY_LOGGER.isEnabledFor(level):
+            # a summary does not belong to the request which has completed it
+            token = _FASTAPI_REQUEST_CONTEXT.set(None)
+            try:
+                _SUMMARY_LOGGER.log(
+                    level,
+                    "Request latency summary",
+                    extra={"json_fields": {"latency": snapshot}},
+                )
+            finally:
+                _FASTAPI_REQUEST_CONTEXT.reset(token)
@@ -0,0 +1,102 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from typing import Optional
+
+from .request_logging_middleware import _FASTAPI_REQUEST_CONTEXT
+
+_REQUEST_CONTEXT_ATTRIBUTE = "_fastapi_request_context"
+
+
+class FastAPIQueueHandler(QueueHandler):
+    """
+    Handler that only puts records on a queue, to be handled by a
+    ``FastAPIQueueListener`` on its own thread.
+
+    The caller keeps a reference to the request context in the record, and puts the
+    record as it is on a ``queue.SimpleQueue``, without any lock of the handler.
+    Formatting, request data, tracebacks and serialization are all left to the handlers
+    of the listener, so a log call blocks the event loop for a few microseconds only.
+
+    As the record is not formatted in advance, arguments of a message must not be
+    mutated after the log call.
+    """
+
+    def __init__(self, queue_: Optional[queue.SimpleQueue] = None):
+        """
+        Args:
+            queue_ (Optional[queue.SimpleQueue]): The queue of records.
+                Defaults to a new ``queue.SimpleQueue``.
+        """
+        super().__init__(queue_ if queue_ is not None else queue.SimpleQueue())
+
+    def handle(self, record):
+        """
+        Same as ``Handler.handle`` without the lock of the handler,
+        as putting a record on the queue is thread-safe.
+        """
+        rv = self.filter(record)
+        if rv:
+            self.emit(record)
+        return rv
+
+    def prepare(self, record):
+        """Keep the request context of the record, instead of formatting it."""
+        setattr(record, _REQUEST_CONTEXT_ATTRIBUTE, _FASTAPI_REQUEST_CONTEXT.get())
+        return record
+
+    def create_listener(self, *handlers, respect_handler_level: bool = True):
+        """Create a ``FastAPIQueueListener`` of the queue of this handler."""
+        return FastAPIQueueListener(
+            self.queue, *handlers, respect_handler_level=respect_handler_level
+        )
+
+
+class FastAPIQueueListener(QueueListener):
+    """
+    Listener that handles records put by ``FastAPIQueueHandler`` on its own thread.
+
+    The request context kept in a record is set while the record is handled,
+    so ``FastAPILoggingHandler`` and ``FastAPIStructuredLogHandler`` add the request
+    data of the request which has logged the record.
+    Call ``stop`` on shutdown to handle the records left on the queue.
+    """
+
+    def handle(self, record):
+        token = _FASTAPI_REQUEST_CONTEXT.set(
+            getattr(record, _REQUEST_CONTEXT_ATTRIBUTE, None)
+        )
+        try:
+            super().handle(record)
+        finally:
+            _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    def register_shutdown(self, app) -> None:
+        """Stop the listener on shutdown of a FastAPI application."""
+        app.add_event_handler("shutdown", self.stop)
+
+
+def setup_queue_logging(
+    *handlers, logger: Optional[logging.Logger] = None, level: int = logging.INFO
+) -> FastAPIQueueListener:
+    """
+    Attach a ``FastAPIQueueHandler`` to a logger, and start a listener which passes
+    its records to ``handlers``.
+
+    Args:
+        handlers (logging.Handler): Handlers of records on the listener thread,
+            such as ``FastAPILoggingHandler``.
+        logger (Optional[logging.Logger]): The logger to attach the queue handler to.
+            Defaults to the root logger.
+        level (int): The level of the logger. Defaults to INFO.
+
+    Returns:
+        FastAPIQueueListener: The started listener, to be stopped on shutdown.
+    """
+    logger = logger if logger is not None else logging.getLogger()
+    queue_handler = FastAPIQueueHandler()
+    logger.addHandler(queue_handler)
+    logger.setLevel(level)
+    listener = queue_handler.create_listener(*handlers)
+    listener.start()
+    return listener
@@ -0,0 +1,203 @@
+import collections
+import datetime
+import logging
+import threading
+import time
+from typing import List, Optional, Tuple
+
+from .request_logging_middleware import _FASTAPI_REQUEST_CONTEXT
+
+_DEFAULT_MAX_KEYS = 1024
+# interval of checks for windows which have closed
+_MAX_SWEEP_INTERVAL = 1.0
+
+
+def _isoformat(created: float) -> str:
+    return datetime.datetime.fromtimestamp(created, datetime.timezone.utc).isoformat()
+
+
+class _Window:
+    """Records of a key in the current window, and the fields of its summary."""
+
+    __slots__ = (
+        "start",
+        "count",
+        "suppressed",
+        "first_suppressed",
+        "last_suppressed",
+        "name",
+        "levelno",
+        "pathname",
+        "lineno",
+        "func_name",
+        "template",
+    )
+
+    def __init__(self, record: logging.LogRecord, template: Optional[str], now: float):
+        self.start = now
+        self.count = 0
+        self.suppressed = 0
+        self.first_suppressed = 0.0
+        self.last_suppressed = 0.0
+        self.name = record.name
+        self.levelno = record.levelno
+        self.pathname = record.pathname
+        self.lineno = record.lineno
+        self.func_name = record.funcName
+        self.template = template
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Filter that lets through ``max_records`` identical records per ``window`` seconds.
+
+    Records are identical when they have the same logger, level, file, line and message
+    template, such as ``"User %s not found"`` before formatting. The other records of
+    a window are suppressed, and after the window closes, a summary record with the
+    number of suppressed records and their first and last timestamps is logged at the
+    same level. Keys are kept in an LRU of ``max_keys`` entries, so the memory stays
+    bounded with many distinct messages. The summary of an evicted key is logged
+    on eviction.
+
+    Summaries are handled by ``handler`` only, when the filter is added to that
+    handler. Otherwise, they are logged to the logger of the suppressed records,
+    which passes them to all of its handlers and to those of its ancestors.
+
+    Windows which have closed are found by later records, or by ``flush``.
+    A summary is logged while the filter checks the record which finds its window
+    closed, so the summary comes before that record.
+    """
+
+    def __init__(
+        self,
+        max_records: int = 10,
+        window: float = 60.0,
+        *,
+        max_keys: int = _DEFAULT_MAX_KEYS,
+        handler: Optional[logging.Handler] = None,
+    ):
+        """
+        Args:
+            max_records (int): The number of identical records to keep per window.
+            window (float): The length of a window in seconds.
+            max_keys (int): The maximum number of keys to keep track of.
+            handler (Optional[logging.Handler]): The handler which this filter is
+                added to, and which only handles summaries. Defaults to logging them
+                to the logger of the suppressed records.
+        """
+        super().__init__()
+        if max_records < 1:
+            raise ValueError(f"max_records must be at least 1: {max_records}")
+        self.max_records = max_records
+        self.window = window
+        self.max_keys = max_keys
+        self.handler = handler
+        self._windows: "collections.OrderedDict[tuple, _Window]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self._sweep_interval = min(window, _MAX_SWEEP_INTERVAL)
+        self._next_sweep = time.monotonic() + self._sweep_interval
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if getattr(record, "_rate_limit_summary", False):
+            return True
+        msg = record.msg
+        template = msg if isinstance(msg, str) else None
+        key = (record.name, record.levelno, record.pathname, record.lineno, template)
+        now = time.monotonic()
+        summaries: List[logging.LogRecord] = []
+        with self._lock:
+            if now >= self._next_sweep:
+                self._next_sweep = now + self._sweep_interval
+                summaries.extend(self._close_windows(now))
+            windows = self._windows
+            current = windows.get(key)
+            if current is None or now - current.start >= self.window:
+                if current is not None and current.suppressed:
+                    summaries.append(self._make_summary(current))
+                current = windows[key] = _Window(record, template, now)
+                if len(windows) > self.max_keys:
+                    _, evicted = windows.popitem(last=False)
+                    if evicted.suppressed:
+                        summaries.append(self._make_summary(evicted))
+            windows.move_to_end(key)
+            current.count += 1
+            allowed = current.count <= self.max_records
+            if not allowed:
+                if not current.suppressed:
+                    current.first_suppressed = record.created
+                current.suppressed += 1
+                current.last_suppressed = record.created
+        if summaries:
+            self._log_summaries(summaries)
+        return allowed
+
+    def _close_windows(self, now: float) -> List[logging.LogRecord]:
+        """Remove the windows which have closed, and return their summaries."""
+        closed = [
+            key
+            for key, current in self._windows.items()
+            if now - current.start >= self.window
+        ]
+        summaries = []
+        for key in closed:
+            current = self._windows.pop(key)
+            if current.suppressed:
+                summaries.append(self._make_summary(current))
+        return summaries
+
+    def flush(self) -> None:
+        """Log the summaries of all windows, including those still open."""
+        with self._lock:
+            summaries = []
+            for current in self._windows.values():
+                if current.suppressed:
+                    summaries.append(self._make_summary(current))
+                    # suppressed records are not counted again by the next summary
+                    current.suppressed = 0
+        self._log_summaries(summaries)
+
+    def _log_summaries(self, summaries: List[logging.LogRecord]) -> None:
+        # a summary does not belong to the request which has found it
+        token = _FASTAPI_REQUEST_CONTEXT.set(None)
+        try:
+            for summary in summaries:
+                if self.handler is not None:
+                    if summary.levelno >= self.handler.level:
+                        self.handler.handle(summary)
+                    continue
+                logger = logging.getLogger(summary.name)
+                if logger.isEnabledFor(summary.levelno):
+                    logger.handle(summary)
+        finally:
+            _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    def _make_summary(self, current: _Window) -> logging.LogRecord:
+        msg, args = self._summary_message(current)
+        record = logging.LogRecord(
+            current.name,
+            current.levelno,
+            current.pathname,
+            current.lineno,
+            msg,
+            args,
+            None,
+            func=current.func_name,
+        )
+        record._rate_limit_summary = True
+        record.json_fields = {
+            "rate_limit": {
+                "suppressed": current.suppressed,
+                "first_suppressed": _isoformat(current.first_suppressed),
+                "last_suppressed": _isoformat(current.last_suppressed),
+                "window": self.window,
+            }
+        }
+        return record
+
+    @staticmethod
+    def _summary_message(current: _Window) -> Tuple[str, tuple]:
+        if current.template is None:
+            return "Suppressed %d records", (current.suppressed,)
+        return "Suppressed %d records of: %s", (current.suppressed, current.template)
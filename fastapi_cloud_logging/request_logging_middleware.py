@@ -1,71 +1,520 @@
+import logging
+import threading
+import time
 from contextvars import ContextVar
-from dataclasses import dataclass
-from typing import Optional
+from typing import Any, Callable, Dict, Optional, Tuple
 
 from fastapi import Request
+from google.cloud.logging_v2.handlers._helpers import _parse_xcloud_trace
+from starlette.datastructures import URL
 from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .latency_histogram import RouteLatencyHistograms
+
+_HTTP_CONTENT_LENGTH = "content-length"
+_HTTP_USER_AGENT = "user-agent"
+_HTTP_FORWARDED_FOR_HEADER = "x-forwarded-for"
+_HTTP_REFERER_HEADER = "referer"
+_HTTP_TRACE_HEADER = "x-cloud-trace-context"
+
+# raw ASGI header names, which are always lowercased bytes
+_RAW_HEADER_NAMES = {
+    _HTTP_CONTENT_LENGTH.encode("latin-1"): _HTTP_CONTENT_LENGTH,
+    _HTTP_USER_AGENT.encode("latin-1"): _HTTP_USER_AGENT,
+    _HTTP_FORWARDED_FOR_HEADER.encode("latin-1"): _HTTP_FORWARDED_FOR_HEADER,
+    _HTTP_REFERER_HEADER.encode("latin-1"): _HTTP_REFERER_HEADER,
+    _HTTP_TRACE_HEADER.encode("latin-1"): _HTTP_TRACE_HEADER,
+}
+
+
+def _parse_content_length(content_header: Optional[str]) -> Optional[int]:
+    if content_header is None:
+        return None
+    content_length = None
+    try:
+        content_length = int(content_header)
+    except (ValueError, TypeError):
+        content_length = None
+    return content_length
+
+
+def _format_latency(latency_ns: int) -> str:
+    """Format nanoseconds as a Duration of the Cloud Logging API, such as ``0.012345678s``"""
+    seconds, nanos = divmod(latency_ns, 1_000_000_000)
+    return f"{seconds}.{nanos:09d}s"
+
+
+_UNPARSED = object()
+# guards log buffers of requests, as records may be handled on another thread,
+# such as the thread of a queue listener, while a request completes
+_LOG_BUFFERS_LOCK = threading.Lock()
 
 
-@dataclass
 class FastAPIRequestContext:
-    request_method: str
-    """HTTP Method Name"""
-    request_url: str
-    """HTTP Request URI"""
-    content_length: Optional[int]
-    """Size of the message body"""
-    user_agent: str
-    """User Agent"""
-    remote_ip: Optional[str]
-    """Remote IP Address"""
-    referer: Optional[str]
-    """HTTP Referer"""
-    protocol: str
-    """HTTP Protocol Scheme"""
-    cloud_trace_content: Optional[str]
-    """Cloud Trace Header"""
+    """
+    Request data for logging.
+
+    A context created by ``from_scope`` keeps the raw ASGI scope and parses each
+    value on first access only. Parsed values are memoized, so a request that
+    never logs anything does not pay for URL building or header decoding.
+    Attributes are slotted, as a context is created for every request.
+    """
+
+    __slots__ = (
+        "_scope",
+        "_root_path",
+        "_url",
+        "_headers",
+        "_http_request",
+        "_http_request_json",
+        "_trace_data",
+        "_trace_path",
+        "_log_buffers",
+        "completed",
+        "start_time_ns",
+        "_latency_ns",
+        "_status_code",
+        "_response_size",
+        "sampling_value",
+        "_request_method",
+        "_request_url",
+        "_content_length",
+        "_user_agent",
+        "_remote_ip",
+        "_referer",
+        "_protocol",
+        "_cloud_trace_content",
+    )
+
+    def __init__(
+        self,
+        request_method: str,
+        request_url: str,
+        content_length: Optional[int],
+        user_agent: str,
+        remote_ip: Optional[str],
+        referer: Optional[str],
+        protocol: str,
+        cloud_trace_content: Optional[str],
+    ):
+        self._scope: Optional[Scope] = None
+        # root path of the application, before mounts are added to the scope
+        self._root_path = ""
+        self._url: Optional[URL] = None
+        self._headers: Optional[Dict[str, str]] = None
+        self._http_request: Optional[Dict[str, Any]] = None
+        # httpRequest serialized by a JSON encoder, with the encoder
+        self._http_request_json: Optional[Tuple[Any, str]] = None
+        self._trace_data: Optional[Tuple[Optional[str], Optional[str], bool]] = None
+        self._trace_path: Optional[Tuple[str, str]] = None
+        self._log_buffers: Optional[Dict[Any, Any]] = None
+        self.completed = False
+        self.start_time_ns: Optional[int] = None
+        self._latency_ns: Optional[int] = None
+        self._status_code: Optional[int] = None
+        self._response_size: Optional[int] = None
+        # value from 0.0 to 1.0 compared with sampling rates of records
+        self.sampling_value: Optional[float] = None
+        self._request_method = request_method
+        self._request_url = request_url
+        self._content_length = content_length
+        self._user_agent = user_agent
+        self._remote_ip = remote_ip
+        self._referer = referer
+        self._protocol = protocol
+        self._cloud_trace_content = cloud_trace_content
+
+    @classmethod
+    def from_scope(cls, scope: Scope) -> "FastAPIRequestContext":
+        """Create a context whose values are lazily parsed from an ASGI scope."""
+        context = cls(*(_UNPARSED,) * 8)
+        context._scope = scope
+        context._root_path = scope.get("root_path", "")
+        return context
+
+    @property
+    def request_method(self) -> str:
+        """HTTP Method Name"""
+        if self._request_method is _UNPARSED:
+            self._request_method = self._scope["method"]
+        return self._request_method
+
+    @property
+    def request_url(self) -> str:
+        """HTTP Request URI"""
+        if self._request_url is _UNPARSED:
+            self._request_url = str(self._get_url())
+        return self._request_url
+
+    @property
+    def content_length(self) -> Optional[int]:
+        """Size of the message body"""
+        if self._content_length is _UNPARSED:
+            self._content_length = _parse_content_length(
+                self._get_headers().get(_HTTP_CONTENT_LENGTH)
+            )
+        return self._content_length
+
+    @property
+    def user_agent(self) -> str:
+        """User Agent"""
+        if self._user_agent is _UNPARSED:
+            self._user_agent = self._get_headers().get(_HTTP_USER_AGENT)
+        return self._user_agent
+
+    @property
+    def remote_ip(self) -> Optional[str]:
+        """Remote IP Address"""
+        if self._remote_ip is _UNPARSED:
+            remote_ip = self._get_headers().get(_HTTP_FORWARDED_FOR_HEADER)
+            if remote_ip is None:
+                client = self._scope.get("client")
+                remote_ip = client[0] if client else None
+            self._remote_ip = remote_ip
+        return self._remote_ip
+
+    @property
+    def referer(self) -> Optional[str]:
+        """HTTP Referer"""
+        if self._referer is _UNPARSED:
+            self._referer = self._get_headers().get(_HTTP_REFERER_HEADER)
+        return self._referer
+
+    @property
+    def protocol(self) -> str:
+        """HTTP Protocol Scheme"""
+        if self._protocol is _UNPARSED:
+            self._protocol = self._get_url().scheme
+        return self._protocol
+
+    @property
+    def cloud_trace_content(self) -> Optional[str]:
+        """Cloud Trace Header"""
+        if self._cloud_trace_content is _UNPARSED:
+            self._cloud_trace_content = self._get_headers().get(_HTTP_TRACE_HEADER)
+        return self._cloud_trace_content
+
+    @property
+    def route_template(self) -> Optional[str]:
+        """
+        Path template of the route matched by FastAPI, such as ``/users/{user_id}``.
+        A route of a mounted application is prefixed with its mount path.
+        """
+        if self._scope is None:
+            return None
+        path = getattr(self._scope.get("route"), "path", None)
+        if path is None:
+            return None
+        # the router of a mount appends the mount path to the root path of the scope
+        root_path = self._scope.get("root_path", "")
+        if root_path.startswith(self._root_path):
+            mount_start = len(self._root_path)
+            path = root_path[mount_start:] + path
+        return path
+
+    @property
+    def http_request(self) -> Dict[str, Any]:
+        """
+        httpRequest data for Cloud Logging.
+        It is built once and shared by every record of the request, so it must not be mutated.
+        """
+        if self._http_request is None:
+            http_request = {
+                "requestMethod": self.request_method,
+                "requestUrl": self.request_url,
+                "requestSize": self.content_length,
+                "userAgent": self.user_agent,
+                "remoteIp": self.remote_ip,
+                "referer": self.referer,
+                "protocol": self.protocol,
+            }
+            # response data is added as soon as the middleware knows it
+            if self._status_code is not None:
+                http_request["status"] = self._status_code
+            if self._response_size is not None:
+                http_request["responseSize"] = self._response_size
+            if self._latency_ns is not None:
+                http_request["latency"] = _format_latency(self._latency_ns)
+            self._http_request = http_request
+        return self._http_request
+
+    def get_http_request_json(self, json_encoder) -> str:
+        """``http_request`` serialized by a JSON encoder, once per request."""
+        http_request = self.http_request
+        cached = self._http_request_json
+        if cached is None or cached[0] is not json_encoder:
+            cached = self._http_request_json = (
+                json_encoder,
+                json_encoder.dumps(http_request),
+            )
+        return cached[1]
+
+    @property
+    def status_code(self) -> Optional[int]:
+        """HTTP status code of the response"""
+        return self._status_code
+
+    @status_code.setter
+    def status_code(self, value: Optional[int]) -> None:
+        self._status_code = value
+        self._http_request = None
+        self._http_request_json = None
+
+    @property
+    def response_size(self) -> Optional[int]:
+        """Size of the response body sent to the client"""
+        return self._response_size
+
+    @response_size.setter
+    def response_size(self, value: Optional[int]) -> None:
+        self._response_size = value
+        self._http_request = None
+        self._http_request_json = None
+
+    @property
+    def latency_ns(self) -> Optional[int]:
+        """Nanoseconds from the start of the request to the end of the response"""
+        return self._latency_ns
+
+    @latency_ns.setter
+    def latency_ns(self, value: Optional[int]) -> None:
+        self._latency_ns = value
+        self._http_request = None
+        self._http_request_json = None
+
+    @property
+    def trace_data(self) -> Tuple[Optional[str], Optional[str], bool]:
+        """Trace ID, span ID and sampled flag parsed from the Cloud Trace header"""
+        if self._trace_data is None:
+            self._trace_data = _parse_xcloud_trace(self.cloud_trace_content)
+        return self._trace_data
 
+    def get_trace_path(self, project: str) -> Optional[str]:
+        """Full resource path of the trace, such as ``projects/{project}/traces/{trace_id}``"""
+        trace_id = self.trace_data[0]
+        if trace_id is None:
+            return None
+        if self._trace_path is None or self._trace_path[0] != project:
+            self._trace_path = (project, f"projects/{project}/traces/{trace_id}")
+        return self._trace_path[1]
+
+    def get_log_buffer(self, owner, factory: Callable[[], Any] = list) -> Any:
+        """
+        Buffer of log records held for ``owner`` until the request completes,
+        created by ``factory`` on first use.
+        Returns None once the request has completed, so records are not held any more.
+        """
+        with _LOG_BUFFERS_LOCK:
+            if self.completed:
+                return None
+            if self._log_buffers is None:
+                self._log_buffers = {}
+            buffer = self._log_buffers.get(owner)
+            if buffer is None:
+                buffer = self._log_buffers[owner] = factory()
+            return buffer
+
+    def finish_timing(self) -> None:
+        """Measure the latency of the request, if it is not measured yet."""
+        if self.start_time_ns is not None and self._latency_ns is None:
+            self.latency_ns = time.perf_counter_ns() - self.start_time_ns
+
+    def complete(self) -> None:
+        """
+        Mark the request as completed, and hand every log buffer over to
+        ``complete_request`` of its owner.
+        """
+        self.finish_timing()
+        with _LOG_BUFFERS_LOCK:
+            self.completed = True
+            buffers, self._log_buffers = self._log_buffers, None
+        if buffers:
+            for owner, buffer in buffers.items():
+                owner.complete_request(self, buffer)
+
+    def _get_url(self) -> URL:
+        if self._url is None:
+            self._url = URL(scope=self._scope)
+        return self._url
+
+    def _get_headers(self) -> Dict[str, str]:
+        """
+        Decode the headers needed for logging in a single pass over the scope.
+        The first occurrence of a header wins, as with ``Request.headers.get``.
+        """
+        if self._headers is None:
+            headers = {}
+            for key, value in self._scope["headers"]:
+                name = _RAW_HEADER_NAMES.get(key)
+                if name is not None and name not in headers:
+                    headers[name] = value.decode("latin-1")
+            self._headers = headers
+        return self._headers
+
+    def _values(self) -> tuple:
+        return (
+            self.request_method,
+            self.request_url,
+            self.content_length,
+            self.user_agent,
+            self.remote_ip,
+            self.referer,
+            self.protocol,
+            self.cloud_trace_content,
+        )
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, FastAPIRequestContext):
+            return NotImplemented
+        return self._values() == other._values()
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(request_method={self.request_method!r}, "
+            f"request_url={self.request_url!r}, "
+            f"content_length={self.content_length!r}, "
+            f"user_agent={self.user_agent!r}, remote_ip={self.remote_ip!r}, "
+            f"referer={self.referer!r}, protocol={self.protocol!r}, "
+            f"cloud_trace_content={self.cloud_trace_content!r})"
+        )
+
+
+_ACCESS_LOGGER = logging.getLogger("fastapi_cloud_logging.access")
 
 _FASTAPI_REQUEST_CONTEXT: ContextVar[Optional[FastAPIRequestContext]] = ContextVar(
     "fastapi_request_context", default=None
 )
-_HTTP_CONTENT_LENGTH = "content-length"
-_HTTP_USER_AGENT = "user-agent"
-_HTTP_FORWARDED_FOR_HEADER = "x-forwarded-for"
-_HTTP_REFERER_HEADER = "referer"
-_HTTP_TRACE_HEADER = "x-cloud-trace-context"
+
+
+def _log_access(context: FastAPIRequestContext) -> None:
+    """Write an access log entry of a completed request."""
+    status_code = context.status_code
+    if status_code is None or status_code >= 500:
+        level = logging.ERROR
+    elif status_code >= 400:
+        level = logging.WARNING
+    else:
+        level = logging.INFO
+    if _ACCESS_LOGGER.isEnabledFor(level):
+        _ACCESS_LOGGER.log(
+            level,
+            "%s %s %s",
+            context.request_method,
+            context.request_url,
+            status_code,
+        )
+
+
+class ASGIRequestLoggingMiddleware:
+    """
+    Pure ASGI middleware that stores request data for logging in a context variable.
+
+    Unlike ``RequestLoggingMiddleware``, it does not build a ``Request`` object
+    nor run the application in a separate task, so streaming responses and
+    background tasks are passed through untouched.
+
+    The status, size and latency of the response are added to the httpRequest data
+    as they are known. The latency is measured until the last chunk of the body
+    is sent, without background tasks. With ``access_log``, an access log entry is written to the
+    ``fastapi_cloud_logging.access`` logger when the response completes, and with
+    ``latency_histograms``, the latency of every request is recorded in them.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        access_log: bool = False,
+        latency_histograms: Optional[RouteLatencyHistograms] = None,
+    ) -> None:
+        self.app = app
+        self.access_log = access_log
+        self.latency_histograms = latency_histograms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        context = FastAPIRequestContext.from_scope(scope)
+        context.start_time_ns = time.perf_counter_ns()
+        token = _FASTAPI_REQUEST_CONTEXT.set(context)
+        response_size = 0
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal response_size
+            if message["type"] == "http.response.start":
+                context.status_code = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+            # background tasks run after the last chunk, before the app returns
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                context.finish_timing()
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            context.response_size = response_size
+            context.finish_timing()
+            context.complete()
+            if self.access_log:
+                _log_access(context)
+            if self.latency_histograms is not None:
+                self.latency_histograms.record_request(context)
+            _FASTAPI_REQUEST_CONTEXT.reset(token)
 
 
 class RequestLoggingMiddleware(BaseHTTPMiddleware):
+    """
+    Middleware based on ``BaseHTTPMiddleware``, kept for compatibility.
+    ``ASGIRequestLoggingMiddleware`` is recommended for new applications.
+
+    The response size is taken from the Content-Length header of the response,
+    and the latency is measured until the response starts.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        dispatch=None,
+        access_log: bool = False,
+        latency_histograms: Optional[RouteLatencyHistograms] = None,
+    ) -> None:
+        super().__init__(app, dispatch=dispatch)
+        self.access_log = access_log
+        self.latency_histograms = latency_histograms
+
     async def dispatch(self, request: Request, call_next):
         self.set_request_context(request=request)
-        return await call_next(request)
+        context = _FASTAPI_REQUEST_CONTEXT.get()
+        if context is not None:
+            context.start_time_ns = time.perf_counter_ns()
+        try:
+            response = await call_next(request)
+            if context is not None:
+                context.status_code = response.status_code
+                context.response_size = _parse_content_length(
+                    response.headers.get(_HTTP_CONTENT_LENGTH)
+                )
+            return response
+        finally:
+            # records logged while the response body is streamed are not buffered
+            if context is not None:
+                context.finish_timing()
+                context.complete()
+                if self.access_log:
+                    _log_access(context)
+                if self.latency_histograms is not None:
+                    self.latency_histograms.record_request(context)
 
     def set_request_context(self, request: Request) -> None:
         _FASTAPI_REQUEST_CONTEXT.set(self._parse_request(request))
 
     def _parse_request(self, request: Request) -> FastAPIRequestContext:
-        return FastAPIRequestContext(
-            request_method=request.method,
-            request_url=str(request.url),
-            content_length=self._parse_content_length(
-                request.headers.get(_HTTP_CONTENT_LENGTH)
-            ),
-            user_agent=request.headers.get(_HTTP_USER_AGENT),
-            remote_ip=request.headers.get(
-                _HTTP_FORWARDED_FOR_HEADER, request.client.host
-            ),
-            referer=request.headers.get(_HTTP_REFERER_HEADER),
-            protocol=request.url.scheme,
-            cloud_trace_content=request.headers.get(_HTTP_TRACE_HEADER),
-        )
+        return FastAPIRequestContext.from_scope(request.scope)
 
     def _parse_content_length(self, content_header: Optional[str]) -> Optional[int]:
-        if content_header is None:
-            return None
-        content_length = None
-        try:
-            content_length = int(content_header)
-        except (ValueError, TypeError):
-            content_length = None
-        return content_length
+        return _parse_content_length(content_header)
@@ -0,0 +1,103 @@
+import logging
+import random
+import zlib
+from typing import Dict, Optional, Tuple
+
+from .request_logging_middleware import _FASTAPI_REQUEST_CONTEXT
+
+
+def _validate_rate(rate: float) -> float:
+    if not 0.0 <= rate <= 1.0:
+        raise ValueError(f"Sampling rate must be between 0.0 and 1.0: {rate}")
+    return rate
+
+
+class TraceSamplingFilter(logging.Filter):
+    """
+    Filter that samples the records of requests, deciding once per request.
+
+    A request whose ``X-Cloud-Trace-Context`` header has the sampled flag keeps every
+    record. Otherwise, the trace ID is hashed into a value from 0.0 to 1.0, and a record
+    is kept if the value is below its sampling rate. As the value only depends on the
+    trace ID, the services handling the same trace keep or drop their records together,
+    and a request without a trace ID gets a random value.
+
+    The sampling rate of a record is the rate of the highest level in ``level_rates``
+    not above the level of the record, or else the rate of its logger, or its nearest
+    parent, in ``logger_rates``, or else ``rate``. Records logged outside of a request
+    are always kept.
+    """
+
+    def __init__(
+        self,
+        rate: float = 1.0,
+        *,
+        logger_rates: Optional[Dict[str, float]] = None,
+        level_rates: Optional[Dict[int, float]] = None,
+        use_sampled_flag: bool = True,
+    ):
+        """
+        Args:
+            rate (float): The default sampling rate, from 0.0 to 1.0.
+            logger_rates (Optional[Dict[str, float]]): Sampling rates by logger name,
+                which also apply to the child loggers.
+            level_rates (Optional[Dict[int, float]]): Sampling rates by level,
+                such as ``{logging.WARNING: 1.0}`` to keep every warning and error.
+            use_sampled_flag (bool): Keep every record of a request with the sampled
+                flag of Cloud Trace. Defaults to True.
+        """
+        super().__init__()
+        self.rate = _validate_rate(rate)
+        self.logger_rates = {
+            name: _validate_rate(value) for name, value in (logger_rates or {}).items()
+        }
+        self.level_rates = sorted(
+            (
+                (level, _validate_rate(value))
+                for level, value in (level_rates or {}).items()
+            ),
+            reverse=True,
+        )
+        self.use_sampled_flag = use_sampled_flag
+        self._rates: Dict[Tuple[str, int], float] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        request = _FASTAPI_REQUEST_CONTEXT.get()
+        if request is None:
+            return True
+        if self.use_sampled_flag and request.trace_data[2]:
+            return True
+        return self._get_sampling_value(request) < self.get_rate(
+            record.name, record.levelno
+        )
+
+    def get_rate(self, name: str, level: int) -> float:
+        """Sampling rate of records of a logger and a level."""
+        key = (name, level)
+        rate = self._rates.get(key)
+        if rate is None:
+            rate = self._rates[key] = self._resolve_rate(name, level)
+        return rate
+
+    def _resolve_rate(self, name: str, level: int) -> float:
+        for rule_level, rate in self.level_rates:
+            if level >= rule_level:
+                return rate
+        while name:
+            rate = self.logger_rates.get(name)
+            if rate is not None:
+                return rate
+            name = name.rpartition(".")[0]
+        return self.rate
+
+    @staticmethod
+    def _get_sampling_value(request) -> float:
+        value = request.sampling_value
+        if value is None:
+            trace_id = request.trace_data[0]
+            if trace_id is None:
+                value = random.random()
+            else:
+                value = zlib.crc32(trace_id.encode("utf-8")) / 0x100000000
+            request.sampling_value = value
+        return value
@@ -0,0 +1,132 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from fastapi import APIRouter
+
+
+class _ThreadCounters:
+    """Counters updated by a single thread, so they need no lock."""
+
+    __slots__ = (
+        "records",
+        "filter_ns",
+        "sanitize_ns",
+        "enqueue_ns",
+        "batches",
+        "batch_entries",
+        "max_batch_size",
+        "flush_ns",
+        "max_flush_ns",
+        "api_errors",
+    )
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+
+class HandlerStats:
+    """
+    Low-overhead counters of the time spent by a logging handler.
+
+    Times are measured with ``time.perf_counter_ns`` and accumulated per thread,
+    so recording them takes no lock. ``as_dict`` sums the counters of all threads.
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        self._threads: List[_ThreadCounters] = []
+        self._lock = threading.Lock()
+        self._started = time.monotonic()
+        # set by a transport which can report the depth of its queue
+        self.queue_depth: Optional[Callable[[], int]] = None
+
+    def _counters(self) -> _ThreadCounters:
+        counters = getattr(self._local, "counters", None)
+        if counters is None:
+            counters = self._local.counters = _ThreadCounters()
+            with self._lock:
+                self._threads.append(counters)
+        return counters
+
+    def record_filter(self, elapsed_ns: int) -> None:
+        counters = self._counters()
+        counters.records += 1
+        counters.filter_ns += elapsed_ns
+
+    def record_sanitize(self, elapsed_ns: int) -> None:
+        self._counters().sanitize_ns += elapsed_ns
+
+    def record_enqueue(self, elapsed_ns: int) -> None:
+        self._counters().enqueue_ns += elapsed_ns
+
+    def record_batch(self, size: int, elapsed_ns: int, failed: bool = False) -> None:
+        counters = self._counters()
+        counters.batches += 1
+        counters.batch_entries += size
+        counters.max_batch_size = max(counters.max_batch_size, size)
+        counters.flush_ns += elapsed_ns
+        counters.max_flush_ns = max(counters.max_flush_ns, elapsed_ns)
+        if failed:
+            counters.api_errors += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: The number of records and records per second, the total time in
+            nanoseconds of filtering, sanitizing extras and enqueueing records,
+            the queue depth, the number and sizes of written batches, the total and
+            maximum time in nanoseconds to write a batch, and the number of failed
+            API calls.
+        """
+        with self._lock:
+            threads = list(self._threads)
+        totals = {name: 0 for name in _ThreadCounters.__slots__}
+        for counters in threads:
+            for name in _ThreadCounters.__slots__:
+                value = getattr(counters, name)
+                if name.startswith("max_"):
+                    totals[name] = max(totals[name], value)
+                else:
+                    totals[name] += value
+
+        elapsed = time.monotonic() - self._started
+        records = totals["records"]
+        batches = totals["batches"]
+        return {
+            "records": records,
+            "records_per_second": records / elapsed if elapsed > 0 else 0.0,
+            "filter_ns": totals["filter_ns"],
+            "sanitize_ns": totals["sanitize_ns"],
+            "enqueue_ns": totals["enqueue_ns"],
+            "mean_filter_ns": totals["filter_ns"] / records if records else 0.0,
+            "mean_enqueue_ns": totals["enqueue_ns"] / records if records else 0.0,
+            "queue_depth": self.queue_depth() if self.queue_depth else None,
+            "batches": batches,
+            "mean_batch_size": totals["batch_entries"] / batches if batches else 0.0,
+            "max_batch_size": totals["max_batch_size"],
+            "flush_ns": totals["flush_ns"],
+            "max_flush_ns": totals["max_flush_ns"],
+            "api_errors": totals["api_errors"],
+        }
+
+
+def create_stats_router(handler, path: str = "/logging/stats") -> APIRouter:
+    """
+    Create a FastAPI router which returns the stats of a handler as JSON.
+
+    Args:
+        handler (FastAPILoggingHandler): A handler created with ``collect_stats=True``.
+        path (str): The path of the endpoint.
+    """
+    if handler.stats is None:
+        raise ValueError("The handler is not created with collect_stats=True")
+
+    router = APIRouter()
+
+    @router.get(path, include_in_schema=False)
+    def get_logging_stats() -> Dict[str, Any]:
+        return handler.stats.as_dict()
+
+    return router
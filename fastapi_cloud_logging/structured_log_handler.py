@@ -0,0 +1,126 @@
+import collections.abc
+import logging
+import math
+import sys
+
+from google.cloud.logging_v2.handlers.structured_log import (
+    GCP_STRUCTURED_LOGGING_FIELDS,
+)
+
+from .fastapi_cloud_logging_handler import (
+    FastAPILoggingFilter,
+    _format_and_parse_message,
+)
+
+
+class FastAPIStructuredLogHandler(logging.StreamHandler):
+    """
+    This LoggingHandler writes logs of FastAPI in the structured logging format
+    of Cloud Logging, one JSON line per record, to standard output by default.
+
+    On Cloud Run and GKE, the logging agent ingests the lines from standard output,
+    so it needs neither a Cloud Logging client, the network, nor a background thread.
+    Request and trace data are added by ``FastAPILoggingFilter`` as with
+    ``FastAPILoggingHandler``.
+    """
+
+    def __init__(
+        self,
+        *,
+        labels=None,
+        stream=None,
+        project_id=None,
+        structured: bool = False,
+        traceback_length: int = 100,
+        json_encoder=None,
+        error_fingerprint: bool = False,
+        max_payload_size=None,
+    ):
+        """
+        Args:
+            labels (Optional[dict]): Additional labels to attach to logs.
+            stream (Optional[IO]): Stream to be used by the handler.
+                Defaults to ``sys.stdout``.
+            project_id (Optional[str]): Project ID to write the full path of traces.
+            structured (bool): Treat every message as structured message.
+            traceback_length (int): Maximum number of traceback entries of an error.
+            json_encoder (Optional[Union[str, JSONEncoder]]): JSON encoder of lines,
+                "json" or "orjson". Defaults to orjson when it is installed.
+            error_fingerprint (bool): Add ``error_fingerprint``, a stable hash of
+                the type and the frames of an error, to records with an error.
+            max_payload_size (Optional[int]): Truncate long strings and collections
+                of the message and ``json_fields`` of a record, so that their size
+                estimated in characters fits in it. Defaults to no limit.
+        """
+        super().__init__(stream=stream or sys.stdout)
+        self.project_id = project_id
+
+        log_filter = FastAPILoggingFilter(
+            project=project_id,
+            default_labels=labels,
+            structured=structured,
+            traceback_length=traceback_length,
+            json_encoder=json_encoder,
+            string_fields=False,
+            error_fingerprint=error_fingerprint,
+            max_payload_size=max_payload_size,
+        )
+        self.json_encoder = log_filter.json_encoder
+        self.addFilter(log_filter)
+
+    def format(self, record):
+        """
+        Format a record into a JSON line of the structured logging format.
+
+        Args:
+            record (logging.LogRecord): The log record.
+        Returns:
+            str: A JSON string formatted for GCP structured logging.
+        """
+        message = _format_and_parse_message(record, super(), self.json_encoder)
+
+        if isinstance(message, collections.abc.Mapping):
+            # special fields of a message would overwrite the fields of the record
+            entry = {
+                key: value
+                for key, value in message.items()
+                if key not in GCP_STRUCTURED_LOGGING_FIELDS
+            }
+        elif message:
+            entry = {"message": message}
+        else:
+            entry = {}
+
+        nanos, seconds = math.modf(record.created)
+        entry["severity"] = record.levelname
+        entry["timestampSeconds"] = int(seconds)
+        entry["timestampNanos"] = int(nanos * 1e9)
+        if record._labels:
+            entry["logging.googleapis.com/labels"] = record._labels
+        if record._trace is not None:
+            entry["logging.googleapis.com/trace"] = record._trace
+        if record._span_id is not None:
+            entry["logging.googleapis.com/spanId"] = record._span_id
+        if record._trace_sampled:
+            entry["logging.googleapis.com/trace_sampled"] = True
+        if record._source_location:
+            entry["logging.googleapis.com/sourceLocation"] = record._source_location
+        if record._http_request:
+            entry["httpRequest"] = record._http_request
+
+        # remove exception info to avoid duplicating it
+        record.exc_info = None
+        record.exc_text = None
+        return self.json_encoder.dumps(entry)
+
+    def emit(self, record):
+        """Write a record as a line in a single write call."""
+        try:
+            line = self.format(record) + self.terminator
+            stream = self.stream
+            stream.write(line)
+            stream.flush()
+        except RecursionError:  # See issue 36272
+            raise
+        except Exception:
+            self.handleError(record)
@@ -0,0 +1,79 @@
+import collections
+import hashlib
+import threading
+import traceback
+from types import TracebackType
+from typing import List, Optional, Tuple
+
+_MAX_CACHED_TRACEBACKS = 256
+
+
+class _TracebackCache:
+    """
+    LRU cache of formatted tracebacks, keyed by the code and the instruction
+    of each frame, so an error raised again at the same place is formatted once.
+    """
+
+    def __init__(self, maxsize: int = _MAX_CACHED_TRACEBACKS):
+        self.maxsize = maxsize
+        self._entries: "collections.OrderedDict[tuple, Tuple[str, ...]]" = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def get(self, key: tuple) -> Optional[Tuple[str, ...]]:
+        with self._lock:
+            formatted = self._entries.get(key)
+            if formatted is not None:
+                self._entries.move_to_end(key)
+            return formatted
+
+    def put(self, key: tuple, formatted: Tuple[str, ...]) -> None:
+        with self._lock:
+            self._entries[key] = formatted
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_CACHE = _TracebackCache()
+
+
+def format_traceback(tb: Optional[TracebackType], limit: int) -> List[str]:
+    """
+    Same as ``traceback.format_tb(tb)[:limit]``, except that only the first
+    ``limit`` frames are walked and formatted, and formatted tracebacks are cached.
+    """
+    key = []
+    frame = tb
+    while frame is not None and len(key) < limit:
+        # the instruction gives both the line and the position of the error
+        key.append((frame.tb_frame.f_code, frame.tb_lasti))
+        frame = frame.tb_next
+    key = tuple(key)
+    formatted = _CACHE.get(key)
+    if formatted is None:
+        formatted = tuple(traceback.format_tb(tb, limit=limit))
+        _CACHE.put(key, formatted)
+    return list(formatted)
+
+
+def exception_fingerprint(error_type: type, tb: Optional[TracebackType]) -> str:
+    """
+    Stable fingerprint of an error, from its type and the file, function and line
+    of every frame of its traceback. It is the same across processes and restarts,
+    as long as the code does not change.
+    """
+    parts = [f"{error_type.__module__}.{error_type.__qualname__}"]
+    while tb is not None:
+        code = tb.tb_frame.f_code
+        parts.append(f"{code.co_filename}:{code.co_name}:{tb.tb_lineno}")
+        tb = tb.tb_next
+    return hashlib.blake2b("\n".join(parts).encode("utf-8"), digest_size=8).hexdigest()
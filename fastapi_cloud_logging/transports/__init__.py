@@ -0,0 +1,16 @@
+from .async_batch import AsyncBatchTransport
+from .bounded import BoundedBackgroundThreadTransport, OverflowPolicy
+from .resilient import CircuitState, ResilientBackgroundThreadTransport
+from .shipper import LogShipper, UnixSocketTransport
+from .sync_batch import SyncBatchTransport
+
+__all__ = [
+    "AsyncBatchTransport",
+    "BoundedBackgroundThreadTransport",
+    "CircuitState",
+    "LogShipper",
+    "OverflowPolicy",
+    "ResilientBackgroundThreadTransport",
+    "SyncBatchTransport",
+    "UnixSocketTransport",
+]
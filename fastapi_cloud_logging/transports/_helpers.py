@@ -0,0 +1,168 @@
+import datetime
+import struct
+import sys
+import time
+import traceback
+from typing import List, Optional, Tuple
+
+from google.cloud.logging_v2 import _helpers
+from google.cloud.logging_v2.logger import Batch
+from google.cloud.logging_v2.resource import Resource
+
+# length prefix of an encoded entry
+_FRAME_HEADER = struct.Struct("!I")
+
+
+def batch_resource(cloud_logger) -> Optional[Resource]:
+    """
+    The default resource of a logger, when it can be written once per batch
+    instead of in every entry.
+    """
+    resource = cloud_logger.default_resource
+    return resource if isinstance(resource, Resource) else None
+
+
+def build_entry(
+    record, message, shared_resource: Optional[Resource] = None, **kwargs
+) -> dict:
+    """
+    Build keyword arguments of ``Batch.log`` for a log record,
+    in the same way as ``BackgroundThreadTransport`` of Cloud Logging.
+    The ``labels`` argument is copied before adding the logger name.
+    The ``resource`` argument is set to None when it is ``shared_resource``,
+    which is written in the batch instead.
+    """
+    if shared_resource is not None:
+        resource = kwargs.get("resource")
+        if resource is shared_resource or resource == shared_resource:
+            kwargs["resource"] = None
+    labels = kwargs.pop("labels", None) or {}
+    if record.name and "python_logger" not in labels:
+        labels = {**labels, "python_logger": record.name}
+    entry = {
+        "message": message,
+        "severity": _helpers._normalize_severity(record.levelno),
+        "timestamp": datetime.datetime.fromtimestamp(
+            record.created, datetime.timezone.utc
+        ),
+        "labels": labels,
+    }
+    entry.update(kwargs)
+    return entry
+
+
+def commit_entries(cloud_logger, entries) -> bool:
+    """
+    Write entries in a single API call, with the default resource of the logger
+    for the entries without their own resource.
+    A failure is reported on stderr instead of logging, not to recurse into the handler.
+    """
+    if not entries:
+        return True
+    batch = Batch(
+        cloud_logger, cloud_logger.client, resource=batch_resource(cloud_logger)
+    )
+    for entry in entries:
+        batch.log(**entry)
+    try:
+        batch.commit()
+    except Exception:
+        print(f"Failed to submit {len(entries)} logs.", file=sys.stderr)
+        traceback.print_exc(file=sys.stderr)
+        return False
+    return True
+
+
+def commit_in_batches(cloud_logger, entries, batch_size: int, stats=None) -> None:
+    """
+    Write entries with ``commit_entries`` in API calls of up to ``batch_size``
+    entries, and record each call in ``stats`` of a handler if given.
+    """
+    for start in range(0, len(entries), batch_size):
+        end = start + batch_size
+        batch = entries[start:end]
+        if stats is None:
+            commit_entries(cloud_logger, batch)
+            continue
+        commit_start = time.perf_counter_ns()
+        succeeded = commit_entries(cloud_logger, batch)
+        stats.record_batch(
+            len(batch), time.perf_counter_ns() - commit_start, failed=not succeeded
+        )
+
+
+def encode_frame(payload: bytes) -> bytes:
+    """Prefix a payload with its length, to be split again by ``split_frames``."""
+    return _FRAME_HEADER.pack(len(payload)) + payload
+
+
+def frame_length(buffer, offset: int = 0) -> Optional[int]:
+    """The length of the payload of the frame at ``offset``, if its header is complete."""
+    if len(buffer) - offset < _FRAME_HEADER.size:
+        return None
+    return _FRAME_HEADER.unpack_from(buffer, offset)[0]
+
+
+def split_frames(
+    buffer, offset: int = 0, max_frames: Optional[int] = None
+) -> Tuple[List[bytes], int]:
+    """
+    Split the complete frames of a buffer from ``offset``, up to ``max_frames``.
+
+    Returns:
+        Tuple[List[bytes], int]: The payloads, and the offset after their frames.
+    """
+    payloads = []
+    header_size = _FRAME_HEADER.size
+    while len(buffer) - offset >= header_size:
+        if max_frames is not None and len(payloads) >= max_frames:
+            break
+        (length,) = _FRAME_HEADER.unpack_from(buffer, offset)
+        start = offset + header_size
+        end = start + length
+        if len(buffer) < end:
+            break
+        payloads.append(bytes(buffer[start:end]))
+        offset = end
+    return payloads, offset
+
+
+def encode_entry(entry: dict, json_encoder) -> bytes:
+    """
+    Encode an entry built by ``build_entry`` into a length-prefixed JSON frame,
+    to be decoded by ``decode_entries`` in another process.
+    """
+    fields = dict(entry)
+    timestamp = fields.get("timestamp")
+    if timestamp is not None:
+        fields["timestamp"] = timestamp.isoformat()
+    resource = fields.get("resource")
+    if isinstance(resource, Resource):
+        fields["resource"] = resource._to_dict()
+    return encode_frame(json_encoder.dumps(fields).encode("utf-8"))
+
+
+def decode_entries(buffer: bytearray, json_encoder) -> Tuple[List[dict], int]:
+    """
+    Decode the complete frames at the start of a buffer.
+
+    Returns:
+        Tuple[List[dict], int]: The entries, and the number of bytes they took,
+        to be removed from the buffer. A frame which is not valid JSON is skipped.
+    """
+    payloads, offset = split_frames(buffer)
+    entries = []
+    for payload in payloads:
+        try:
+            fields = json_encoder.loads(payload)
+        except ValueError:
+            print("Failed to decode a log entry.", file=sys.stderr)
+            continue
+        timestamp = fields.get("timestamp")
+        if timestamp is not None:
+            fields["timestamp"] = datetime.datetime.fromisoformat(timestamp)
+        resource = fields.get("resource")
+        if resource is not None:
+            fields["resource"] = Resource._from_dict(resource)
+        entries.append(fields)
+    return entries, offset
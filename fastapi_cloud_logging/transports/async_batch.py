@@ -0,0 +1,246 @@
+import asyncio
+import collections
+from typing import Any, Deque, Iterable, List, Optional, Tuple
+
+from google.cloud.logging_v2.handlers.transports.base import Transport
+from google.cloud.logging_v2.logger import _GLOBAL_RESOURCE
+
+from ..stats import HandlerStats
+from ._helpers import batch_resource, build_entry, commit_in_batches
+
+_DEFAULT_MAX_BATCH_SIZE = 100
+_DEFAULT_MAX_LATENCY = 0.5  # Seconds
+# queued to write a batch without waiting for max_latency
+_FLUSH_MARKER = object()
+
+
+class AsyncBatchTransport(Transport):
+    """
+    Asynchronous transport that batches entries on the running event loop.
+
+    Entries are put on an ``asyncio.Queue``, and a task on the loop writes them in
+    a batch when ``batch_size`` entries are queued or ``max_latency`` seconds have
+    passed since the first entry of the batch. There is no worker thread nor
+    lock-protected queue. Only the blocking API call of each batch runs in the default
+    executor of the loop.
+
+    Entries sent while no loop is running are kept until a loop starts,
+    or until ``flush`` is called. Call ``aclose`` on shutdown to drain the queue,
+    for example with ``register_shutdown``.
+    """
+
+    def __init__(
+        self,
+        client,
+        name,
+        *,
+        batch_size: int = _DEFAULT_MAX_BATCH_SIZE,
+        max_latency: float = _DEFAULT_MAX_LATENCY,
+        resource=_GLOBAL_RESOURCE,
+        **kwargs,
+    ):
+        """
+        Args:
+            client (~logging_v2.client.Client):
+                The Logging client.
+            name (str): The name of the logger.
+            batch_size (int): The maximum number of entries to write at a time.
+            max_latency (float): The maximum number of seconds to hold entries
+                before writing them.
+            resource (Optional[Resource|dict]): The default monitored resource to associate
+                with logs when not specified
+        """
+        self.client = client
+        self.logger = client.logger(name, resource=resource)
+        self._shared_resource = batch_resource(self.logger)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        # entries sent while no loop is running
+        self._pending: Deque[dict] = collections.deque()
+        self.handler_stats: Optional[HandlerStats] = None
+
+    def send(self, record, message, **kwargs):
+        """Overrides Transport.send().
+
+        Args:
+            record (logging.LogRecord): Python log record that the handler was called with.
+            message (str or dict): The message from the ``LogRecord`` after being
+                formatted by the associated log formatters.
+            kwargs: Additional optional arguments for the logger
+        """
+        entry = build_entry(
+            record, message, shared_resource=self._shared_resource, **kwargs
+        )
+        self._put_many((entry,))
+
+    def send_batch(self, items: Iterable[Tuple[Any, Any, dict]]):
+        """
+        Queue log entries at once.
+
+        Args:
+            items (Iterable[Tuple[logging.LogRecord, Any, dict]]): Records, messages
+                and additional arguments, the same as those of ``send``.
+        """
+        self._put_many(
+            [
+                build_entry(
+                    record, message, shared_resource=self._shared_resource, **kwargs
+                )
+                for record, message, kwargs in items
+            ]
+        )
+
+    def _put_many(self, entries: Iterable[dict]) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            loop = None
+
+        if loop is not None:
+            if loop is not self._loop:
+                self._start(loop)
+            self._put_nowait_many(entries)
+        elif self._is_running():
+            # called from another thread
+            self._loop.call_soon_threadsafe(self._put_nowait_many, entries)
+        else:
+            self._pending.extend(entries)
+
+    def _put_nowait_many(self, entries: Iterable[dict]) -> None:
+        put_nowait = self._queue.put_nowait
+        for entry in entries:
+            put_nowait(entry)
+
+    def _is_running(self) -> bool:
+        return self._loop is not None and self._loop.is_running()
+
+    def _start(self, loop: asyncio.AbstractEventLoop) -> None:
+        if self._queue is not None:
+            # keep entries left by a loop which has stopped
+            while not self._queue.empty():
+                entry = self._queue.get_nowait()
+                if entry is not _FLUSH_MARKER:
+                    self._pending.append(entry)
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        while self._pending:
+            self._queue.put_nowait(self._pending.popleft())
+        self._task = loop.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        queue = self._queue
+        entries: List[dict] = []
+        try:
+            while True:
+                entry = await queue.get()
+                if entry is _FLUSH_MARKER:
+                    queue.task_done()
+                    continue
+                entries.append(entry)
+                deadline = loop.time() + self.max_latency
+                while len(entries) < self.batch_size:
+                    if not queue.empty():
+                        entry = queue.get_nowait()
+                    else:
+                        timeout = deadline - loop.time()
+                        if timeout <= 0:
+                            break
+                        try:
+                            entry = await asyncio.wait_for(queue.get(), timeout)
+                        except asyncio.TimeoutError:
+                            break
+                    if entry is _FLUSH_MARKER:
+                        queue.task_done()
+                        break
+                    entries.append(entry)
+
+                # a batch being written is not written again on cancellation
+                batch, entries = entries, []
+                await loop.run_in_executor(
+                    None,
+                    commit_in_batches,
+                    self.logger,
+                    batch,
+                    self.batch_size,
+                    self.handler_stats,
+                )
+                for _ in batch:
+                    queue.task_done()
+        except asyncio.CancelledError:
+            # the loop is shutting down, so write what is left before exiting
+            while not queue.empty():
+                entries.append(queue.get_nowait())
+            commit_in_batches(
+                self.logger,
+                [entry for entry in entries if entry is not _FLUSH_MARKER],
+                self.batch_size,
+                self.handler_stats,
+            )
+            raise
+
+    def set_handler_stats(self, stats: HandlerStats) -> None:
+        """Report the queue depth and written batches to the stats of a handler."""
+        self.handler_stats = stats
+        stats.queue_depth = self._queue_depth
+
+    def _queue_depth(self) -> int:
+        queued = self._queue.qsize() if self._queue is not None else 0
+        return queued + len(self._pending)
+
+    async def drain(self) -> None:
+        """Write queued entries without waiting for ``max_latency``, and wait until done."""
+        if self._queue is None or asyncio.get_running_loop() is not self._loop:
+            self.flush()
+            return
+        self._queue.put_nowait(_FLUSH_MARKER)
+        await self._queue.join()
+
+    async def aclose(self) -> None:
+        """Write every queued entry and stop the task of the event loop."""
+        await self.drain()
+        task, self._task = self._task, None
+        if task is not None and asyncio.get_running_loop() is self._loop:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._loop = None
+        self._queue = None
+
+    def register_shutdown(self, app) -> None:
+        """Drain the queue on shutdown of a FastAPI application."""
+        app.add_event_handler("shutdown", self.aclose)
+
+    def flush(self):
+        """
+        Submit any pending log records.
+
+        When the event loop is running in another thread, it blocks until the queue is
+        drained. On the thread of the running loop, it cannot block, and only makes the
+        task write the queued entries without waiting for ``max_latency``.
+        """
+        if self._is_running():
+            try:
+                running_loop = asyncio.get_running_loop()
+            except RuntimeError:
+                running_loop = None
+            if running_loop is self._loop:
+                self._queue.put_nowait(_FLUSH_MARKER)
+            else:
+                asyncio.run_coroutine_threadsafe(self.drain(), self._loop).result()
+            return
+
+        entries = list(self._pending)
+        self._pending.clear()
+        if self._queue is not None:
+            while not self._queue.empty():
+                entry = self._queue.get_nowait()
+                self._queue.task_done()
+                if entry is not _FLUSH_MARKER:
+                    entries.append(entry)
+        commit_in_batches(self.logger, entries, self.batch_size, self.handler_stats)
@@ -0,0 +1,393 @@
+import collections
+import queue
+import sys
+import time
+import traceback
+from enum import Enum
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from google.cloud.logging_v2.handlers.transports import BackgroundThreadTransport
+from google.cloud.logging_v2.handlers.transports.background_thread import (
+    _DEFAULT_GRACE_PERIOD,
+    _DEFAULT_MAX_BATCH_SIZE,
+    _DEFAULT_MAX_LATENCY,
+    _Worker,
+)
+from google.cloud.logging_v2.logger import _GLOBAL_RESOURCE
+
+from ..stats import HandlerStats
+from ..utils import estimate_json_size
+from ._helpers import batch_resource, build_entry
+
+_WARNING_SEVERITY = 400
+# rough size of the fields of an entry other than its payload
+_ENTRY_OVERHEAD_BYTES = 256
+
+
+class OverflowPolicy(str, Enum):
+    """What to do with an entry when the queue of a transport is full."""
+
+    BLOCK = "block"
+    """Block the caller until the queue has room, or until ``block_timeout``"""
+    DROP_NEWEST = "drop_newest"
+    """Drop the new entry"""
+    DROP_OLDEST = "drop_oldest"
+    """Drop the oldest queued entries to make room"""
+    DROP_BELOW_WARNING = "drop_below_warning"
+    """
+    Drop a new entry below WARNING. A new entry of WARNING or above drops
+    the oldest queued entries below WARNING, or the oldest entries if there are none.
+    """
+
+
+# names of LogSeverity of Cloud Logging
+_SEVERITY_NAMES = {
+    0: "DEFAULT",
+    100: "DEBUG",
+    200: "INFO",
+    300: "NOTICE",
+    400: "WARNING",
+    500: "ERROR",
+    600: "CRITICAL",
+    700: "ALERT",
+    800: "EMERGENCY",
+}
+
+
+def _severity_name(severity: int) -> str:
+    return _SEVERITY_NAMES.get(severity) or str(severity)
+
+
+class _BoundedQueue(queue.Queue):
+    """
+    Queue of log entries bounded by the number of entries and their estimated size.
+    ``offer`` applies the overflow policy, while the worker uses the usual queue API.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        block_timeout: Optional[float] = None,
+    ):
+        super().__init__(0)
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.overflow_policy = OverflowPolicy(overflow_policy)
+        self.block_timeout = block_timeout
+        self.dropped_entries = 0
+        self.dropped_by_severity: Dict[str, int] = collections.Counter()
+
+    def _init(self, maxsize):
+        self.queue = collections.deque()
+        self.sizes = collections.deque()
+        self.queued_bytes = 0
+
+    def _put(self, item):
+        self._put_sized(item, 0)
+
+    def _put_sized(self, item, size: int):
+        self.queue.append(item)
+        self.sizes.append(size)
+        self.queued_bytes += size
+
+    def _get(self):
+        self.queued_bytes -= self.sizes.popleft()
+        return self.queue.popleft()
+
+    def _has_room(self, size: int) -> bool:
+        if self.max_entries is not None and len(self.queue) >= self.max_entries:
+            return False
+        if self.max_bytes is not None and self.queued_bytes + size > self.max_bytes:
+            return False
+        return True
+
+    def _record_drop(self, entry: dict) -> None:
+        self.dropped_entries += 1
+        self.dropped_by_severity[_severity_name(entry.get("severity", 0))] += 1
+
+    def _evict(self, index: int) -> None:
+        entry = self.queue[index]
+        del self.queue[index]
+        self.queued_bytes -= self.sizes[index]
+        del self.sizes[index]
+        self._record_drop(entry)
+        # the evicted entry will never be marked as done by the worker
+        self.unfinished_tasks -= 1
+        if self.unfinished_tasks == 0:
+            self.all_tasks_done.notify_all()
+
+    def _evict_oldest(self, size: int, below_severity: Optional[int] = None) -> bool:
+        index = 0
+        while not self._has_room(size) and index < len(self.queue):
+            entry = self.queue[index]
+            if not isinstance(entry, dict) or (
+                below_severity is not None
+                and entry.get("severity", 0) >= below_severity
+            ):
+                # keep the stop signal of the worker and entries to keep
+                index += 1
+                continue
+            self._evict(index)
+        return self._has_room(size)
+
+    def _make_room(self, entry: dict, size: int) -> bool:
+        policy = self.overflow_policy
+        if policy is OverflowPolicy.BLOCK:
+            deadline = (
+                None
+                if self.block_timeout is None
+                else time.monotonic() + self.block_timeout
+            )
+            while not self._has_room(size):
+                if deadline is None:
+                    self.not_full.wait()
+                    continue
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self.not_full.wait(remaining)
+            return True
+        if policy is OverflowPolicy.DROP_OLDEST:
+            return self._evict_oldest(size)
+        if policy is OverflowPolicy.DROP_BELOW_WARNING:
+            if entry.get("severity", 0) < _WARNING_SEVERITY:
+                return False
+            return self._evict_oldest(
+                size, below_severity=_WARNING_SEVERITY
+            ) or self._evict_oldest(size)
+        return False
+
+    def _estimate_size(self, entry: dict) -> int:
+        if self.max_bytes is None:
+            return 0
+        return estimate_json_size(entry.get("message")) + _ENTRY_OVERHEAD_BYTES
+
+    def _offer_locked(self, entry: dict, size: int) -> bool:
+        if self.max_bytes is not None and size > self.max_bytes:
+            # it never fits in the queue
+            self._record_drop(entry)
+            return False
+        if not self._has_room(size) and not self._make_room(entry, size):
+            self._record_drop(entry)
+            return False
+        self._put_sized(entry, size)
+        self.unfinished_tasks += 1
+        self.not_empty.notify()
+        return True
+
+    def offer(self, entry: dict) -> bool:
+        """
+        Queue an entry, applying the overflow policy when the queue is full.
+
+        Returns:
+            bool: False if the entry is dropped.
+        """
+        size = self._estimate_size(entry)
+        with self.not_full:
+            return self._offer_locked(entry, size)
+
+    def offer_many(self, entries: List[dict]) -> int:
+        """
+        Queue entries in order under a single acquisition of the lock,
+        applying the overflow policy to each of them.
+
+        Returns:
+            int: The number of queued entries.
+        """
+        sizes = [self._estimate_size(entry) for entry in entries]
+        queued = 0
+        with self.not_full:
+            for entry, size in zip(entries, sizes):
+                queued += self._offer_locked(entry, size)
+        return queued
+
+    def stats(self) -> dict:
+        with self.mutex:
+            return {
+                "queued_entries": len(self.queue),
+                "queued_bytes": self.queued_bytes,
+                "dropped_entries": self.dropped_entries,
+                "dropped_by_severity": dict(self.dropped_by_severity),
+            }
+
+
+class _BoundedWorker(_Worker):
+    """A background thread that writes batches of log entries from a bounded queue."""
+
+    def __init__(
+        self,
+        cloud_logger,
+        *,
+        max_queue_entries: Optional[int] = None,
+        max_queue_bytes: Optional[int] = None,
+        overflow_policy: OverflowPolicy = OverflowPolicy.BLOCK,
+        block_timeout: Optional[float] = None,
+        **kwargs,
+    ):
+        super().__init__(cloud_logger, **kwargs)
+        self._queue = _BoundedQueue(
+            max_entries=max_queue_entries,
+            max_bytes=max_queue_bytes,
+            overflow_policy=overflow_policy,
+            block_timeout=block_timeout,
+        )
+        self.handler_stats: Optional[HandlerStats] = None
+        self._shared_resource = batch_resource(cloud_logger)
+
+    def _safely_commit_batch(self, batch):
+        # entries without their own resource share the one of the batch
+        batch.resource = self._shared_resource
+        total_logs = len(batch.entries)
+        if total_logs == 0:
+            return
+
+        stats = self.handler_stats
+        start = time.perf_counter_ns()
+        try:
+            batch.commit()
+        except Exception:
+            # reported on stderr instead of logging, not to recurse into the handler
+            print(f"Failed to submit {total_logs} logs.", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+            failed = True
+        else:
+            failed = False
+        if stats is not None:
+            stats.record_batch(
+                total_logs, time.perf_counter_ns() - start, failed=failed
+            )
+
+    def enqueue(self, record, message, **kwargs):
+        """Queues a log entry to be written by the background thread.
+
+        Args:
+            record (logging.LogRecord): Python log record that the handler was called with.
+            message (str or dict): The message from the ``LogRecord`` after being
+                        formatted by the associated log formatters.
+            kwargs: Additional optional arguments for the logger
+        """
+        entry = build_entry(
+            record, message, shared_resource=self._shared_resource, **kwargs
+        )
+        self._queue.offer(entry)
+
+    def enqueue_many(self, items: Iterable[Tuple[Any, Any, dict]]):
+        """Queues log entries to be written by the background thread at once.
+
+        Args:
+            items (Iterable[Tuple[logging.LogRecord, Any, dict]]): Records, messages
+                and additional arguments, the same as those of ``enqueue``.
+        """
+        shared_resource = self._shared_resource
+        self._queue.offer_many(
+            [
+                build_entry(record, message, shared_resource=shared_resource, **kwargs)
+                for record, message, kwargs in items
+            ]
+        )
+
+    def enqueue_entries(self, entries: List[dict]):
+        """Queues log entries which are already built, such as decoded entries."""
+        shared_resource = self._shared_resource
+        if shared_resource is not None:
+            for entry in entries:
+                if entry.get("resource") == shared_resource:
+                    entry["resource"] = None
+        self._queue.offer_many(entries)
+
+
+class BoundedBackgroundThreadTransport(BackgroundThreadTransport):
+    """
+    Asynchronous transport that uses a background thread, with a bounded queue.
+
+    The queue can be bounded by the number of entries and by their estimated size
+    in bytes. When it is full, an entry is handled by ``overflow_policy``, and
+    dropped entries are counted in ``stats``. Without any bound, it works in the same
+    way as ``BackgroundThreadTransport``.
+    """
+
+    def __init__(
+        self,
+        client,
+        name,
+        *,
+        grace_period=_DEFAULT_GRACE_PERIOD,
+        batch_size=_DEFAULT_MAX_BATCH_SIZE,
+        max_latency=_DEFAULT_MAX_LATENCY,
+        resource=_GLOBAL_RESOURCE,
+        max_queue_entries: Optional[int] = None,
+        max_queue_bytes: Optional[int] = None,
+        overflow_policy: Union[str, OverflowPolicy] = OverflowPolicy.BLOCK,
+        block_timeout: Optional[float] = None,
+        **kwargs,
+    ):
+        """
+        Args:
+            client (~logging_v2.client.Client):
+                The Logging client.
+            name (str): The name of the logger.
+            grace_period (Optional[float]): The amount of time to wait for pending logs to
+                be submitted when the process is shutting down.
+            batch_size (Optional[int]): The maximum number of items to send at a time in the
+                background thread.
+            max_latency (Optional[float]): The amount of time to wait for new logs before
+                sending a new batch.
+            resource (Optional[Resource|dict]): The default monitored resource to associate
+                with logs when not specified
+            max_queue_entries (Optional[int]): The maximum number of queued entries.
+            max_queue_bytes (Optional[int]): The maximum estimated size of queued entries.
+            overflow_policy (Union[str, OverflowPolicy]): What to do with an entry when
+                the queue is full, "block", "drop_newest", "drop_oldest" or
+                "drop_below_warning". Defaults to "block".
+            block_timeout (Optional[float]): The maximum number of seconds to block with
+                the "block" policy. The entry is dropped after that. Defaults to no limit.
+        """
+        self.client = client
+        logger = self.client.logger(name, resource=resource)
+        self.worker = self._create_worker(
+            logger,
+            grace_period=grace_period,
+            max_batch_size=batch_size,
+            max_latency=max_latency,
+            max_queue_entries=max_queue_entries,
+            max_queue_bytes=max_queue_bytes,
+            overflow_policy=overflow_policy,
+            block_timeout=block_timeout,
+        )
+        self.worker.start()
+
+    def _create_worker(self, cloud_logger, **kwargs) -> _BoundedWorker:
+        return _BoundedWorker(cloud_logger, **kwargs)
+
+    def send_batch(self, items: Iterable[Tuple[Any, Any, dict]]):
+        """
+        Queue log entries with a single acquisition of the queue lock.
+
+        Args:
+            items (Iterable[Tuple[logging.LogRecord, Any, dict]]): Records, messages
+                and additional arguments, the same as those of ``send``.
+        """
+        self.worker.enqueue_many(items)
+
+    def set_handler_stats(self, stats: HandlerStats) -> None:
+        """Report the queue depth and written batches to the stats of a handler."""
+        self.worker.handler_stats = stats
+        stats.queue_depth = self.worker._queue.qsize
+
+    @property
+    def dropped_entries(self) -> int:
+        """Number of entries dropped because the queue was full"""
+        return self.worker._queue.dropped_entries
+
+    def stats(self) -> dict:
+        """
+        Counters of the queue, to be exported as metrics.
+
+        Returns:
+            dict: ``queued_entries``, ``queued_bytes``, ``dropped_entries`` and
+            ``dropped_by_severity``, the number of dropped entries by severity name.
+        """
+        return self.worker._queue.stats()
@@ -0,0 +1,448 @@
+import contextlib
+import json
+import mmap
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from enum import Enum
+from typing import Callable, List, Optional
+
+from google.api_core import exceptions
+from google.auth.exceptions import TransportError
+from google.cloud.logging_v2.handlers.transports.background_thread import (
+    _DEFAULT_GRACE_PERIOD,
+    _DEFAULT_MAX_BATCH_SIZE,
+    _DEFAULT_MAX_LATENCY,
+)
+from google.cloud.logging_v2.logger import _GLOBAL_RESOURCE
+
+from ..utils import serialize_json
+from ._helpers import encode_frame, split_frames
+from .bounded import BoundedBackgroundThreadTransport, _BoundedWorker
+
+_DEFAULT_MAX_RETRIES = 3
+_DEFAULT_INITIAL_BACKOFF = 0.5  # Seconds
+_DEFAULT_MAX_BACKOFF = 30.0  # Seconds
+_DEFAULT_FAILURE_THRESHOLD = 3
+_DEFAULT_RESET_TIMEOUT = 30.0  # Seconds
+_DEFAULT_MAX_SPILL_BYTES = 64 * 1024 * 1024
+
+# errors after which the same batch can be written, unlike an invalid entry
+# or a missing permission. OSError includes connection errors and timeouts.
+_RETRYABLE_ERRORS = (
+    exceptions.ServiceUnavailable,
+    exceptions.DeadlineExceeded,
+    exceptions.ResourceExhausted,
+    exceptions.InternalServerError,
+    exceptions.Aborted,
+    TransportError,
+    OSError,
+)
+
+
+class CircuitState(str, Enum):
+    """State of the circuit breaker of a resilient transport."""
+
+    CLOSED = "closed"
+    """Batches are written to the API"""
+    OPEN = "open"
+    """Batches are spilled without calling the API, until ``reset_timeout`` passes"""
+    HALF_OPEN = "half_open"
+    """A single write is tried, which closes or opens the circuit again"""
+
+
+class _WriteResult(Enum):
+    WRITTEN = "written"
+    """The batch is written"""
+    FAILED = "failed"
+    """The batch can be written again"""
+    REJECTED = "rejected"
+    """The batch fails in the same way when it is written again"""
+
+
+def _decode(payloads: List[bytes]) -> List[dict]:
+    entries = []
+    for payload in payloads:
+        try:
+            entries.append(json.loads(payload))
+        except ValueError:
+            print("Failed to decode a spilled log entry.", file=sys.stderr)
+    return entries
+
+
+class _SpillFile:
+    """
+    Append-only file of entries which could not be written, in the representation
+    of the API, as length-prefixed JSON frames. It is read through a memory map
+    to replay the entries in order.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        # entries left by a previous process are replayed as well
+        self.size = os.path.getsize(path) if os.path.exists(path) else 0
+
+    def append(self, entries: List[dict]) -> bool:
+        """
+        Returns:
+            bool: False if the entries are dropped, as the file would be too large.
+        """
+        data = b"".join(
+            encode_frame(
+                json.dumps(entry, separators=(",", ":"), default=serialize_json).encode(
+                    "utf-8"
+                )
+            )
+            for entry in entries
+        )
+        if self.size + len(data) > self.max_bytes:
+            return False
+        try:
+            with open(self.path, "ab") as file:
+                file.write(data)
+        except OSError:
+            # a partial frame would corrupt the entries appended after it
+            with contextlib.suppress(OSError):
+                os.truncate(self.path, self.size)
+            raise
+        self.size += len(data)
+        return True
+
+    def replay(self, write: Callable[[List[dict]], bool], batch_size: int) -> bool:
+        """
+        Write the entries of the file in order with ``write``, in batches of
+        ``batch_size`` entries. When ``write`` fails, the file keeps the entries
+        which are not written yet.
+
+        Returns:
+            bool: True if every entry has been written.
+        """
+        if self.size == 0:
+            return True
+        remaining = None
+        with open(self.path, "rb") as file:
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as view:
+                offset = 0
+                while True:
+                    payloads, end = split_frames(view, offset, batch_size)
+                    if not payloads:
+                        break
+                    if not write(_decode(payloads)):
+                        remaining = view[offset:]
+                        break
+                    offset = end
+                if remaining is None and offset < len(view):
+                    print(
+                        f"Dropped {len(view) - offset} bytes of an incomplete entry "
+                        f"in {self.path}.",
+                        file=sys.stderr,
+                    )
+        if remaining is None:
+            self.clear()
+            return True
+        if len(remaining) < self.size:
+            temporary_path = f"{self.path}.tmp"
+            with open(temporary_path, "wb") as file:
+                file.write(remaining)
+            os.replace(temporary_path, self.path)
+            self.size = len(remaining)
+        return False
+
+    def clear(self) -> None:
+        self.size = 0
+        if os.path.exists(self.path):
+            os.truncate(self.path, 0)
+
+
+class _ResilientWorker(_BoundedWorker):
+    """
+    A background thread that retries failed batches with backoff, and spills them
+    while the circuit breaker is open.
+    """
+
+    def __init__(
+        self,
+        cloud_logger,
+        *,
+        max_retries: int,
+        initial_backoff: float,
+        max_backoff: float,
+        failure_threshold: int,
+        reset_timeout: float,
+        spill_path: Optional[str],
+        max_spill_bytes: int,
+        **kwargs,
+    ):
+        super().__init__(cloud_logger, **kwargs)
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.spill = (
+            _SpillFile(spill_path, max_spill_bytes) if spill_path is not None else None
+        )
+        self.circuit_state = CircuitState.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._write_kwargs = {"logger_name": cloud_logger.full_name}
+        # the shared resource is converted once, instead of once per batch
+        if self._shared_resource is not None:
+            self._write_kwargs["resource"] = self._shared_resource._to_dict()
+        if cloud_logger.labels is not None:
+            self._write_kwargs["labels"] = cloud_logger.labels
+        self._counters_lock = threading.Lock()
+        self.counters = {
+            "retries": 0,
+            "spilled_entries": 0,
+            "replayed_entries": 0,
+            "dropped_batches": 0,
+            "rejected_batches": 0,
+        }
+
+    def _count(self, name: str, value: int = 1) -> None:
+        with self._counters_lock:
+            self.counters[name] += value
+
+    def _safely_commit_batch(self, batch):
+        # entries are converted once, and kept in this form for retries and spilling
+        entries = [entry.to_api_repr() for entry in batch.entries]
+        del batch.entries[:]
+        if entries:
+            self._commit_entries(entries)
+
+    def _commit_entries(self, entries: List[dict]) -> None:
+        if self._allows_write():
+            retries = (
+                0 if self.circuit_state is CircuitState.HALF_OPEN else self.max_retries
+            )
+            # spilled entries go first, to keep the order of entries
+            if self._replay_spill() and self._write_with_retries(entries, retries):
+                return
+        self._spill_entries(entries)
+
+    def _allows_write(self) -> bool:
+        if self.circuit_state is CircuitState.OPEN:
+            if time.monotonic() - self._opened_at < self.reset_timeout:
+                return False
+            self.circuit_state = CircuitState.HALF_OPEN
+        return True
+
+    def _replay_spill(self) -> bool:
+        if self.spill is None or self.spill.size == 0:
+            return True
+        try:
+            replayed = self.spill.replay(self._write_replayed, self._max_batch_size)
+        except Exception:
+            # entries which cannot be read back are dropped, not to stop the worker
+            self._count("dropped_batches")
+            print(
+                f"Dropped {self.spill.size} bytes of logs spilled to {self.spill.path}.",
+                file=sys.stderr,
+            )
+            traceback.print_exc(file=sys.stderr)
+            with contextlib.suppress(OSError):
+                self.spill.clear()
+            return True
+        if not replayed:
+            self._on_failure()
+        return replayed
+
+    def _write_replayed(self, entries: List[dict]) -> bool:
+        result = self._write(entries)
+        if result is _WriteResult.FAILED:
+            return False
+        # a rejected batch is skipped, not to stop the replay of the next ones
+        if result is _WriteResult.WRITTEN:
+            self._count("replayed_entries", len(entries))
+        return True
+
+    def _write_with_retries(self, entries: List[dict], retries: int) -> bool:
+        for attempt in range(retries + 1):
+            if attempt:
+                self._count("retries")
+                time.sleep(self._backoff(attempt))
+            if self._write(entries) is not _WriteResult.FAILED:
+                # a rejected batch is dropped, but the API is available
+                self._on_success()
+                return True
+        self._on_failure()
+        return False
+
+    def _backoff(self, attempt: int) -> float:
+        """Exponential backoff with full jitter."""
+        delay = min(self.max_backoff, self.initial_backoff * 2 ** (attempt - 1))
+        return random.uniform(0, delay)
+
+    def _write(self, entries: List[dict]) -> _WriteResult:
+        stats = self.handler_stats
+        start = time.perf_counter_ns()
+        try:
+            self._cloud_logger.client.logging_api.write_entries(
+                entries, partial_success=True, **self._write_kwargs
+            )
+        except _RETRYABLE_ERRORS:
+            result = _WriteResult.FAILED
+        except Exception:
+            result = _WriteResult.REJECTED
+            self._count("rejected_batches")
+            print(f"Dropped {len(entries)} logs rejected by the API.", file=sys.stderr)
+            traceback.print_exc(file=sys.stderr)
+        else:
+            result = _WriteResult.WRITTEN
+        if stats is not None:
+            stats.record_batch(
+                len(entries),
+                time.perf_counter_ns() - start,
+                failed=result is not _WriteResult.WRITTEN,
+            )
+        return result
+
+    def _on_success(self) -> None:
+        if self.circuit_state is not CircuitState.CLOSED:
+            print("Cloud Logging API is available again.", file=sys.stderr)
+        self.circuit_state = CircuitState.CLOSED
+        self._consecutive_failures = 0
+
+    def _on_failure(self) -> None:
+        self._consecutive_failures += 1
+        if (
+            self.circuit_state is CircuitState.HALF_OPEN
+            or self._consecutive_failures >= self.failure_threshold
+        ):
+            if self.circuit_state is CircuitState.CLOSED:
+                # reported on stderr instead of logging, not to recurse into the handler
+                print(
+                    f"Failed to submit logs {self._consecutive_failures} times, "
+                    f"holding logs for {self.reset_timeout} seconds.",
+                    file=sys.stderr,
+                )
+            self.circuit_state = CircuitState.OPEN
+            self._opened_at = time.monotonic()
+
+    def _spill_entries(self, entries: List[dict]) -> None:
+        if self.spill is not None:
+            try:
+                spilled = self.spill.append(entries)
+            except Exception:
+                spilled = False
+                traceback.print_exc(file=sys.stderr)
+            if spilled:
+                self._count("spilled_entries", len(entries))
+                return
+        self._count("dropped_batches")
+        print(f"Failed to submit {len(entries)} logs.", file=sys.stderr)
+
+
+class ResilientBackgroundThreadTransport(BoundedBackgroundThreadTransport):
+    """
+    Background thread transport that does not lose batches when the API fails.
+
+    A failed batch is retried up to ``max_retries`` times with exponential backoff
+    and full jitter. After ``failure_threshold`` batches in a row have failed, the
+    circuit breaker opens, and batches are appended to the file at ``spill_path``
+    without calling the API for ``reset_timeout`` seconds. Then a single write is
+    tried, and once it succeeds, spilled entries are replayed in order before new
+    batches. Entries spilled by a previous process are replayed as well.
+    Without ``spill_path``, batches are dropped while the circuit is open.
+
+    Only errors which may pass, such as ``ServiceUnavailable`` or connection errors,
+    are retried. A batch rejected with another error, such as ``InvalidArgument``
+    or ``PermissionDenied``, is dropped and counted in ``rejected_batches``,
+    without opening the circuit breaker.
+    """
+
+    def __init__(
+        self,
+        client,
+        name,
+        *,
+        grace_period=_DEFAULT_GRACE_PERIOD,
+        batch_size=_DEFAULT_MAX_BATCH_SIZE,
+        max_latency=_DEFAULT_MAX_LATENCY,
+        resource=_GLOBAL_RESOURCE,
+        max_retries: int = _DEFAULT_MAX_RETRIES,
+        initial_backoff: float = _DEFAULT_INITIAL_BACKOFF,
+        max_backoff: float = _DEFAULT_MAX_BACKOFF,
+        failure_threshold: int = _DEFAULT_FAILURE_THRESHOLD,
+        reset_timeout: float = _DEFAULT_RESET_TIMEOUT,
+        spill_path: Optional[str] = None,
+        max_spill_bytes: int = _DEFAULT_MAX_SPILL_BYTES,
+        **kwargs,
+    ):
+        """
+        Args:
+            client (~logging_v2.client.Client):
+                The Logging client.
+            name (str): The name of the logger.
+            grace_period (Optional[float]): The amount of time to wait for pending logs to
+                be submitted when the process is shutting down.
+            batch_size (Optional[int]): The maximum number of items to send at a time in the
+                background thread.
+            max_latency (Optional[float]): The amount of time to wait for new logs before
+                sending a new batch.
+            resource (Optional[Resource|dict]): The default monitored resource to associate
+                with logs when not specified
+            max_retries (int): The number of retries of a failed batch.
+            initial_backoff (float): The maximum delay in seconds before the first retry,
+                doubled for each retry.
+            max_backoff (float): The maximum delay in seconds between retries.
+            failure_threshold (int): The number of failed batches in a row which
+                opens the circuit breaker.
+            reset_timeout (float): Seconds to wait before trying to write again
+                after the circuit breaker has opened.
+            spill_path (Optional[str]): The file to append batches to while the circuit
+                breaker is open. Defaults to dropping them.
+            max_spill_bytes (int): The maximum size of the spill file.
+            kwargs: Bounds of the queue, the same as those of
+                :class:`.BoundedBackgroundThreadTransport`.
+        """
+        self._worker_options = {
+            "max_retries": max_retries,
+            "initial_backoff": initial_backoff,
+            "max_backoff": max_backoff,
+            "failure_threshold": failure_threshold,
+            "reset_timeout": reset_timeout,
+            "spill_path": spill_path,
+            "max_spill_bytes": max_spill_bytes,
+        }
+        super().__init__(
+            client,
+            name,
+            grace_period=grace_period,
+            batch_size=batch_size,
+            max_latency=max_latency,
+            resource=resource,
+            **kwargs,
+        )
+
+    def _create_worker(self, cloud_logger, **kwargs) -> _ResilientWorker:
+        return _ResilientWorker(cloud_logger, **self._worker_options, **kwargs)
+
+    @property
+    def circuit_state(self) -> CircuitState:
+        return self.worker.circuit_state
+
+    def stats(self) -> dict:
+        """
+        Counters of the queue and of failed writes, to be exported as metrics.
+
+        Returns:
+            dict: The counters of :meth:`.BoundedBackgroundThreadTransport.stats`,
+            ``circuit_state``, ``retries``, ``spilled_entries``, ``replayed_entries``,
+            ``dropped_batches``, ``rejected_batches`` and ``spill_bytes``, the size
+            of the spill file.
+        """
+        worker = self.worker
+        with worker._counters_lock:
+            counters = dict(worker.counters)
+        return {
+            **super().stats(),
+            **counters,
+            "circuit_state": worker.circuit_state.value,
+            "spill_bytes": worker.spill.size if worker.spill is not None else 0,
+        }
@@ -0,0 +1,429 @@
+import atexit
+import os
+import selectors
+import socket
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from google.cloud.logging_v2.handlers.transports.background_thread import (
+    _DEFAULT_GRACE_PERIOD,
+    _DEFAULT_MAX_LATENCY,
+    _get_many,
+)
+from google.cloud.logging_v2.handlers.transports.base import Transport
+from google.cloud.logging_v2.logger import _GLOBAL_RESOURCE
+
+from ..json_encoder import get_json_encoder
+from ..stats import HandlerStats
+from ._helpers import (
+    _FRAME_HEADER,
+    build_entry,
+    decode_entries,
+    encode_entry,
+    frame_length,
+)
+from .bounded import OverflowPolicy, _BoundedQueue, _BoundedWorker
+
+_DEFAULT_MAX_QUEUE_ENTRIES = 10000
+_DEFAULT_SEND_BATCH_SIZE = 100
+_DEFAULT_SHIPPER_BATCH_SIZE = 500
+_DEFAULT_RECONNECT_INTERVAL = 1.0  # Seconds
+_RECEIVE_SIZE = 65536
+# far larger than the maximum size of an entry of Cloud Logging
+_DEFAULT_MAX_FRAME_BYTES = 1024 * 1024
+# interval of checks whether the shipper is stopped
+_SELECT_TIMEOUT = 0.1
+_STOP_SIGNAL = object()
+
+
+class UnixSocketTransport(Transport):
+    """
+    Transport that forwards encoded entries over a Unix socket to a ``LogShipper``.
+
+    Use it in each worker process of gunicorn or uvicorn, so that a single shipper
+    process batches the entries of all workers with one Cloud Logging client.
+    Entries are encoded into JSON frames and written to the socket by a background
+    thread. While the shipper is unreachable, the thread retries every
+    ``reconnect_interval`` seconds, and entries wait in a queue bounded by
+    ``max_queue_entries``, where ``overflow_policy`` applies. An entry may be written
+    twice if the connection is lost in the middle of a write. An entry encoded into
+    more than ``max_frame_bytes`` bytes is dropped, as the shipper would reject it.
+    The transport is closed when the process exits, to write the queued entries.
+    """
+
+    def __init__(
+        self,
+        client,
+        name,
+        *,
+        socket_path: str,
+        batch_size: int = _DEFAULT_SEND_BATCH_SIZE,
+        max_queue_entries: Optional[int] = _DEFAULT_MAX_QUEUE_ENTRIES,
+        overflow_policy: Union[str, OverflowPolicy] = OverflowPolicy.DROP_OLDEST,
+        reconnect_interval: float = _DEFAULT_RECONNECT_INTERVAL,
+        grace_period: float = _DEFAULT_GRACE_PERIOD,
+        json_encoder=None,
+        max_frame_bytes: int = _DEFAULT_MAX_FRAME_BYTES,
+        **kwargs,
+    ):
+        """
+        Args:
+            client (~logging_v2.client.Client):
+                The Logging client. It is only used for the full name of the log.
+            name (str): The name of the logger.
+            socket_path (str): The path of the Unix socket of the shipper.
+            batch_size (int): The maximum number of entries to write at a time.
+            max_queue_entries (Optional[int]): The maximum number of queued entries.
+            overflow_policy (Union[str, OverflowPolicy]): What to do with an entry when
+                the queue is full. Defaults to "drop_oldest".
+            reconnect_interval (float): Seconds to wait before connecting again
+                to the shipper after a failure.
+            grace_period (float): Seconds to wait for queued entries to be written
+                by ``flush`` and ``close``, including at exit.
+            json_encoder (Optional[Union[str, JSONEncoder]]): JSON encoder of entries,
+                "json" or "orjson". Defaults to orjson when it is installed.
+            max_frame_bytes (int): The maximum size of an encoded entry, the same as
+                that of the shipper.
+        """
+        self.client = client
+        self.log_name = client.logger(name).full_name
+        self.socket_path = socket_path
+        self.batch_size = batch_size
+        self.reconnect_interval = reconnect_interval
+        self.grace_period = grace_period
+        self.json_encoder = get_json_encoder(json_encoder)
+        self.max_frame_bytes = max_frame_bytes
+        self.handler_stats: Optional[HandlerStats] = None
+        self._queue = _BoundedQueue(
+            max_entries=max_queue_entries,
+            overflow_policy=overflow_policy,
+            block_timeout=grace_period,
+        )
+        self._socket: Optional[socket.socket] = None
+        self._connection_failed = False
+        self._thread = threading.Thread(
+            target=self._run, name="UnixSocketTransport", daemon=True
+        )
+        self._thread.start()
+        atexit.register(self.close)
+
+    def send(self, record, message, **kwargs):
+        """Overrides Transport.send().
+
+        Args:
+            record (logging.LogRecord): Python log record that the handler was called with.
+            message (str or dict): The message from the ``LogRecord`` after being
+                formatted by the associated log formatters.
+            kwargs: Additional optional arguments for the logger
+        """
+        self._queue.offer(
+            build_entry(record, message, log_name=self.log_name, **kwargs)
+        )
+
+    def send_batch(self, items: Iterable[Tuple[Any, Any, dict]]):
+        """
+        Queue log entries with a single acquisition of the queue lock.
+
+        Args:
+            items (Iterable[Tuple[logging.LogRecord, Any, dict]]): Records, messages
+                and additional arguments, the same as those of ``send``.
+        """
+        self._queue.offer_many(
+            [
+                build_entry(record, message, log_name=self.log_name, **kwargs)
+                for record, message, kwargs in items
+            ]
+        )
+
+    def _run(self) -> None:
+        queue_ = self._queue
+        while True:
+            items = _get_many(queue_, max_items=self.batch_size)
+            entries = [item for item in items if item is not _STOP_SIGNAL]
+            stopping = len(entries) < len(items)
+            frames = self._encode(entries)
+            if frames:
+                self._write_until_done(b"".join(frames), len(frames), stopping)
+            for _ in items:
+                queue_.task_done()
+            if stopping:
+                self._close_socket()
+                return
+
+    def _encode(self, entries: List[dict]) -> List[bytes]:
+        frames = []
+        max_size = self.max_frame_bytes + _FRAME_HEADER.size
+        for entry in entries:
+            frame = encode_entry(entry, self.json_encoder)
+            if len(frame) <= max_size:
+                frames.append(frame)
+                continue
+            with self._queue.mutex:
+                self._queue._record_drop(entry)
+            print(
+                f"Dropped a log of {len(frame)} bytes, "
+                f"over max_frame_bytes of {self.max_frame_bytes}.",
+                file=sys.stderr,
+            )
+        return frames
+
+    def _write_until_done(self, data: bytes, count: int, stopping: bool) -> None:
+        while True:
+            start = time.perf_counter_ns()
+            succeeded = self._write(data)
+            if self.handler_stats is not None:
+                self.handler_stats.record_batch(
+                    count, time.perf_counter_ns() - start, failed=not succeeded
+                )
+            if succeeded:
+                return
+            if stopping:
+                print(
+                    f"Failed to forward {count} logs to {self.socket_path}.",
+                    file=sys.stderr,
+                )
+                return
+            time.sleep(self.reconnect_interval)
+
+    def _write(self, data: bytes) -> bool:
+        try:
+            if self._socket is None:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.connect(self.socket_path)
+            self._socket.sendall(data)
+        except OSError as error:
+            self._close_socket()
+            if not self._connection_failed:
+                # reported once until the connection is back
+                print(
+                    f"Failed to connect to the log shipper at {self.socket_path}: "
+                    f"{error}",
+                    file=sys.stderr,
+                )
+                self._connection_failed = True
+            return False
+        self._connection_failed = False
+        return True
+
+    def _close_socket(self) -> None:
+        sock, self._socket = self._socket, None
+        if sock is not None:
+            sock.close()
+
+    def set_handler_stats(self, stats: HandlerStats) -> None:
+        """Report the queue depth and written batches to the stats of a handler."""
+        self.handler_stats = stats
+        stats.queue_depth = self._queue.qsize
+
+    def stats(self) -> dict:
+        """
+        Counters of the queue, to be exported as metrics.
+
+        Returns:
+            dict: ``queued_entries``, ``queued_bytes``, ``dropped_entries`` and
+            ``dropped_by_severity``, the number of dropped entries by severity name.
+        """
+        return self._queue.stats()
+
+    def flush(self):
+        """Wait up to ``grace_period`` seconds for queued entries to be written."""
+        deadline = time.monotonic() + self.grace_period
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or not self._thread.is_alive():
+                    return
+                self._queue.all_tasks_done.wait(remaining)
+
+    def close(self):
+        """Write queued entries, and stop the background thread."""
+        if not self._thread.is_alive():
+            return
+        # put is not bounded, unlike offer
+        self._queue.put(_STOP_SIGNAL)
+        self._thread.join(timeout=self.grace_period)
+
+
+class LogShipper:
+    """
+    Process-wide shipper of entries forwarded by ``UnixSocketTransport``.
+
+    It listens on a Unix socket, decodes the entries of every connected worker, and
+    writes them to Cloud Logging in batches of up to ``batch_size`` entries with a
+    single client, so the workers of a server share batches and the API connection.
+    Each entry keeps the log name and resource given by its worker.
+
+    Run it once per host or pod in its own process, as the threads and gRPC channels
+    of the client do not survive a fork: not in the master process of gunicorn,
+    whose workers fork after its hooks. Stop it on exit to write the entries left.
+    A connection which sends a frame larger than ``max_frame_bytes`` is closed,
+    so a corrupt length prefix does not grow the buffer of the connection.
+    """
+
+    def __init__(
+        self,
+        client,
+        socket_path: str,
+        *,
+        name: str = "python",
+        batch_size: int = _DEFAULT_SHIPPER_BATCH_SIZE,
+        max_latency: float = _DEFAULT_MAX_LATENCY,
+        max_queue_entries: Optional[int] = None,
+        overflow_policy: Union[str, OverflowPolicy] = OverflowPolicy.DROP_OLDEST,
+        grace_period: float = _DEFAULT_GRACE_PERIOD,
+        resource=_GLOBAL_RESOURCE,
+        json_encoder=None,
+        max_frame_bytes: int = _DEFAULT_MAX_FRAME_BYTES,
+    ):
+        """
+        Args:
+            client (~logging_v2.client.Client):
+                The Logging client shared by all workers.
+            socket_path (str): The path of the Unix socket to listen on.
+            name (str): The name of the log of entries without a log name.
+            batch_size (int): The maximum number of entries to write at a time.
+            max_latency (float): The amount of time to wait for new entries before
+                writing a batch.
+            max_queue_entries (Optional[int]): The maximum number of queued entries.
+            overflow_policy (Union[str, OverflowPolicy]): What to do with an entry when
+                the queue is full. Defaults to "drop_oldest".
+            grace_period (float): Seconds to wait for queued entries to be written
+                on ``stop``.
+            resource (Optional[Resource|dict]): The monitored resource of entries
+                without a resource.
+            json_encoder (Optional[Union[str, JSONEncoder]]): JSON decoder of entries,
+                "json" or "orjson". Defaults to orjson when it is installed.
+            max_frame_bytes (int): The maximum size of an encoded entry.
+        """
+        self.client = client
+        self.socket_path = socket_path
+        self.max_frame_bytes = max_frame_bytes
+        self.grace_period = grace_period
+        self.json_encoder = get_json_encoder(json_encoder)
+        self.worker = _BoundedWorker(
+            client.logger(name, resource=resource),
+            grace_period=grace_period,
+            max_batch_size=batch_size,
+            max_latency=max_latency,
+            max_queue_entries=max_queue_entries,
+            overflow_policy=overflow_policy,
+        )
+        self.received_entries = 0
+        self.rejected_connections = 0
+        self._selector: Optional[selectors.BaseSelector] = None
+        self._server: Optional[socket.socket] = None
+        self._buffers: Dict[socket.socket, bytearray] = {}
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_alive(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        """Listen on the socket, and start the threads of the shipper."""
+        if self.is_alive:
+            return
+        if os.path.exists(self.socket_path):
+            # left by a shipper which has not stopped
+            os.unlink(self.socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+        server.setblocking(False)
+        self._server = server
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(server, selectors.EVENT_READ)
+        self._stopping.clear()
+        self.worker.start()
+        self._thread = threading.Thread(
+            target=self._serve, name="LogShipper", daemon=True
+        )
+        self._thread.start()
+
+    def _serve(self) -> None:
+        selector = self._selector
+        while not self._stopping.is_set():
+            for key, _ in selector.select(timeout=_SELECT_TIMEOUT):
+                if key.fileobj is self._server:
+                    self._accept()
+                else:
+                    self._receive(key.fileobj)
+        # read what the workers have already written
+        for key, _ in selector.select(timeout=0):
+            if key.fileobj is not self._server:
+                self._receive(key.fileobj)
+        for connection in list(self._buffers):
+            self._disconnect(connection)
+        selector.unregister(self._server)
+        selector.close()
+        self._server.close()
+
+    def _accept(self) -> None:
+        try:
+            connection, _ = self._server.accept()
+        except OSError:
+            return
+        connection.setblocking(False)
+        self._buffers[connection] = bytearray()
+        self._selector.register(connection, selectors.EVENT_READ)
+
+    def _receive(self, connection: socket.socket) -> None:
+        try:
+            data = connection.recv(_RECEIVE_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            # a partial frame of a closed connection is written again by the worker
+            self._disconnect(connection)
+            return
+        buffer = self._buffers[connection]
+        buffer += data
+        entries, size = decode_entries(buffer, self.json_encoder)
+        del buffer[:size]
+        if entries:
+            self.received_entries += len(entries)
+            self.worker.enqueue_entries(entries)
+        length = frame_length(buffer)
+        if length is not None and length > self.max_frame_bytes:
+            self.rejected_connections += 1
+            print(
+                f"Closed a connection with a frame of {length} bytes, "
+                f"over max_frame_bytes of {self.max_frame_bytes}.",
+                file=sys.stderr,
+            )
+            self._disconnect(connection)
+
+    def _disconnect(self, connection: socket.socket) -> None:
+        self._selector.unregister(connection)
+        del self._buffers[connection]
+        connection.close()
+
+    def stop(self) -> None:
+        """Stop listening, and write the received entries within ``grace_period``."""
+        if not self.is_alive:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.worker.stop(grace_period=self.grace_period)
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: ``connections``, the number of connected workers,
+            ``received_entries``, ``rejected_connections``, the number of connections
+            closed for a frame over ``max_frame_bytes``, and the counters of the queue.
+        """
+        return {
+            "connections": len(self._buffers),
+            "received_entries": self.received_entries,
+            "rejected_connections": self.rejected_connections,
+            **self.worker._queue.stats(),
+        }
@@ -0,0 +1,133 @@
+import atexit
+import threading
+import time
+from typing import Any, Iterable, List, Optional, Tuple
+
+from google.cloud.logging_v2.handlers.transports.base import Transport
+from google.cloud.logging_v2.logger import _GLOBAL_RESOURCE
+
+from ..stats import HandlerStats
+from ._helpers import batch_resource, build_entry, commit_in_batches
+
+_DEFAULT_MAX_BATCH_SIZE = 100
+_DEFAULT_MAX_LATENCY = 0.5  # Seconds
+
+
+class SyncBatchTransport(Transport):
+    """
+    Synchronous transport that writes entries in batches, without a background thread.
+
+    Entries are held in memory, and written in a single API call on the thread which
+    sends the entry completing a batch of ``batch_size`` entries, or the first entry
+    after ``max_latency`` seconds since the oldest held entry. It fits short-lived
+    workers and serverless functions, whose background threads are frozen between
+    invocations.
+
+    Nothing is written while no entry is sent, so call ``flush`` at the end of an
+    invocation. Held entries are also written at exit, and on shutdown of an
+    application with ``register_shutdown``.
+    """
+
+    def __init__(
+        self,
+        client,
+        name,
+        *,
+        batch_size: int = _DEFAULT_MAX_BATCH_SIZE,
+        max_latency: float = _DEFAULT_MAX_LATENCY,
+        resource=_GLOBAL_RESOURCE,
+        flush_at_exit: bool = True,
+        **kwargs,
+    ):
+        """
+        Args:
+            client (~logging_v2.client.Client):
+                The Logging client.
+            name (str): The name of the logger.
+            batch_size (int): The maximum number of entries to write at a time.
+            max_latency (float): The maximum number of seconds to hold entries,
+                checked when an entry is sent.
+            resource (Optional[Resource|dict]): The default monitored resource to associate
+                with logs when not specified
+            flush_at_exit (bool): Write held entries when the process exits.
+                Defaults to True.
+        """
+        self.client = client
+        self.logger = client.logger(name, resource=resource)
+        self._shared_resource = batch_resource(self.logger)
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.handler_stats: Optional[HandlerStats] = None
+        self._entries: List[dict] = []
+        self._oldest: Optional[float] = None
+        self._lock = threading.Lock()
+        if flush_at_exit:
+            atexit.register(self.flush)
+
+    def send(self, record, message, **kwargs):
+        """Overrides Transport.send().
+
+        Args:
+            record (logging.LogRecord): Python log record that the handler was called with.
+            message (str or dict): The message from the ``LogRecord`` after being
+                formatted by the associated log formatters.
+            kwargs: Additional optional arguments for the logger
+        """
+        entry = build_entry(
+            record, message, shared_resource=self._shared_resource, **kwargs
+        )
+        self._hold([entry])
+
+    def send_batch(self, items: Iterable[Tuple[Any, Any, dict]]):
+        """
+        Hold log entries at once.
+
+        Args:
+            items (Iterable[Tuple[logging.LogRecord, Any, dict]]): Records, messages
+                and additional arguments, the same as those of ``send``.
+        """
+        self._hold(
+            [
+                build_entry(
+                    record, message, shared_resource=self._shared_resource, **kwargs
+                )
+                for record, message, kwargs in items
+            ]
+        )
+
+    def _hold(self, entries: List[dict]) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if self._oldest is None:
+                self._oldest = now
+            self._entries.extend(entries)
+            if (
+                len(self._entries) < self.batch_size
+                and now - self._oldest < self.max_latency
+            ):
+                return
+            entries = self._take_entries()
+        commit_in_batches(self.logger, entries, self.batch_size, self.handler_stats)
+
+    def _take_entries(self) -> List[dict]:
+        entries, self._entries = self._entries, []
+        self._oldest = None
+        return entries
+
+    def set_handler_stats(self, stats: HandlerStats) -> None:
+        """Report the number of held entries and written batches to the stats of a handler."""
+        self.handler_stats = stats
+        stats.queue_depth = self._held_entries
+
+    def _held_entries(self) -> int:
+        return len(self._entries)
+
+    def register_shutdown(self, app) -> None:
+        """Write held entries on shutdown of a FastAPI application."""
+        app.add_event_handler("shutdown", self.flush)
+
+    def flush(self):
+        """Write every held entry."""
+        with self._lock:
+            entries = self._take_entries()
+        commit_in_batches(self.logger, entries, self.batch_size, self.handler_stats)
@@ -1,9 +1,285 @@
-from datetime import date, datetime
+import dataclasses
+from datetime import date, time, timedelta
+from decimal import Decimal
+from enum import Enum
+from functools import singledispatch
+from typing import Any, Callable, Dict, Optional, Tuple
+from uuid import UUID
 
+try:
+    from pydantic import BaseModel
+except ImportError:  # pragma: no cover
+    BaseModel = None
 
-def serialize_json(object):
-    if isinstance(object, (datetime, date)):
-        return object.isoformat()
-    elif hasattr(object, "__dict__"):
+# exact types which are encoded as they are and come back unchanged from JSON
+_JSON_SCALAR_TYPES = frozenset({str, int, float, bool, type(None)})
+
+_FAILED_TO_SERIALIZE = "object that is failed to serialize"
+# appended to strings cut by truncate_json
+_TRUNCATED_SUFFIX = "..."
+
+
+@singledispatch
+def _serialize_object(object):
+    if hasattr(object, "__dict__"):
         return object.__dict__
-    return "object that is failed to serialize"
+    return _FAILED_TO_SERIALIZE
+
+
+def _serialize_dataclass(object):
+    return {
+        field.name: getattr(object, field.name) for field in dataclasses.fields(object)
+    }
+
+
+@_serialize_object.register(date)
+@_serialize_object.register(time)
+def _serialize_isoformat(object):
+    # datetime is a subclass of date
+    return object.isoformat()
+
+
+@_serialize_object.register(timedelta)
+def _serialize_timedelta(object):
+    return object.total_seconds()
+
+
+@_serialize_object.register(UUID)
+@_serialize_object.register(Decimal)
+def _serialize_str(object):
+    return str(object)
+
+
+@_serialize_object.register(Enum)
+def _serialize_enum(object):
+    return object.value
+
+
+@_serialize_object.register(set)
+@_serialize_object.register(frozenset)
+@_serialize_object.register(tuple)
+def _serialize_set(object):
+    # tuples are native to json, but orjson only encodes exact tuples
+    return list(object)
+
+
+@_serialize_object.register(bytes)
+@_serialize_object.register(bytearray)
+def _serialize_bytes(object):
+    return object.decode("utf-8", errors="backslashreplace")
+
+
+if BaseModel is not None:
+
+    @_serialize_object.register(BaseModel)
+    def _serialize_pydantic_model(object):
+        if hasattr(object, "model_dump"):
+            return object.model_dump(by_alias=True)
+        return object.dict(by_alias=True)
+
+
+# converters resolved for each class, which skip the MRO search of singledispatch
+_RESOLVED_SERIALIZERS: Dict[type, Callable[[Any], Any]] = {}
+
+
+def register_serializer(cls: type, func: Optional[Callable[[Any], Any]] = None):
+    """
+    Register a function converting instances of ``cls`` into JSON-serializable data.
+    The converter is also applied to subclasses of ``cls``.
+    It can be used as a decorator.
+
+    Example:
+
+    .. code-block:: python
+
+        @register_serializer(Money)
+        def serialize_money(money: Money):
+            return {"amount": str(money.amount), "currency": money.currency}
+    """
+    if func is None:
+        return lambda f: register_serializer(cls, f)
+    _serialize_object.register(cls, func)
+    _RESOLVED_SERIALIZERS.clear()
+    return func
+
+
+def _resolve_serializer(cls: type) -> Callable[[Any], Any]:
+    serializer = _serialize_object.dispatch(cls)
+    if serializer is _serialize_object.registry[object]:
+        # dataclasses have no common base class to register
+        if dataclasses.is_dataclass(cls):
+            serializer = _serialize_dataclass
+    _RESOLVED_SERIALIZERS[cls] = serializer
+    return serializer
+
+
+def serialize_json(object):
+    """
+    Convert an object which is not JSON-native, to be used as ``default`` of ``json.dumps``.
+    Converters are looked up in a registry by the class of the object,
+    and custom converters can be added with ``register_serializer``.
+    """
+    cls = type(object)
+    serializer = _RESOLVED_SERIALIZERS.get(cls)
+    if serializer is None:
+        serializer = _resolve_serializer(cls)
+    return serializer(object)
+
+
+def sanitize_json(value: Any) -> Any:
+    """
+    Convert a value into JSON-native data in a single pass.
+
+    The result equals ``json.loads(json.dumps(value, default=serialize_json))``,
+    but only values which are not JSON-native are converted. Containers without
+    anything to convert are returned as they are, so the result must not be mutated.
+    """
+    value_type = type(value)
+    if value_type in _JSON_SCALAR_TYPES:
+        return value
+    if value_type is dict:
+        return _sanitize_dict(value)
+    if value_type is list:
+        return _sanitize_list(value)
+    return _sanitize_object(value)
+
+
+def estimate_json_size(value: Any) -> int:
+    """
+    Roughly estimate the size of a value encoded in JSON, without encoding it.
+    Characters are counted instead of UTF-8 bytes, and escapes are ignored.
+    """
+    value_type = type(value)
+    if value_type is str:
+        return len(value) + 2
+    if value_type is dict:
+        return 2 + sum(
+            len(str(key)) + 4 + estimate_json_size(item) for key, item in value.items()
+        )
+    if value_type is list or value_type is tuple:
+        return 2 + sum(estimate_json_size(item) + 1 for item in value)
+    if value is None or value_type is bool:
+        return 5
+    if value_type is int or value_type is float:
+        return 8
+    return len(str(value)) + 2
+
+
+def truncate_json(value: Any, max_size: int) -> Tuple[Any, bool]:
+    """
+    Truncate a JSON-native value so that its size estimated by ``estimate_json_size``
+    fits in ``max_size``. Long strings are cut, and the last items of lists and
+    dictionaries are dropped once the budget is spent. Only truncated containers
+    are copied.
+
+    Returns:
+        Tuple[Any, bool]: The value, and whether it has been truncated.
+    """
+    if estimate_json_size(value) <= max_size:
+        return value, False
+    value, _ = _truncate(value, max_size)
+    return value, True
+
+
+def _truncate(value: Any, max_size: int) -> Tuple[Any, int]:
+    """Truncate a value, and return it with its estimated size."""
+    value_type = type(value)
+    if value_type is str:
+        if len(value) + 2 <= max_size:
+            return value, len(value) + 2
+        kept = max(max_size - 2 - len(_TRUNCATED_SUFFIX), 0)
+        return value[:kept] + _TRUNCATED_SUFFIX, kept + len(_TRUNCATED_SUFFIX) + 2
+    if value_type is dict:
+        truncated_dict = {}
+        size = 2
+        changed = False
+        for key, item in value.items():
+            key_size = len(str(key)) + 4
+            if size + key_size >= max_size:
+                changed = True
+                break
+            truncated_item, item_size = _truncate(item, max_size - size - key_size)
+            changed = changed or truncated_item is not item
+            truncated_dict[key] = truncated_item
+            size += key_size + item_size
+        return (truncated_dict if changed else value), size
+    if value_type is list or value_type is tuple:
+        truncated_list = []
+        size = 2
+        changed = False
+        for item in value:
+            if size + 1 >= max_size:
+                changed = True
+                break
+            truncated_item, item_size = _truncate(item, max_size - size - 1)
+            changed = changed or truncated_item is not item
+            truncated_list.append(truncated_item)
+            size += item_size + 1
+        return (truncated_list if changed else value), size
+    return value, estimate_json_size(value)
+
+
+def _sanitize_dict(value: dict) -> dict:
+    for key, item in value.items():
+        if type(key) is not str or type(item) not in _JSON_SCALAR_TYPES:
+            break
+    else:
+        # fast path: a flat dict of JSON scalars
+        return value
+
+    sanitized = {}
+    for key, item in value.items():
+        if type(key) is not str:
+            key = _sanitize_key(key)
+        if type(item) not in _JSON_SCALAR_TYPES:
+            item = sanitize_json(item)
+        sanitized[key] = item
+    return sanitized
+
+
+def _sanitize_list(value: list) -> list:
+    for item in value:
+        if type(item) not in _JSON_SCALAR_TYPES:
+            break
+    else:
+        # fast path: a flat list of JSON scalars
+        return value
+
+    return [
+        item if type(item) in _JSON_SCALAR_TYPES else sanitize_json(item)
+        for item in value
+    ]
+
+
+def _sanitize_key(key: Any) -> str:
+    # same conversion as the key handling of json.dumps
+    if isinstance(key, str):
+        return str.__str__(key)
+    if key is True:
+        return "true"
+    if key is False:
+        return "false"
+    if key is None:
+        return "null"
+    if isinstance(key, int):
+        return int.__repr__(key)
+    if isinstance(key, float):
+        return float.__repr__(key)
+    raise TypeError(
+        f"keys must be str, int, float, bool or None, not {key.__class__.__name__}"
+    )
+
+
+def _sanitize_object(value: Any) -> Any:
+    # subclasses of JSON types are encoded as their base types by json.dumps
+    if isinstance(value, str):
+        return str.__str__(value)
+    if isinstance(value, int):
+        return int.__int__(value)
+    if isinstance(value, float):
+        return float.__float__(value)
+    if isinstance(value, (list, tuple)):
+        return [sanitize_json(item) for item in value]
+    if isinstance(value, dict):
+        return {_sanitize_key(key): sanitize_json(item) for key, item in value.items()}
+    return sanitize_json(serialize_json(value))
@@ -0,0 +1,85 @@
+import logging
+import threading
+import time
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+from google.cloud.logging import Client
+
+
+def pytest_addoption(parser):
+    parser.addoption(
+        "--run-benchmark",
+        action="store_true",
+        default=False,
+        help="run benchmarks marked with @pytest.mark.benchmark",
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--run-benchmark"):
+        return
+    skip_benchmark = pytest.mark.skip(reason="need --run-benchmark option to run")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
+def make_record(
+    message: str = "message", name: str = "test_logger", level: int = logging.INFO
+) -> logging.LogRecord:
+    """Log record of a plain message, to be given to filters and transports."""
+    return logging.LogRecord(
+        name=name,
+        level=level,
+        pathname="tests/conftest.py",
+        lineno=1,
+        msg=message,
+        args=None,
+        exc_info=None,
+    )
+
+
+class FakeLoggingAPI:
+    """
+    Local fake of the Logging API which records written entries.
+    It can inject latency and failures into writes.
+    """
+
+    def __init__(self):
+        self.writes = []
+        self.resources = []
+        self.delay = 0.0
+        self.failures = 0
+        self._lock = threading.Lock()
+
+    def write_entries(
+        self, entries, logger_name=None, resource=None, labels=None, **kwargs
+    ):
+        if self.delay:
+            time.sleep(self.delay)
+        with self._lock:
+            if self.failures > 0:
+                self.failures -= 1
+                raise ConnectionError("injected failure")
+            self.writes.append(entries)
+            self.resources.append(resource)
+
+    @property
+    def entries(self):
+        with self._lock:
+            return [entry for entries in self.writes for entry in entries]
+
+
+@pytest.fixture
+def logging_api() -> FakeLoggingAPI:
+    return FakeLoggingAPI()
+
+
+@pytest.fixture
+def logging_client(logging_api: FakeLoggingAPI) -> Client:
+    client = Client(
+        project="test-project", credentials=AnonymousCredentials(), _use_grpc=False
+    )
+    client._logging_api = logging_api
+    return client
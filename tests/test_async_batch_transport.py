@@ -0,0 +1,202 @@
+import asyncio
+import logging
+import threading
+
+from google.cloud.logging import Client
+from google.cloud.logging_v2.resource import Resource
+
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import FastAPILoggingHandler
+from fastapi_cloud_logging.transports import AsyncBatchTransport
+
+from .conftest import make_record
+
+
+def test_flush_on_batch_size(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(
+        logging_client, "python", batch_size=10, max_latency=10
+    )
+
+    async def main():
+        for index in range(25):
+            transport.send(make_record(f"message {index}"), f"message {index}")
+        await asyncio.sleep(0.1)
+        written = [len(entries) for entries in logging_api.writes]
+        await transport.aclose()
+        return written
+
+    assert asyncio.run(main()) == [10, 10]
+    assert [len(entries) for entries in logging_api.writes] == [10, 10, 5]
+    assert [entry["textPayload"] for entry in logging_api.entries] == [
+        f"message {index}" for index in range(25)
+    ]
+
+
+def test_flush_on_max_latency(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(
+        logging_client, "python", batch_size=100, max_latency=0.01
+    )
+
+    async def main():
+        for index in range(3):
+            transport.send(make_record(f"message {index}"), f"message {index}")
+        await asyncio.sleep(0.2)
+        return len(logging_api.writes)
+
+    assert asyncio.run(main()) == 1
+    assert len(logging_api.entries) == 3
+    entry = logging_api.entries[0]
+    assert entry["severity"] == 200
+    assert entry["labels"] == {"python_logger": "test_logger"}
+
+
+def test_entries_sent_before_loop_starts(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(logging_client, "python")
+    transport.send(make_record("before loop"), "before loop")
+    assert logging_api.writes == []
+
+    async def main():
+        transport.send(make_record("in loop"), "in loop")
+        await transport.drain()
+
+    asyncio.run(main())
+    assert [entry["textPayload"] for entry in logging_api.entries] == [
+        "before loop",
+        "in loop",
+    ]
+
+
+def test_send_from_another_thread(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(logging_client, "python", max_latency=0.01)
+
+    async def main():
+        transport.send(make_record("in loop"), "in loop")
+        thread = threading.Thread(
+            target=transport.send, args=(make_record("in thread"), "in thread")
+        )
+        thread.start()
+        await asyncio.get_running_loop().run_in_executor(None, thread.join)
+        await asyncio.sleep(0.05)
+        await transport.aclose()
+
+    asyncio.run(main())
+    assert sorted(entry["textPayload"] for entry in logging_api.entries) == [
+        "in loop",
+        "in thread",
+    ]
+
+
+def test_flush_on_loop_thread(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(
+        logging_client, "python", batch_size=100, max_latency=60
+    )
+
+    async def main():
+        transport.send(make_record("flushed"), "flushed")
+        await asyncio.sleep(0.01)
+        # on the loop thread, flush does not block, and does not wait for max_latency
+        transport.flush()
+        for _ in range(100):
+            if logging_api.writes:
+                break
+            await asyncio.sleep(0.01)
+        written = len(logging_api.writes)
+        await transport.aclose()
+        return written
+
+    assert asyncio.run(main()) == 1
+    assert [entry["textPayload"] for entry in logging_api.entries] == ["flushed"]
+
+
+def test_flush_from_another_thread(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(
+        logging_client, "python", batch_size=100, max_latency=60
+    )
+
+    async def main():
+        transport.send(make_record("flushed"), "flushed")
+        await asyncio.sleep(0.01)
+        await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(None, transport.flush), 5
+        )
+        written = len(logging_api.writes)
+        await transport.aclose()
+        return written
+
+    assert asyncio.run(main()) == 1
+
+
+def test_flush_without_loop(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(logging_client, "python")
+    transport.send(make_record("no loop"), "no loop")
+    transport.flush()
+    assert [entry["textPayload"] for entry in logging_api.entries] == ["no loop"]
+
+
+def test_write_left_entries_on_loop_shutdown(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(logging_client, "python", max_latency=10)
+
+    async def main():
+        transport.send(make_record("left"), "left")
+
+    asyncio.run(main())
+    assert [entry["textPayload"] for entry in logging_api.entries] == ["left"]
+
+
+def test_failed_batch_is_reported(logging_client: Client, logging_api, capsys):
+    logging_api.failures = 1
+    transport = AsyncBatchTransport(logging_client, "python", max_latency=0)
+
+    async def main():
+        transport.send(make_record("failed"), "failed")
+        await transport.drain()
+        transport.send(make_record("succeeded"), "succeeded")
+        await transport.aclose()
+
+    asyncio.run(main())
+    assert [entry["textPayload"] for entry in logging_api.entries] == ["succeeded"]
+    assert "Failed to submit 1 logs." in capsys.readouterr().err
+
+
+def test_with_handler_and_shutdown(logging_client: Client, logging_api):
+    from fastapi import FastAPI
+
+    handler = FastAPILoggingHandler(
+        logging_client,
+        transport=AsyncBatchTransport,
+        resource=Resource(type="global", labels={}),
+    )
+    logger = logging.Logger("handler_logger")
+    logger.addHandler(handler)
+    app = FastAPI()
+    handler.transport.register_shutdown(app)
+
+    async def main():
+        await app.router.startup()
+        logger.warning("Hello")
+        await app.router.shutdown()
+
+    asyncio.run(main())
+    (entry,) = logging_api.entries
+    assert entry["textPayload"] == "Hello"
+    assert entry["severity"] == 400
+    assert entry["labels"] == {"python_logger": "handler_logger"}
+
+
+def test_send_batch(logging_client: Client, logging_api):
+    transport = AsyncBatchTransport(logging_client, "python", max_latency=10)
+    items = [
+        (make_record(f"message {index}"), f"message {index}", {}) for index in range(3)
+    ]
+    transport.send_batch(items[:1])
+
+    async def main():
+        transport.send_batch(items[1:])
+        await transport.aclose()
+
+    asyncio.run(main())
+    assert [len(entries) for entries in logging_api.writes] == [3]
+    assert [entry["textPayload"] for entry in logging_api.entries] == [
+        "message 0",
+        "message 1",
+        "message 2",
+    ]
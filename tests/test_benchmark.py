@@ -0,0 +1,308 @@
+"""
+Benchmarks for hot paths of this library.
+
+They are skipped by default. Run them with::
+
+    pytest tests/test_benchmark.py --run-benchmark -s
+"""
+import asyncio
+import json
+import logging
+import time
+from datetime import datetime
+from logging import LogRecord
+
+import pytest
+from fastapi import FastAPI
+from google.cloud.logging_v2.entries import LogEntry
+from google.cloud.logging_v2.handlers._helpers import _parse_xcloud_trace
+from google.cloud.logging_v2.handlers.transports.base import Transport
+from google.cloud.logging_v2.resource import Resource
+from starlette.datastructures import Headers
+
+from fastapi_cloud_logging import FastAPILoggingHandler, FastAPIQueueHandler
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import FastAPILoggingFilter
+from fastapi_cloud_logging.request_logging_middleware import (
+    _FASTAPI_REQUEST_CONTEXT,
+    ASGIRequestLoggingMiddleware,
+    FastAPIRequestContext,
+    RequestLoggingMiddleware,
+)
+from fastapi_cloud_logging.transports._helpers import build_entry
+from fastapi_cloud_logging.utils import sanitize_json, serialize_json
+
+pytestmark = pytest.mark.benchmark
+
+
+def _report(name: str, **values):
+    formatted = ", ".join(f"{key}={value:,.2f}" for key, value in values.items())
+    print(f"\n[benchmark] {name}: {formatted}")
+
+
+def _http_scope() -> dict:
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "GET",
+        "scheme": "https",
+        "server": ("example.com", 443),
+        "root_path": "",
+        "path": "/",
+        "raw_path": b"/",
+        "query_string": b"",
+        "headers": Headers(
+            {
+                "host": "example.com",
+                "user-agent": "curl/7.77.0",
+                "x-cloud-trace-context": "105445aa7843bc8bf206b12000100000/1;o=1",
+            }
+        ).raw,
+        "client": ("127.0.0.1", 50000),
+    }
+
+
+async def _call(app) -> None:
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    await app(_http_scope(), receive, send)
+
+
+def _requests_per_second(app, requests: int) -> float:
+    async def main() -> float:
+        # warm up
+        for _ in range(100):
+            await _call(app)
+        started = time.perf_counter()
+        for _ in range(requests):
+            await _call(app)
+        return requests / (time.perf_counter() - started)
+
+    return asyncio.run(main())
+
+
+def _build_app(middleware_class) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(middleware_class)
+
+    @app.get("/")
+    async def root():
+        return {"message": "Hello World"}
+
+    return app
+
+
+def test_middleware_requests_per_second():
+    requests = 3000
+    legacy = _requests_per_second(_build_app(RequestLoggingMiddleware), requests)
+    asgi = _requests_per_second(_build_app(ASGIRequestLoggingMiddleware), requests)
+    _report(
+        "middleware requests/sec",
+        base_http_middleware=legacy,
+        asgi_middleware=asgi,
+        speedup=asgi / legacy,
+    )
+    assert asgi > legacy
+
+
+class _PerRecordFilter(FastAPILoggingFilter):
+    """Filter that builds request data for every record, as before memoization."""
+
+    def get_request_data(self):
+        request = _FASTAPI_REQUEST_CONTEXT.get()
+        if request is None:
+            return None, None, None, False
+        http_request = {
+            "requestMethod": request.request_method,
+            "requestUrl": request.request_url,
+            "requestSize": request.content_length,
+            "userAgent": request.user_agent,
+            "remoteIp": request.remote_ip,
+            "referer": request.referer,
+            "protocol": request.protocol,
+        }
+        trace_id, span_id, trace_sampled = _parse_xcloud_trace(
+            request.cloud_trace_content
+        )
+        return http_request, trace_id, span_id, trace_sampled
+
+
+def _log_record(message: str) -> LogRecord:
+    return LogRecord(
+        name="benchmark",
+        level=20,
+        pathname="tests/test_benchmark.py",
+        lineno=1,
+        msg=message,
+        args=None,
+        exc_info=None,
+    )
+
+
+def _microseconds_per_record(
+    logging_filter: FastAPILoggingFilter, requests: int, records_per_request: int
+) -> float:
+    records = [_log_record("info") for _ in range(records_per_request)]
+    elapsed = 0
+    for _ in range(requests):
+        _FASTAPI_REQUEST_CONTEXT.set(FastAPIRequestContext.from_scope(_http_scope()))
+        started = time.perf_counter_ns()
+        for record in records:
+            logging_filter.filter(record)
+        elapsed += time.perf_counter_ns() - started
+    _FASTAPI_REQUEST_CONTEXT.set(None)
+    return elapsed / 1000 / (requests * records_per_request)
+
+
+@pytest.mark.parametrize("records_per_request", [1, 50])
+def test_filter_cost_per_record(records_per_request: int):
+    requests = 20000 // records_per_request
+    per_record = _microseconds_per_record(
+        _PerRecordFilter(project="benchmark"), requests, records_per_request
+    )
+    memoized = _microseconds_per_record(
+        FastAPILoggingFilter(project="benchmark"), requests, records_per_request
+    )
+    _report(
+        f"filter us/record with {records_per_request} records/request",
+        per_record=per_record,
+        memoized=memoized,
+    )
+    if records_per_request > 1:
+        assert memoized < per_record
+
+
+def _nested_extra(depth: int) -> dict:
+    extra = {"user_id": "user1234", "created_at": datetime(2022, 6, 9, 22, 33)}
+    for level in range(depth):
+        extra = {"level": level, "items": [1, 2, 3], "child": extra}
+    return extra
+
+
+@pytest.mark.parametrize(
+    "name, extra",
+    [
+        ("small", {"user_id": "user1234", "count": 3}),
+        (
+            "medium",
+            {
+                **{f"key_{index}": f"value_{index}" for index in range(30)},
+                "ids": list(range(30)),
+                "user": {"id": "user1234", "groups": ["admin", "staff"]},
+            },
+        ),
+        ("deeply nested", _nested_extra(depth=20)),
+    ],
+)
+def test_sanitize_extras(name: str, extra: dict):
+    iterations = 20000
+
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        json.loads(json.dumps(extra, default=serialize_json))
+    round_trip = (time.perf_counter_ns() - started) / 1000 / iterations
+
+    started = time.perf_counter_ns()
+    for _ in range(iterations):
+        sanitize_json(extra)
+    single_pass = (time.perf_counter_ns() - started) / 1000 / iterations
+
+    _report(f"{name} extra us/record", round_trip=round_trip, single_pass=single_pass)
+    assert single_pass < round_trip
+
+
+class _BuildEntryTransport(Transport):
+    def __init__(self, client, name, **kwargs):
+        pass
+
+    def send(self, record, message, **kwargs):
+        build_entry(record, message, **kwargs)
+
+
+def _loop_stall_us(logger: logging.Logger, requests: int, records: int) -> list:
+    """Time each log call blocks the event loop for, in microseconds."""
+
+    async def main() -> list:
+        stalls = []
+        for _ in range(requests):
+            _FASTAPI_REQUEST_CONTEXT.set(
+                FastAPIRequestContext.from_scope(_http_scope())
+            )
+            for index in range(records):
+                started = time.perf_counter_ns()
+                logger.info("Hello %s", "Bob", extra={"labels": {"index": str(index)}})
+                stalls.append((time.perf_counter_ns() - started) / 1000)
+            await asyncio.sleep(0)
+        _FASTAPI_REQUEST_CONTEXT.set(None)
+        return stalls
+
+    return sorted(asyncio.run(main()))
+
+
+def test_queue_handler_loop_stall(mocker):
+    handler = FastAPILoggingHandler(
+        mocker.Mock(project="benchmark"),
+        transport=_BuildEntryTransport,
+        resource=Resource(type="global", labels={}),
+    )
+    logger = logging.Logger("benchmark")
+    logger.addHandler(handler)
+    direct = _loop_stall_us(logger, requests=2000, records=5)
+
+    queue_handler = FastAPIQueueHandler()
+    listener = queue_handler.create_listener(handler)
+    logger.handlers = [queue_handler]
+    listener.start()
+    try:
+        queued = _loop_stall_us(logger, requests=2000, records=5)
+    finally:
+        listener.stop()
+
+    for name, stalls in [("direct", direct), ("queue", queued)]:
+        _report(
+            f"{name} handler loop stall us/record",
+            mean=sum(stalls) / len(stalls),
+            p99=stalls[int(len(stalls) * 0.99)],
+        )
+    assert sum(queued) < sum(direct)
+
+
+def _request_bytes(entries: list, **kwargs) -> int:
+    api_entries = [LogEntry(payload=entry.pop("message"), **entry) for entry in entries]
+    request = {"entries": [entry.to_api_repr() for entry in api_entries], **kwargs}
+    return len(json.dumps(request, default=str))
+
+
+def test_shared_resource_request_bytes():
+    resource = Resource(
+        type="cloud_run_revision",
+        labels={
+            "project_id": "benchmark",
+            "service_name": "api",
+            "revision_name": "api-00042-abc",
+            "location": "asia-northeast1",
+            "configuration_name": "api",
+        },
+    )
+    records = [_log_record(f"message {index}") for index in range(100)]
+    repeated = _request_bytes(
+        [build_entry(record, record.msg, resource=resource) for record in records]
+    )
+    shared = _request_bytes(
+        [
+            build_entry(record, record.msg, shared_resource=resource, resource=resource)
+            for record in records
+        ],
+        resource=resource._to_dict(),
+    )
+
+    _report("request bytes per 100 entries", repeated=repeated, shared=shared)
+    assert shared < repeated
@@ -0,0 +1,254 @@
+import asyncio
+import logging
+
+import pytest
+from google.cloud.logging import Client
+from google.cloud.logging_v2.resource import Resource
+from google.cloud.logging_v2.handlers import setup_logging
+from google.cloud.logging_v2.handlers.handlers import EXCLUDED_LOGGER_DEFAULTS
+from google.cloud.logging_v2.handlers.transports import SyncTransport
+from pytest_mock import MockerFixture
+
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import FastAPILoggingHandler
+from fastapi_cloud_logging.request_logging_middleware import (
+    ASGIRequestLoggingMiddleware,
+)
+from fastapi_cloud_logging.transports import (
+    BoundedBackgroundThreadTransport,
+    OverflowPolicy,
+)
+from fastapi_cloud_logging.transports.bounded import _BoundedQueue
+
+
+def _entry(message: str, severity: int = 200) -> dict:
+    return {"message": message, "severity": severity}
+
+
+def _messages(bounded_queue: _BoundedQueue) -> list:
+    return [entry["message"] for entry in bounded_queue.queue]
+
+
+@pytest.fixture
+def resource() -> Resource:
+    return Resource(type="global", labels={})
+
+
+def test_drop_newest():
+    bounded_queue = _BoundedQueue(max_entries=2, overflow_policy="drop_newest")
+    assert bounded_queue.offer(_entry("a")) is True
+    assert bounded_queue.offer(_entry("b")) is True
+    assert bounded_queue.offer(_entry("c", severity=500)) is False
+    assert _messages(bounded_queue) == ["a", "b"]
+    assert bounded_queue.stats() == {
+        "queued_entries": 2,
+        "queued_bytes": 0,
+        "dropped_entries": 1,
+        "dropped_by_severity": {"ERROR": 1},
+    }
+
+
+def test_drop_oldest():
+    bounded_queue = _BoundedQueue(max_entries=2, overflow_policy="drop_oldest")
+    for message in ["a", "b", "c"]:
+        assert bounded_queue.offer(_entry(message)) is True
+    assert _messages(bounded_queue) == ["b", "c"]
+    assert bounded_queue.dropped_entries == 1
+    # evicted entries are not waited for by join
+    assert bounded_queue.unfinished_tasks == 2
+
+
+def test_drop_below_warning():
+    bounded_queue = _BoundedQueue(
+        max_entries=2, overflow_policy=OverflowPolicy.DROP_BELOW_WARNING
+    )
+    bounded_queue.offer(_entry("warning", severity=400))
+    bounded_queue.offer(_entry("info", severity=200))
+    assert bounded_queue.offer(_entry("debug", severity=100)) is False
+    assert bounded_queue.offer(_entry("error", severity=500)) is True
+    assert _messages(bounded_queue) == ["warning", "error"]
+    # without entries below WARNING, the oldest entry is dropped
+    assert bounded_queue.offer(_entry("critical", severity=600)) is True
+    assert _messages(bounded_queue) == ["error", "critical"]
+    assert bounded_queue.stats()["dropped_by_severity"] == {
+        "DEBUG": 1,
+        "INFO": 1,
+        "WARNING": 1,
+    }
+
+
+def test_block_with_timeout():
+    bounded_queue = _BoundedQueue(max_entries=1, block_timeout=0.01)
+    assert bounded_queue.offer(_entry("a")) is True
+    assert bounded_queue.offer(_entry("b")) is False
+    assert bounded_queue.get() == _entry("a")
+    assert bounded_queue.offer(_entry("c")) is True
+
+
+def test_max_bytes():
+    bounded_queue = _BoundedQueue(max_bytes=600, overflow_policy="drop_newest")
+    assert bounded_queue.offer(_entry("a" * 10)) is True
+    assert bounded_queue.offer(_entry("b" * 10)) is True
+    assert bounded_queue.offer(_entry("c" * 10)) is False
+    assert bounded_queue.offer(_entry("d" * 1000)) is False
+    assert bounded_queue.stats()["queued_bytes"] == 2 * (12 + 256)
+    bounded_queue.get()
+    assert bounded_queue.stats()["queued_bytes"] == 12 + 256
+
+
+def test_with_slow_api(logging_client: Client, logging_api, resource: Resource):
+    logging_api.delay = 0.05
+    handler = FastAPILoggingHandler(
+        logging_client,
+        resource=resource,
+        max_queue_entries=5,
+        overflow_policy="drop_newest",
+    )
+    logger = logging.Logger("bounded_logger")
+    logger.addHandler(handler)
+    transport = handler.transport
+    assert isinstance(transport, BoundedBackgroundThreadTransport)
+
+    for index in range(50):
+        logger.info("message %d", index)
+        assert transport.stats()["queued_entries"] <= 5
+    transport.flush()
+    transport.worker.stop(grace_period=1)
+
+    dropped = transport.dropped_entries
+    assert dropped > 0
+    assert len(logging_api.entries) == 50 - dropped
+    assert transport.stats()["dropped_by_severity"] == {"INFO": dropped}
+
+
+def test_without_limits(logging_client: Client, logging_api, resource: Resource):
+    handler = FastAPILoggingHandler(logging_client, resource=resource)
+    logger = logging.Logger("unbounded_logger")
+    logger.addHandler(handler)
+    for index in range(20):
+        logger.info("message %d", index)
+    handler.transport.flush()
+    handler.transport.worker.stop(grace_period=1)
+    assert len(logging_api.entries) == 20
+    assert handler.transport.dropped_entries == 0
+
+
+def test_share_default_resource_in_batch(
+    logging_client: Client, logging_api, resource: Resource
+):
+    handler = FastAPILoggingHandler(logging_client, resource=resource)
+    logger = logging.Logger("shared_resource_logger")
+    logger.addHandler(handler)
+    logger.info("from the handler")
+    handler.transport.worker.enqueue_entries(
+        [
+            {
+                "message": "decoded",
+                "severity": 200,
+                "resource": Resource(**resource._asdict()),
+            }
+        ]
+    )
+    handler.transport.flush()
+    handler.transport.worker.stop(grace_period=1)
+
+    assert all(written == resource._to_dict() for written in logging_api.resources)
+    assert [entry.get("resource") for entry in logging_api.entries] == [None, None]
+
+
+def test_limits_require_bounded_transport(logging_client: Client, resource: Resource):
+    with pytest.raises(ValueError):
+        FastAPILoggingHandler(
+            logging_client,
+            transport=SyncTransport,
+            resource=resource,
+            max_queue_entries=10,
+        )
+
+
+def test_offer_many():
+    bounded_queue = _BoundedQueue(max_entries=3, overflow_policy="drop_newest")
+    assert bounded_queue.offer_many([_entry("a"), _entry("b")]) == 2
+    assert bounded_queue.offer_many([_entry("c"), _entry("d")]) == 1
+    assert _messages(bounded_queue) == ["a", "b", "c"]
+    assert bounded_queue.unfinished_tasks == 3
+    assert bounded_queue.dropped_entries == 1
+
+
+def test_request_buffering_with_middleware(
+    logging_client: Client, logging_api, resource: Resource
+):
+    handler = FastAPILoggingHandler(
+        logging_client, resource=resource, request_buffering=True
+    )
+    logger = logging.Logger("buffered_logger")
+    logger.addHandler(handler)
+    transport = handler.transport
+    queued = []
+
+    async def app(scope, receive, send):
+        for index in range(5):
+            logger.info("message %d", index)
+        queued.append(transport.stats()["queued_entries"])
+
+    scope = {"type": "http", "method": "GET", "headers": [], "path": "/"}
+    asyncio.run(ASGIRequestLoggingMiddleware(app)(scope, None, None))
+    transport.flush()
+    transport.worker.stop(grace_period=1)
+
+    assert queued == [0]
+    assert [entry["textPayload"] for entry in logging_api.entries] == [
+        f"message {index}" for index in range(5)
+    ]
+    assert logging_api.entries[0]["httpRequest"]["requestMethod"] == "GET"
+
+
+@pytest.fixture
+def root_logger(mocker: MockerFixture):
+    mocker.patch(
+        "google.cloud.logging_v2.handlers.handlers.detect_resource",
+        return_value=Resource(type="global", labels={}),
+    )
+    root = logging.getLogger()
+    handlers, level = root.handlers[:], root.level
+    excluded = {
+        name: (logger.propagate, logger.handlers[:])
+        for name, logger in (
+            (name, logging.getLogger(name)) for name in EXCLUDED_LOGGER_DEFAULTS
+        )
+    }
+    yield root
+    root.handlers[:] = handlers
+    root.setLevel(level)
+    for name, (propagate, logger_handlers) in excluded.items():
+        logger = logging.getLogger(name)
+        logger.propagate = propagate
+        logger.handlers[:] = logger_handlers
+
+
+@pytest.mark.parametrize("collect_stats", [False, True])
+def test_failed_batch_is_not_logged_to_handler(
+    logging_client: Client,
+    logging_api,
+    resource: Resource,
+    root_logger: logging.Logger,
+    collect_stats: bool,
+    capsys,
+):
+    logging_api.failures = 10**9
+    handler = FastAPILoggingHandler(
+        logging_client,
+        resource=resource,
+        max_queue_entries=1,
+        overflow_policy="block",
+        collect_stats=collect_stats,
+    )
+    setup_logging(handler)
+    logging.getLogger("failing_logger").error("lost")
+    handler.transport.flush()
+    handler.transport.worker.stop(grace_period=1)
+
+    # the failure does not come back into the queue as another failing batch
+    assert logging_api.failures == 10**9 - 1
+    assert "Failed to submit 1 logs." in capsys.readouterr().err
+    if collect_stats:
+        assert handler.stats.as_dict()["api_errors"] == 1
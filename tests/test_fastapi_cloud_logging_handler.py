@@ -1,6 +1,10 @@
+import gc
+import sys
+import tracemalloc
 from logging import LogRecord
 
 import pytest
+from google.cloud.logging_v2.resource import Resource
 from pytest_mock import MockerFixture
 
 from fastapi_cloud_logging.fastapi_cloud_logging_handler import (
@@ -183,3 +187,405 @@ def test_get_request_data_with_no_context(logging_filter: FastAPILoggingFilter):
     assert trace_id is None
     assert span_id is None
     assert trace_sampled is False
+
+
+def test_request_data_is_memoized_per_request():
+    logging_filter = FastAPILoggingFilter(project="sample-project")
+    token = _FASTAPI_REQUEST_CONTEXT.set(
+        FastAPIRequestContext(
+            request_method="GET",
+            request_url="https://example.com/api/v1/users/me",
+            content_length=None,
+            user_agent="curl/7.77.0",
+            remote_ip="127.0.0.1",
+            referer=None,
+            protocol="https",
+            cloud_trace_content="105445ab7f43bc8bf206b12000100000/2a;o=1",
+        )
+    )
+    try:
+        records = [
+            LogRecord(
+                name="some_log",
+                level=3,
+                pathname="tests/test_fastapi_cloud_logging_handler.py",
+                lineno=31,
+                msg=f"info {index}",
+                args=None,
+                exc_info=None,
+            )
+            for index in range(2)
+        ]
+        for record in records:
+            assert logging_filter.filter(record) is True
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    first, second = records
+    assert first._http_request is second._http_request
+    assert first._trace is second._trace
+    assert (
+        first._trace
+        == "projects/sample-project/traces/105445ab7f43bc8bf206b12000100000"
+    )
+    assert second._span_id == "2a"
+    assert second._trace_sampled is True
+    assert first._source_location is second._source_location
+    assert first._labels is second._labels
+    assert first._http_request_str is second._http_request_str
+
+
+def test_filter_with_user_labels_and_source_location():
+    logging_filter = FastAPILoggingFilter(default_labels={"env": "test"})
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        record = LogRecord(
+            name="some_log",
+            level=3,
+            pathname="tests/test_fastapi_cloud_logging_handler.py",
+            lineno=31,
+            msg="info",
+            args=None,
+            exc_info=None,
+        )
+        record.labels = {"user_id": "1234"}
+        record.source_location = {"file": "app.py", "line": "1"}
+        logging_filter.filter(record)
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert record._labels == {
+        "python_logger": "some_log",
+        "env": "test",
+        "user_id": "1234",
+    }
+    assert record._source_location == {"file": "app.py", "line": "1"}
+    assert record._source_location_str == '{"file":"app.py","line":"1"}'
+    assert record._http_request_str == "{}"
+
+
+def test_filter_with_max_payload_size():
+    logging_filter = FastAPILoggingFilter(max_payload_size=1000)
+    extra = {"items": list(range(1000))}
+    record = LogRecord(
+        name="some_log",
+        level=20,
+        pathname="tests/test_fastapi_cloud_logging_handler.py",
+        lineno=31,
+        msg="Hello %s",
+        args=("x" * 600,),
+        exc_info=None,
+    )
+    record.json_fields = extra
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        logging_filter.filter(record)
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert record.getMessage() == "Hello " + "x" * 600
+    assert record.args is None
+    assert record.json_fields["truncated"] is True
+    assert 0 < len(record.json_fields["items"]) < 1000
+    assert len(extra["items"]) == 1000
+
+
+def test_filter_with_max_payload_size_truncates_message():
+    logging_filter = FastAPILoggingFilter(max_payload_size=100)
+    record = LogRecord(
+        name="some_log",
+        level=20,
+        pathname="tests/test_fastapi_cloud_logging_handler.py",
+        lineno=31,
+        msg="x" * 1000,
+        args=None,
+        exc_info=None,
+    )
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        logging_filter.filter(record)
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert record.msg == "x" * 95 + "..."
+    assert record.json_fields == {"truncated": True}
+
+
+def test_filter_with_max_payload_size_and_small_record():
+    logging_filter = FastAPILoggingFilter(max_payload_size=1000)
+    record = LogRecord(
+        name="some_log",
+        level=20,
+        pathname="tests/test_fastapi_cloud_logging_handler.py",
+        lineno=31,
+        msg="Hello %s",
+        args=("Bob",),
+        exc_info=None,
+    )
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        logging_filter.filter(record)
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert record.getMessage() == "Hello Bob"
+    assert not hasattr(record, "json_fields")
+
+
+def test_filter_allocations_per_record():
+    logging_filter = FastAPILoggingFilter(project="sample-project")
+    context = FastAPIRequestContext.from_scope(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "https",
+            "server": ("example.com", 443),
+            "path": "/users/me",
+            "query_string": b"",
+            "headers": [
+                (b"x-cloud-trace-context", b"105445aa7843bc8bf206b12000100000/1;o=1")
+            ],
+            "client": ("127.0.0.1", 50000),
+        }
+    )
+    assert not hasattr(context, "__dict__")
+
+    def create_record() -> LogRecord:
+        return LogRecord(
+            name="some_log",
+            level=20,
+            pathname="tests/test_fastapi_cloud_logging_handler.py",
+            lineno=31,
+            msg="Hello %s",
+            args=("Bob",),
+            exc_info=None,
+        )
+
+    records = [create_record() for _ in range(1000)]
+    token = _FASTAPI_REQUEST_CONTEXT.set(context)
+    try:
+        # the request data is built by the first record
+        logging_filter.filter(create_record())
+        gc.collect()
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        for record in records:
+            logging_filter.filter(record)
+        after = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    blocks = sum(
+        stat.count_diff
+        for stat in after.compare_to(before, "filename")
+        if stat.traceback[0].filename != tracemalloc.__file__
+    )
+    # only the attributes of a record grow its __dict__
+    assert blocks / len(records) <= 3
+
+
+def test_filter_with_loguru_extra_and_error(logging_filter: FastAPILoggingFilter):
+    try:
+        raise ValueError("invalid")
+    except ValueError:
+        exc_info = sys.exc_info()
+    extra = {"user_id": "user1234"}
+    log_record: LogRecord = LogRecord(
+        name="some_log",
+        level=40,
+        pathname="tests/test_fastapi_cloud_logging_handler.py",
+        lineno=31,
+        msg="error",
+        args=None,
+        exc_info=exc_info,
+    )
+    setattr(log_record, "extra", extra)
+    filtered = logging_filter.filter(log_record)
+    assert filtered is True
+    assert log_record.json_fields["user_id"] == "user1234"
+    assert len(log_record.json_fields["traceback"]) == 1
+    assert extra == {"user_id": "user1234"}
+
+
+def _buffering_handler(mocker: MockerFixture, **kwargs) -> FastAPILoggingHandler:
+    transport = mocker.Mock(spec=["send", "send_batch", "flush"])
+    return FastAPILoggingHandler(
+        mocker.Mock(project="test-project"),
+        transport=mocker.Mock(return_value=transport),
+        resource=Resource(type="global", labels={}),
+        request_buffering=True,
+        **kwargs,
+    )
+
+
+def _log(handler: FastAPILoggingHandler, msg: str, level: int = 20) -> None:
+    handler.handle(
+        LogRecord(
+            name="some_log",
+            level=level,
+            pathname="tests/test_fastapi_cloud_logging_handler.py",
+            lineno=31,
+            msg=msg,
+            args=None,
+            exc_info=None,
+        )
+    )
+
+
+def _batched_messages(transport) -> list:
+    return [
+        [message for _, message, _ in call.args[0]]
+        for call in transport.send_batch.call_args_list
+    ]
+
+
+def test_request_buffering(mocker: MockerFixture):
+    handler = _buffering_handler(mocker)
+    request_context = FastAPIRequestContext.from_scope(
+        {"type": "http", "method": "GET", "headers": [], "path": "/"}
+    )
+    token = _FASTAPI_REQUEST_CONTEXT.set(request_context)
+    try:
+        for index in range(3):
+            _log(handler, f"message {index}")
+        handler.transport.send_batch.assert_not_called()
+        request_context.complete()
+        # records after the response are sent one by one
+        _log(handler, "after response")
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert _batched_messages(handler.transport) == [
+        ["message 0", "message 1", "message 2"]
+    ]
+    assert [call.args[1] for call in handler.transport.send.call_args_list] == [
+        "after response"
+    ]
+    _, _, kwargs = handler.transport.send_batch.call_args.args[0][0]
+    assert kwargs["http_request"]["requestMethod"] == "GET"
+
+
+def test_request_buffering_flushes_early(mocker: MockerFixture):
+    handler = _buffering_handler(
+        mocker, request_buffer_size=2, request_buffer_flush_level=30
+    )
+    request_context = FastAPIRequestContext.from_scope(
+        {"type": "http", "method": "GET", "headers": [], "path": "/"}
+    )
+    token = _FASTAPI_REQUEST_CONTEXT.set(request_context)
+    try:
+        for msg in ["a", "b", "c", "d"]:
+            _log(handler, msg)
+        _log(handler, "e")
+        _log(handler, "warning", level=30)
+        _log(handler, "f")
+        request_context.complete()
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert _batched_messages(handler.transport) == [
+        ["a", "b"],
+        ["c", "d"],
+        ["e", "warning"],
+        ["f"],
+    ]
+    handler.transport.send.assert_not_called()
+
+
+def test_request_buffering_without_send_batch(mocker: MockerFixture):
+    transport = mocker.Mock(spec=["send", "flush"])
+    handler = FastAPILoggingHandler(
+        mocker.Mock(project="test-project"),
+        transport=mocker.Mock(return_value=transport),
+        resource=Resource(type="global", labels={}),
+        request_buffering=True,
+    )
+    request_context = FastAPIRequestContext.from_scope(
+        {"type": "http", "method": "GET", "headers": [], "path": "/"}
+    )
+    token = _FASTAPI_REQUEST_CONTEXT.set(request_context)
+    try:
+        _log(handler, "a")
+        _log(handler, "b")
+        transport.send.assert_not_called()
+        request_context.complete()
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+    assert [call.args[1] for call in transport.send.call_args_list] == ["a", "b"]
+
+
+def _tail_sampling_handler(mocker: MockerFixture, **kwargs) -> FastAPILoggingHandler:
+    transport = mocker.Mock(spec=["send", "send_batch", "flush"])
+    return FastAPILoggingHandler(
+        mocker.Mock(project="test-project"),
+        transport=mocker.Mock(return_value=transport),
+        resource=Resource(type="global", labels={}),
+        tail_sampling=True,
+        **kwargs,
+    )
+
+
+def _sent_messages(transport) -> list:
+    return [call.args[1] for call in transport.send.call_args_list] + [
+        message
+        for call in transport.send_batch.call_args_list
+        for _, message, _ in call.args[0]
+    ]
+
+
+def _run_request(handler, messages, status_code=200, latency_ns=1000) -> None:
+    request_context = FastAPIRequestContext.from_scope(
+        {"type": "http", "method": "GET", "headers": [], "path": "/"}
+    )
+    token = _FASTAPI_REQUEST_CONTEXT.set(request_context)
+    try:
+        for msg, level in messages:
+            _log(handler, msg, level=level)
+        request_context.status_code = status_code
+        request_context.latency_ns = latency_ns
+        request_context.complete()
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+
+@pytest.mark.parametrize(
+    "status_code,latency_ns,expected",
+    [
+        (200, 1000, ["warning"]),
+        (500, 1000, ["warning", "debug", "info"]),
+        (None, 1000, ["warning", "debug", "info"]),
+        (200, 2 * 10**9, ["warning", "debug", "info"]),
+    ],
+)
+def test_tail_sampling(mocker: MockerFixture, status_code, latency_ns, expected):
+    handler = _tail_sampling_handler(mocker, tail_sampling_latency=1.0)
+    _run_request(
+        handler,
+        [("debug", 10), ("info", 20), ("warning", 30)],
+        status_code=status_code,
+        latency_ns=latency_ns,
+    )
+    assert _sent_messages(handler.transport) == expected
+
+
+def test_tail_sampling_keeps_records_on_error(mocker: MockerFixture):
+    handler = _tail_sampling_handler(mocker)
+    _run_request(handler, [("info", 20), ("error", 40), ("after error", 20)])
+    # held records are sent with the error without waiting for the response
+    assert _batched_messages(handler.transport) == [["info", "error"]]
+    assert _sent_messages(handler.transport) == ["after error", "info", "error"]
+
+
+def test_tail_sampling_keep_rate(mocker: MockerFixture):
+    handler = _tail_sampling_handler(mocker, tail_sampling_keep_rate=1.0)
+    _run_request(handler, [("info", 20)])
+    assert _sent_messages(handler.transport) == ["info"]
+
+
+def test_tail_sampling_with_request_buffering(mocker: MockerFixture):
+    handler = _tail_sampling_handler(
+        mocker, request_buffering=True, request_buffer_size=2
+    )
+    _run_request(handler, [("info", 20)] * 3 + [("warning", 30)])
+    assert _batched_messages(handler.transport) == [["warning"]]
@@ -0,0 +1,133 @@
+import math
+from collections import namedtuple
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from decimal import Decimal
+from enum import Enum
+from typing import Any
+from uuid import UUID
+
+import pytest
+
+from fastapi_cloud_logging.json_encoder import (
+    JSONEncoder,
+    OrjsonJSONEncoder,
+    StdlibJSONEncoder,
+    get_json_encoder,
+)
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+requires_orjson = pytest.mark.skipif(orjson is None, reason="orjson is not installed")
+
+
+@dataclass
+class DataObject:
+    id: str
+    created_at: datetime
+
+
+class Status(Enum):
+    ACTIVE = "active"
+
+
+Point = namedtuple("Point", ["x", "y"])
+
+
+class Plain:
+    def __init__(self):
+        self.name = "plain"
+
+
+PAYLOADS = [
+    "str",
+    "日本語",
+    12,
+    -1.25,
+    True,
+    None,
+    [],
+    {},
+    ["a", 1, None, 0.1],
+    {"message": "Hello", "user": {"id": "user1234", "tags": ["a", "b"]}},
+    {"quote": 'say "hi"\n', "unicode": "é", "emoji": "\U0001F600"},
+    {"sign_in_at": datetime(2022, 6, 12, 22, 33, 1, 123456)},
+    {"sign_in_at": datetime(2022, 6, 12, 22, 33, tzinfo=timezone.utc)},
+    {"birthday": date(2000, 1, 1)},
+    {2: "int key", True: "bool key", None: "null key"},
+    {"big": 2**70},
+    {"point": Point(1, 2), "pair": (1, "a")},
+    DataObject(id="id123", created_at=datetime(2022, 6, 9, 22, 33)),
+    {"object": Plain()},
+    {
+        "id": UUID("12345678-1234-5678-1234-567812345678"),
+        "status": Status.ACTIVE,
+        "price": Decimal("1.10"),
+        "tags": {"admin"},
+        "raw": b"bytes",
+        "elapsed": timedelta(seconds=1),
+    },
+]
+
+
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_stdlib_round_trip(payload: Any):
+    encoder = StdlibJSONEncoder()
+    encoded = encoder.dumps(payload)
+    # compact, without escaping non-ASCII characters
+    assert ", " not in encoded and ": " not in encoded
+    assert "\\u" not in encoded
+    assert encoder.dumps(encoder.loads(encoded)) == encoded
+
+
+def test_encoder_must_implement_dumps_and_loads():
+    class DumpsOnly(JSONEncoder):
+        def dumps(self, obj: Any) -> str:
+            return ""
+
+    with pytest.raises(TypeError):
+        DumpsOnly()
+
+
+@requires_orjson
+@pytest.mark.parametrize("payload", PAYLOADS)
+def test_backends_produce_identical_output(payload: Any):
+    stdlib = StdlibJSONEncoder()
+    fast = OrjsonJSONEncoder()
+    encoded = stdlib.dumps(payload)
+    assert fast.dumps(payload) == encoded
+    assert fast.loads(encoded) == stdlib.loads(encoded)
+
+
+@requires_orjson
+@pytest.mark.parametrize(
+    "value,stdlib_output,orjson_output",
+    [
+        (1e16, "1e+16", "1e16"),
+        (math.nan, "NaN", "null"),
+        (math.inf, "Infinity", "null"),
+    ],
+)
+def test_backends_differ_only_in_float_notation(
+    value: float, stdlib_output: str, orjson_output: str
+):
+    assert StdlibJSONEncoder().dumps([value]) == f"[{stdlib_output}]"
+    assert OrjsonJSONEncoder().dumps([value]) == f"[{orjson_output}]"
+
+
+def test_get_json_encoder():
+    default = OrjsonJSONEncoder if orjson is not None else StdlibJSONEncoder
+    assert isinstance(get_json_encoder(), default)
+    assert isinstance(get_json_encoder("json"), StdlibJSONEncoder)
+    encoder = StdlibJSONEncoder()
+    assert get_json_encoder(encoder) is encoder
+    with pytest.raises(ValueError):
+        get_json_encoder("unknown")
+
+
+@requires_orjson
+def test_get_orjson_encoder():
+    assert isinstance(get_json_encoder("orjson"), OrjsonJSONEncoder)
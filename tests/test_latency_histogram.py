@@ -0,0 +1,164 @@
+import asyncio
+import logging
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from fastapi_cloud_logging import ASGIRequestLoggingMiddleware, RequestLoggingMiddleware
+from fastapi_cloud_logging.latency_histogram import (
+    LatencyHistogram,
+    RouteLatencyHistograms,
+    _bucket_index,
+    _bucket_upper_bound,
+)
+from fastapi_cloud_logging.request_logging_middleware import (
+    _FASTAPI_REQUEST_CONTEXT,
+    FastAPIRequestContext,
+)
+
+
+def test_buckets_are_contiguous():
+    previous = -1
+    for value in range(0, 100_000, 7):
+        index = _bucket_index(value)
+        assert value <= _bucket_upper_bound(index)
+        assert index >= previous
+        previous = index
+        # relative error is bounded by the number of sub-buckets
+        assert _bucket_upper_bound(index) - value <= max(value / 32, 1)
+
+
+def test_percentiles():
+    histogram = LatencyHistogram(max_latency=10)
+    for millis in range(1, 1001):
+        histogram.record(millis * 1_000_000)
+    snapshot = histogram.snapshot()
+    assert snapshot["count"] == 1000
+    assert snapshot["max"] == 1.0
+    assert snapshot["p50"] == pytest.approx(0.5, rel=0.04)
+    assert snapshot["p90"] == pytest.approx(0.9, rel=0.04)
+    assert snapshot["p99"] == pytest.approx(0.99, rel=0.04)
+    assert LatencyHistogram().percentile(50) is None
+
+
+def test_fixed_memory_per_key():
+    histogram = LatencyHistogram(max_latency=1)
+    buckets = len(histogram._counts)
+    # latencies over max_latency are counted in the last bucket
+    histogram.record(100 * 10**9)
+    assert len(histogram._counts) == buckets
+    assert histogram._counts[-1] == 1
+    assert histogram.percentile(100) == 100.0
+
+
+def _create_app(middleware_class, histograms: RouteLatencyHistograms) -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(middleware_class, latency_histograms=histograms)
+
+    @app.get("/users/{user_id}")
+    def get_user(user_id: int):
+        return {"user_id": user_id}
+
+    return app
+
+
+@pytest.mark.parametrize(
+    "middleware_class", [ASGIRequestLoggingMiddleware, RequestLoggingMiddleware]
+)
+def test_keyed_by_route_template(middleware_class):
+    histograms = RouteLatencyHistograms()
+    transport = httpx.ASGITransport(app=_create_app(middleware_class, histograms))
+
+    async def main():
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            for user_id in range(3):
+                await client.get(f"/users/{user_id}")
+            await client.get("/users/invalid")
+            await client.get("/unknown")
+
+    asyncio.run(main())
+
+    snapshot = histograms.snapshot()
+    assert sorted(snapshot) == [
+        "GET /users/{user_id} 2xx",
+        "GET /users/{user_id} 4xx",
+        "GET <unmatched> 4xx",
+    ]
+    assert snapshot["GET /users/{user_id} 2xx"]["count"] == 3
+    assert set(snapshot["GET /users/{user_id} 2xx"]) == {
+        "count",
+        "max",
+        "p50",
+        "p90",
+        "p99",
+    }
+
+
+@pytest.mark.parametrize(
+    "middleware_class", [ASGIRequestLoggingMiddleware, RequestLoggingMiddleware]
+)
+def test_keyed_by_mount_path(middleware_class):
+    histograms = RouteLatencyHistograms()
+    app = _create_app(middleware_class, histograms)
+    sub_app = FastAPI()
+
+    @sub_app.get("/users/{user_id}")
+    def get_sub_user(user_id: int):
+        return {"user_id": user_id}
+
+    app.mount("/sub", sub_app)
+    app.root_path = "/api"
+    transport = httpx.ASGITransport(app=app)
+
+    async def main():
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://testserver"
+        ) as client:
+            await client.get("/users/1")
+            await client.get("/sub/users/1")
+
+    asyncio.run(main())
+
+    assert sorted(histograms.snapshot()) == [
+        "GET /sub/users/{user_id} 2xx",
+        "GET /users/{user_id} 2xx",
+    ]
+
+
+def test_summary_log(caplog):
+    histograms = RouteLatencyHistograms(summary_interval=0)
+    with caplog.at_level(logging.INFO, logger="fastapi_cloud_logging.latency"):
+        histograms.record("GET", "/items", 200, 5_000_000)
+        histograms.record("GET", "/items", None, 5_000_000)
+
+    assert len(caplog.records) == 2
+    summary = caplog.records[-1].json_fields["latency"]
+    assert list(summary) == ["GET /items 5xx"]
+    # histograms are reset by periodic summaries
+    assert histograms.snapshot() == {}
+
+
+def test_summary_log_without_request_context(caplog):
+    contexts = []
+
+    def capture_context(record: logging.LogRecord) -> bool:
+        contexts.append(_FASTAPI_REQUEST_CONTEXT.get())
+        return True
+
+    histograms = RouteLatencyHistograms(summary_interval=0)
+    context = FastAPIRequestContext(
+        "GET", "https://example.com/items", None, None, None, None, "https", None
+    )
+    caplog.handler.addFilter(capture_context)
+    token = _FASTAPI_REQUEST_CONTEXT.set(context)
+    try:
+        with caplog.at_level(logging.INFO, logger="fastapi_cloud_logging.latency"):
+            histograms.record("GET", "/items", 200, 5_000_000)
+        assert _FASTAPI_REQUEST_CONTEXT.get() is context
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert contexts == [None]
@@ -66,3 +66,18 @@ def test_exception_not_including_trace(mocker: MockerFixture):
     assert args["source_location"] is not None
     assert message_payloads["message"] == "An error has occurred"
     assert ("traceback" in message_payloads) is False
+
+
+@pytest.mark.parametrize("json_encoder", ["json", "orjson"])
+def test_json_message(mocker: MockerFixture, json_encoder: str):
+    pytest.importorskip(json_encoder)
+    logger = Logger("json_logger")
+    logging_handler = FastAPILoggingHandler(
+        mocker.Mock(), transport=mocker.Mock(), json_encoder=json_encoder
+    )
+    logger.addHandler(logging_handler)
+    logger.info('{"user": "Bob", "age": 20}')
+
+    (record, message_payloads), _ = logging_handler.transport.send.call_args
+    assert message_payloads == {"user": "Bob", "age": 20}
+    assert record._labels_str == '{"python_logger":"json_logger"}'
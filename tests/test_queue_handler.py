@@ -0,0 +1,154 @@
+import logging
+import threading
+
+from google.cloud.logging_v2.resource import Resource
+from pytest_mock import MockerFixture
+
+from fastapi_cloud_logging import (
+    FastAPILoggingHandler,
+    FastAPIQueueHandler,
+    setup_queue_logging,
+)
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import _RequestLogBuffer
+from fastapi_cloud_logging.request_logging_middleware import (
+    _FASTAPI_REQUEST_CONTEXT,
+    FastAPIRequestContext,
+)
+
+
+class _RecordingHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.handled = []
+
+    def emit(self, record):
+        self.handled.append(
+            (record, threading.get_ident(), _FASTAPI_REQUEST_CONTEXT.get())
+        )
+
+
+def _request_context() -> FastAPIRequestContext:
+    return FastAPIRequestContext.from_scope(
+        {
+            "type": "http",
+            "method": "GET",
+            "scheme": "https",
+            "server": ("example.com", 443),
+            "path": "/users/me",
+            "query_string": b"",
+            "headers": [],
+        }
+    )
+
+
+def test_records_are_handled_on_listener_thread():
+    queue_handler = FastAPIQueueHandler()
+    recording_handler = _RecordingHandler()
+    listener = queue_handler.create_listener(recording_handler)
+    logger = logging.Logger("queue_logger")
+    logger.addHandler(queue_handler)
+
+    request_context = _request_context()
+    listener.start()
+    token = _FASTAPI_REQUEST_CONTEXT.set(request_context)
+    try:
+        logger.info("in request %s", "Bob")
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        logger.info("outside of request")
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+    listener.stop()
+
+    (first, thread_id, context), (second, _, no_context) = recording_handler.handled
+    assert thread_id != threading.get_ident()
+    assert context is request_context
+    assert no_context is None
+    assert first.getMessage() == "in request Bob"
+    # the record is not formatted by the queue handler
+    assert first.args == ("Bob",)
+
+
+def test_with_cloud_logging_handler(mocker: MockerFixture):
+    handler = FastAPILoggingHandler(
+        mocker.Mock(project="test-project"),
+        transport=mocker.Mock(),
+        resource=Resource(type="global", labels={}),
+    )
+    logger = logging.Logger("queue_logger")
+    listener = setup_queue_logging(handler, logger=logger)
+
+    token = _FASTAPI_REQUEST_CONTEXT.set(_request_context())
+    try:
+        try:
+            1 / 0
+        except ZeroDivisionError:
+            logger.exception("An error has occurred")
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+    listener.stop()
+
+    (record, message), kwargs = handler.transport.send.call_args
+    assert message["message"] == "An error has occurred"
+    assert len(message["traceback"]) == 1
+    assert kwargs["http_request"]["requestUrl"] == "https://example.com/users/me"
+    assert logger.level == logging.INFO
+
+
+def test_records_handled_after_request_completes(mocker: MockerFixture):
+    handler = FastAPILoggingHandler(
+        mocker.Mock(project="test-project"),
+        transport=mocker.Mock(spec=["send", "send_batch"]),
+        resource=Resource(type="global", labels={}),
+        request_buffering=True,
+    )
+    queue_handler = FastAPIQueueHandler()
+    listener = queue_handler.create_listener(handler)
+    logger = logging.Logger("queue_logger")
+    logger.addHandler(queue_handler)
+
+    request_context = _request_context()
+    token = _FASTAPI_REQUEST_CONTEXT.set(request_context)
+    try:
+        logger.info("late")
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+    # the listener is behind, and handles the record after the request completes
+    request_context.complete()
+    listener.start()
+    listener.stop()
+
+    (record, message), _ = handler.transport.send.call_args
+    assert record.getMessage() == "late"
+    handler.transport.send_batch.assert_not_called()
+
+
+def test_complete_request_waits_for_record_being_buffered(mocker: MockerFixture):
+    handler = FastAPILoggingHandler(
+        mocker.Mock(project="test-project"),
+        transport=mocker.Mock(spec=["send", "send_batch"]),
+        resource=Resource(type="global", labels={}),
+        request_buffering=True,
+    )
+    request_context = _request_context()
+    record = logging.LogRecord("queue_logger", logging.INFO, "", 1, "held", None, None)
+    buffer = request_context.get_log_buffer(handler, lambda: _RequestLogBuffer(10))
+    completed = threading.Event()
+
+    def complete():
+        request_context.complete()
+        completed.set()
+
+    # a listener thread holds the handler while it adds a record to the buffer
+    with handler.lock:
+        thread = threading.Thread(target=complete)
+        thread.start()
+        assert not completed.wait(0.05)
+        assert request_context.get_log_buffer(handler) is None
+        buffer.records.append((record, "held", {}))
+    thread.join()
+
+    ((items,), _) = handler.transport.send_batch.call_args
+    assert [item[0] for item in items] == [record]
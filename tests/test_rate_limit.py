@@ -0,0 +1,172 @@
+import logging
+
+import pytest
+from pytest_mock import MockerFixture
+
+from fastapi_cloud_logging import RateLimitFilter, rate_limit
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        super().__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+@pytest.fixture
+def clock(mocker: MockerFixture):
+    mocked_time = mocker.patch.object(rate_limit, "time")
+    mocked_time.monotonic.return_value = 1000.0
+    return mocked_time
+
+
+@pytest.fixture
+def logger():
+    logger = logging.getLogger("test_rate_limit")
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    yield logger
+    logger.handlers = []
+
+
+def _setup(logger: logging.Logger, **kwargs):
+    handler = _ListHandler()
+    rate_limit_filter = RateLimitFilter(handler=handler, **kwargs)
+    handler.addFilter(rate_limit_filter)
+    logger.addHandler(handler)
+    return handler, rate_limit_filter
+
+
+def _log(logger: logging.Logger, index: int) -> None:
+    logger.warning("User %s not found", index)
+
+
+def test_suppress_identical_records(clock, logger: logging.Logger):
+    handler, _ = _setup(logger, max_records=2, window=10.0)
+    for index in range(5):
+        _log(logger, index)
+    # another call site is another key
+    logger.warning("User %s not found", 5)
+    logger.info("User %s not found", 6)
+
+    assert [record.getMessage() for record in handler.records] == [
+        "User 0 not found",
+        "User 1 not found",
+        "User 5 not found",
+        "User 6 not found",
+    ]
+
+
+def test_summary_after_window(clock, logger: logging.Logger):
+    handler, _ = _setup(logger, max_records=1, window=10.0)
+    for index in range(4):
+        _log(logger, index)
+    handler.records.clear()
+
+    clock.monotonic.return_value = 1011.0
+    _log(logger, 4)
+
+    summary, record = handler.records
+    assert summary.getMessage() == "Suppressed 3 records of: User %s not found"
+    assert summary.levelno == logging.WARNING
+    assert summary.name == "test_rate_limit"
+    assert summary.funcName == "_log"
+    assert summary.json_fields["rate_limit"]["suppressed"] == 3
+    assert summary.json_fields["rate_limit"]["window"] == 10.0
+    first = summary.json_fields["rate_limit"]["first_suppressed"]
+    last = summary.json_fields["rate_limit"]["last_suppressed"]
+    assert first <= last
+    # a new window has started
+    assert record.getMessage() == "User 4 not found"
+
+
+def test_summary_of_closed_window_on_sweep(clock, logger: logging.Logger):
+    handler, _ = _setup(logger, max_records=1, window=5.0)
+    for index in range(3):
+        _log(logger, index)
+    handler.records.clear()
+
+    clock.monotonic.return_value = 1006.0
+    logger.info("Another message")
+
+    summary, record = handler.records
+    assert summary.getMessage() == "Suppressed 2 records of: User %s not found"
+    assert record.getMessage() == "Another message"
+
+
+def test_summary_on_eviction(clock, logger: logging.Logger):
+    handler, rate_limit_filter = _setup(logger, max_records=1, max_keys=2)
+    for index in range(3):
+        _log(logger, index)
+    logger.info("first")
+    logger.info("second")
+
+    assert len(rate_limit_filter._windows) == 2
+    assert [record.getMessage() for record in handler.records] == [
+        "User 0 not found",
+        "first",
+        "Suppressed 2 records of: User %s not found",
+        "second",
+    ]
+
+
+def test_flush(clock, logger: logging.Logger):
+    handler, rate_limit_filter = _setup(logger, max_records=1)
+    for index in range(3):
+        _log(logger, index)
+    rate_limit_filter.flush()
+    rate_limit_filter.flush()
+    _log(logger, 3)
+    rate_limit_filter.flush()
+
+    assert [record.getMessage() for record in handler.records] == [
+        "User 0 not found",
+        "Suppressed 2 records of: User %s not found",
+        "Suppressed 1 records of: User %s not found",
+    ]
+
+
+def test_invalid_max_records():
+    with pytest.raises(ValueError):
+        RateLimitFilter(max_records=0)
+
+
+def test_summary_only_to_its_handler(clock, logger: logging.Logger):
+    handler, _ = _setup(logger, max_records=1, window=10.0)
+    other_handler = _ListHandler()
+    logger.addHandler(other_handler)
+    for index in range(3):
+        _log(logger, index)
+    clock.monotonic.return_value = 1011.0
+    _log(logger, 3)
+
+    assert [record.getMessage() for record in handler.records] == [
+        "User 0 not found",
+        "Suppressed 2 records of: User %s not found",
+        "User 3 not found",
+    ]
+    # the other handler gets every record, but no summary
+    assert [record.getMessage() for record in other_handler.records] == [
+        f"User {index} not found" for index in range(4)
+    ]
+
+
+def test_summary_to_logger_without_handler(clock, logger: logging.Logger):
+    handler = _ListHandler()
+    logger.addHandler(handler)
+    logger.addFilter(RateLimitFilter(max_records=1, window=10.0))
+    try:
+        for index in range(3):
+            _log(logger, index)
+        clock.monotonic.return_value = 1011.0
+        _log(logger, 3)
+    finally:
+        logger.filters = []
+
+    assert [record.getMessage() for record in handler.records] == [
+        "User 0 not found",
+        "Suppressed 2 records of: User %s not found",
+        "User 3 not found",
+    ]
@@ -1,10 +1,18 @@
+import asyncio
+import logging
+
 import pytest
 from fastapi import Request
 from pytest_mock import MockerFixture
+from starlette.background import BackgroundTask
 from starlette.datastructures import Headers
+from starlette.responses import PlainTextResponse
 
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import FastAPILoggingFilter
 from fastapi_cloud_logging.request_logging_middleware import (
     _FASTAPI_REQUEST_CONTEXT,
+    ASGIRequestLoggingMiddleware,
+    FastAPIRequestContext,
     RequestLoggingMiddleware,
 )
 
@@ -130,3 +138,221 @@ def test__parse_request(
     assert request_context.user_agent == user_agent
     assert request_context.referer == referer
     assert request_context.cloud_trace_content == trace_content
+
+
+def _http_scope(headers: dict, scope_type: str = "http") -> dict:
+    return {
+        "type": scope_type,
+        "method": "GET",
+        "scheme": "https",
+        "server": ("example.com", 443),
+        "root_path": "",
+        "path": "/api/v1/users/me",
+        "query_string": b"page=2",
+        "headers": Headers(headers).raw,
+        "client": ("127.0.0.1", 80),
+    }
+
+
+def _run_asgi_middleware(scope: dict):
+    captured = {}
+
+    async def app(scope, receive, send):
+        captured["context"] = _FASTAPI_REQUEST_CONTEXT.get()
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    async def main():
+        _FASTAPI_REQUEST_CONTEXT.set(None)
+        await ASGIRequestLoggingMiddleware(app)(scope, receive, send)
+        captured["after"] = _FASTAPI_REQUEST_CONTEXT.get()
+
+    asyncio.run(main())
+    return captured
+
+
+def test_asgi_middleware_sets_request_context():
+    captured = _run_asgi_middleware(
+        _http_scope(
+            {
+                "User-Agent": "curl 7.79.1",
+                "Content-Length": "64",
+                "Referer": "https://example.com/signin",
+                "X-Cloud-Trace-Context": "105445aa7843bc8bf206b12000100000/1;o=1",
+            }
+        )
+    )
+    request_context = captured["context"]
+    assert request_context is not None
+    assert request_context.request_method == "GET"
+    assert request_context.request_url == "https://example.com/api/v1/users/me?page=2"
+    assert request_context.protocol == "https"
+    assert request_context.content_length == 64
+    assert request_context.user_agent == "curl 7.79.1"
+    assert request_context.remote_ip == "127.0.0.1"
+    assert request_context.referer == "https://example.com/signin"
+    assert (
+        request_context.cloud_trace_content == "105445aa7843bc8bf206b12000100000/1;o=1"
+    )
+    assert captured["after"] is None
+
+
+def test_asgi_middleware_prefers_forwarded_for():
+    captured = _run_asgi_middleware(_http_scope({"X-Forwarded-For": "192.168.0.1"}))
+    assert captured["context"].remote_ip == "192.168.0.1"
+
+
+def test_asgi_middleware_skips_non_http_scope():
+    captured = _run_asgi_middleware(_http_scope({}, scope_type="websocket"))
+    assert captured["context"] is None
+
+
+def test_asgi_middleware_matches_legacy_parsing(middleware: RequestLoggingMiddleware):
+    scope = _http_scope({"User-Agent": "curl 7.79.1", "Content-Length": "invalid"})
+    captured = _run_asgi_middleware(scope)
+    assert captured["context"] == middleware._parse_request(Request(scope))
+
+
+def test_request_context_is_parsed_lazily():
+    scope = _http_scope({"User-Agent": "curl 7.79.1"})
+    request_context = FastAPIRequestContext.from_scope(scope)
+    assert request_context._headers is None
+    assert request_context._url is None
+
+    assert request_context.user_agent == "curl 7.79.1"
+    assert request_context._headers is not None
+    assert request_context._url is None
+
+    # parsed values are memoized and do not read the scope again
+    scope["headers"] = []
+    assert request_context.user_agent == "curl 7.79.1"
+    assert request_context.referer is None
+
+
+def test_request_context_with_explicit_values():
+    request_context = FastAPIRequestContext(
+        request_method="GET",
+        request_url="https://example.com/",
+        content_length=None,
+        user_agent=None,
+        remote_ip="127.0.0.1",
+        referer=None,
+        protocol="https",
+        cloud_trace_content=None,
+    )
+    assert request_context.request_method == "GET"
+    assert request_context.request_url == "https://example.com/"
+    assert request_context.user_agent is None
+    assert request_context.remote_ip == "127.0.0.1"
+
+
+def test_asgi_middleware_records_status_and_latency():
+    sent = []
+
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": 404, "headers": []})
+        await send({"type": "http.response.body", "body": b"not found"})
+
+    async def send(message):
+        sent.append(message["type"])
+
+    request_context = None
+
+    async def capture(scope, receive, send):
+        nonlocal request_context
+        request_context = _FASTAPI_REQUEST_CONTEXT.get()
+        await app(scope, receive, send)
+
+    asyncio.run(ASGIRequestLoggingMiddleware(capture)(_http_scope({}), None, send))
+    assert sent == ["http.response.start", "http.response.body"]
+    assert request_context.status_code == 404
+    assert request_context.completed is True
+    assert request_context.latency_ns > 0
+    assert request_context.http_request["status"] == 404
+    assert request_context.http_request["responseSize"] == 9
+    assert request_context.http_request["latency"].endswith("s")
+
+
+def test_asgi_middleware_latency_excludes_background_tasks():
+    response = PlainTextResponse(
+        "accepted", status_code=202, background=BackgroundTask(asyncio.sleep, 0.2)
+    )
+    request_context = None
+
+    async def app(scope, receive, send):
+        nonlocal request_context
+        request_context = _FASTAPI_REQUEST_CONTEXT.get()
+        await response(scope, receive, send)
+
+    async def send(message):
+        pass
+
+    asyncio.run(ASGIRequestLoggingMiddleware(app)(_http_scope({}), None, send))
+    assert request_context.status_code == 202
+    assert 0 < request_context.latency_ns < 200_000_000
+
+
+def test_response_data_in_http_request():
+    request_context = FastAPIRequestContext.from_scope(_http_scope({}))
+    assert "status" not in request_context.http_request
+    request_context.status_code = 200
+    request_context.response_size = 0
+    request_context.latency_ns = 1_234_567_890
+    assert request_context.http_request["status"] == 200
+    assert request_context.http_request["responseSize"] == 0
+    assert request_context.http_request["latency"] == "1.234567890s"
+
+
+@pytest.mark.parametrize(
+    "status,level",
+    [(200, logging.INFO), (404, logging.WARNING), (503, logging.ERROR)],
+)
+def test_asgi_middleware_access_log(caplog, status: int, level: int):
+    async def app(scope, receive, send):
+        await send({"type": "http.response.start", "status": status, "headers": []})
+        await send({"type": "http.response.body", "body": b"body"})
+
+    async def send(message):
+        pass
+
+    middleware = ASGIRequestLoggingMiddleware(app, access_log=True)
+    caplog.handler.addFilter(FastAPILoggingFilter())
+    with caplog.at_level(logging.INFO, logger="fastapi_cloud_logging.access"):
+        asyncio.run(middleware(_http_scope({}), None, send))
+
+    (record,) = caplog.records
+    assert record.levelno == level
+    assert record.getMessage() == (
+        f"GET https://example.com/api/v1/users/me?page=2 {status}"
+    )
+    # the access log is written with the response data
+    assert record.http_request["status"] == status
+    assert record.http_request["responseSize"] == 4
+
+
+def test_legacy_middleware_access_log(caplog):
+    async def endpoint(scope, receive, send):
+        response = PlainTextResponse("created", status_code=201)
+        await response(scope, receive, send)
+
+    middleware = RequestLoggingMiddleware(endpoint, access_log=True)
+    messages = [{"type": "http.request", "body": b"", "more_body": False}]
+
+    async def receive():
+        return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        pass
+
+    caplog.handler.addFilter(FastAPILoggingFilter())
+    with caplog.at_level(logging.INFO, logger="fastapi_cloud_logging.access"):
+        asyncio.run(middleware(_http_scope({}), receive, send))
+
+    (record,) = caplog.records
+    assert record.levelno == logging.INFO
+    assert record.http_request["status"] == 201
+    assert record.http_request["responseSize"] == 7
@@ -0,0 +1,326 @@
+import datetime
+import os
+
+import pytest
+from google.api_core.exceptions import InvalidArgument
+from google.cloud.logging import Client
+from google.cloud.logging_v2.resource import Resource
+from pytest_mock import MockerFixture
+
+from fastapi_cloud_logging.transports import (
+    CircuitState,
+    ResilientBackgroundThreadTransport,
+)
+from fastapi_cloud_logging.transports.resilient import _SpillFile
+
+from .conftest import make_record
+
+
+def _send(transport: ResilientBackgroundThreadTransport, *messages: str) -> None:
+    for message in messages:
+        transport.send(make_record(message), message)
+    transport.flush()
+
+
+def _payloads(logging_api) -> list:
+    return [entry["textPayload"] for entry in logging_api.entries]
+
+
+def _collect(written: list):
+    def write(entries) -> bool:
+        written.extend(entries)
+        return True
+
+    return write
+
+
+@pytest.fixture
+def spill_path(tmp_path) -> str:
+    return str(tmp_path / "spill.log")
+
+
+def test_retry_failed_batch(logging_client: Client, logging_api):
+    logging_api.failures = 2
+    logging_api.delay = 0.01
+    transport = ResilientBackgroundThreadTransport(
+        logging_client, "python", initial_backoff=0.001, max_retries=3
+    )
+    _send(transport, "a", "b")
+
+    assert _payloads(logging_api) == ["a", "b"]
+    stats = transport.stats()
+    assert stats["retries"] == 2
+    assert stats["circuit_state"] == "closed"
+    assert stats["dropped_batches"] == 0
+    transport.worker.stop()
+
+
+def test_spill_while_circuit_is_open(
+    logging_client: Client, logging_api, spill_path: str, capsys
+):
+    logging_api.failures = 1000
+    transport = ResilientBackgroundThreadTransport(
+        logging_client,
+        "python",
+        max_retries=1,
+        initial_backoff=0.001,
+        failure_threshold=1,
+        reset_timeout=60,
+        spill_path=spill_path,
+    )
+    _send(transport, "a")
+    assert transport.circuit_state is CircuitState.OPEN
+    _send(transport, "b")
+
+    stats = transport.stats()
+    assert stats["spilled_entries"] == 2
+    assert stats["spill_bytes"] == os.path.getsize(spill_path) > 0
+    # no API call while the circuit is open
+    assert logging_api.failures == 1000 - 2
+    assert "holding logs for 60 seconds" in capsys.readouterr().err
+
+    # the API is back after reset_timeout
+    logging_api.failures = 0
+    transport.worker._opened_at -= 60
+    _send(transport, "c")
+
+    assert _payloads(logging_api) == ["a", "b", "c"]
+    assert transport.circuit_state is CircuitState.CLOSED
+    stats = transport.stats()
+    assert stats["replayed_entries"] == 2
+    assert stats["spill_bytes"] == 0
+    assert os.path.getsize(spill_path) == 0
+    transport.worker.stop()
+
+
+def test_half_open_failure_opens_circuit(
+    logging_client: Client, logging_api, spill_path: str
+):
+    logging_api.failures = 1
+    transport = ResilientBackgroundThreadTransport(
+        logging_client,
+        "python",
+        max_retries=0,
+        failure_threshold=1,
+        spill_path=spill_path,
+    )
+    _send(transport, "a")
+    logging_api.failures = 1
+    transport.worker._opened_at -= 60
+    _send(transport, "b")
+
+    # a single attempt is made in the half-open state, to replay "a"
+    assert logging_api.failures == 0
+    assert transport.circuit_state is CircuitState.OPEN
+    assert transport.stats()["spilled_entries"] == 2
+    transport.worker.stop()
+
+
+def test_drop_without_spill_file(logging_client: Client, logging_api, capsys):
+    logging_api.failures = 1
+    transport = ResilientBackgroundThreadTransport(
+        logging_client, "python", max_retries=0, failure_threshold=1
+    )
+    _send(transport, "a")
+
+    assert transport.stats()["dropped_batches"] == 1
+    assert "Failed to submit 1 logs." in capsys.readouterr().err
+    transport.worker.stop()
+
+
+def test_replay_entries_of_previous_process(
+    logging_client: Client, logging_api, spill_path: str
+):
+    spill = _SpillFile(spill_path, max_bytes=1024 * 1024)
+    spill.append([{"textPayload": "from previous process"}])
+
+    transport = ResilientBackgroundThreadTransport(
+        logging_client, "python", spill_path=spill_path
+    )
+    _send(transport, "a")
+
+    assert _payloads(logging_api) == ["from previous process", "a"]
+    transport.worker.stop()
+
+
+def test_spill_file_keeps_entries_not_replayed(spill_path: str):
+    spill = _SpillFile(spill_path, max_bytes=1024 * 1024)
+    spill.append([{"textPayload": str(index)} for index in range(5)])
+    written = []
+
+    def write(entries):
+        if written:
+            return False
+        written.extend(entries)
+        return True
+
+    assert spill.replay(write, batch_size=2) is False
+    assert [entry["textPayload"] for entry in written] == ["0", "1"]
+
+    written.clear()
+    assert spill.replay(_collect(written), batch_size=10) is True
+    assert [entry["textPayload"] for entry in written] == ["2", "3", "4"]
+    assert spill.size == 0
+
+
+def test_spill_file_is_bounded(spill_path: str):
+    spill = _SpillFile(spill_path, max_bytes=100)
+    assert spill.append([{"textPayload": "a"}]) is True
+    assert spill.append([{"textPayload": "x" * 100}]) is False
+    assert spill.size == os.path.getsize(spill_path)
+
+
+def test_spill_file_drops_incomplete_entry(spill_path: str, capsys):
+    spill = _SpillFile(spill_path, max_bytes=1024)
+    spill.append([{"textPayload": "a"}])
+    with open(spill_path, "ab") as file:
+        file.write(b"\x00\x00\x01")
+    spill.size += 3
+    written = []
+
+    assert spill.replay(_collect(written), batch_size=10) is True
+    assert written == [{"textPayload": "a"}]
+    assert "Dropped 3 bytes" in capsys.readouterr().err
+
+
+def test_spill_entry_which_is_not_json_native(
+    logging_client: Client, logging_api, spill_path: str
+):
+    logging_api.failures = 1
+    transport = ResilientBackgroundThreadTransport(
+        logging_client,
+        "python",
+        max_retries=0,
+        failure_threshold=1,
+        spill_path=spill_path,
+    )
+    created_at = datetime.datetime(2024, 1, 2, 3, 4, 5)
+    transport.send(make_record("struct"), {"created_at": created_at})
+    transport.flush()
+    assert transport.stats()["spilled_entries"] == 1
+
+    transport.worker._opened_at -= 60
+    _send(transport, "a")
+
+    assert logging_api.entries[0]["jsonPayload"] == {
+        "created_at": created_at.isoformat()
+    }
+    assert transport.stats()["replayed_entries"] == 1
+    transport.worker.stop()
+
+
+def test_drop_batch_when_spill_fails(
+    logging_client: Client, logging_api, tmp_path, capsys
+):
+    logging_api.failures = 1
+    transport = ResilientBackgroundThreadTransport(
+        logging_client,
+        "python",
+        max_retries=0,
+        failure_threshold=1,
+        spill_path=str(tmp_path / "missing" / "spill.log"),
+    )
+    _send(transport, "a")
+
+    stats = transport.stats()
+    assert stats["dropped_batches"] == 1
+    assert stats["spilled_entries"] == 0
+    assert "FileNotFoundError" in capsys.readouterr().err
+    assert transport.worker.is_alive
+
+    transport.worker._opened_at -= 60
+    _send(transport, "b")
+    assert _payloads(logging_api) == ["b"]
+    transport.worker.stop()
+
+
+def test_drop_spill_file_when_replay_fails(
+    logging_client: Client, logging_api, spill_path: str, mocker: MockerFixture, capsys
+):
+    spill = _SpillFile(spill_path, max_bytes=1024 * 1024)
+    spill.append([{"textPayload": "spilled"}])
+    mocker.patch(
+        "fastapi_cloud_logging.transports.resilient.mmap.mmap",
+        side_effect=OSError("injected failure"),
+    )
+
+    transport = ResilientBackgroundThreadTransport(
+        logging_client, "python", spill_path=spill_path
+    )
+    _send(transport, "a")
+
+    assert _payloads(logging_api) == ["a"]
+    stats = transport.stats()
+    assert stats["dropped_batches"] == 1
+    assert stats["spill_bytes"] == 0
+    assert "bytes of logs spilled to" in capsys.readouterr().err
+    assert transport.worker.is_alive
+    transport.worker.stop()
+
+
+def test_share_default_resource_in_batch(logging_client: Client, logging_api):
+    resource = Resource(type="cloud_run_revision", labels={"service_name": "app"})
+    transport = ResilientBackgroundThreadTransport(
+        logging_client, "python", resource=resource
+    )
+    transport.send(make_record("a"), "a", resource=resource)
+    transport.flush()
+
+    assert logging_api.resources == [resource._to_dict()]
+    assert "resource" not in logging_api.entries[0]
+
+
+@pytest.fixture
+def reject_poison(logging_api, mocker: MockerFixture):
+    write_entries = logging_api.write_entries
+
+    def write(entries, **kwargs):
+        if any(entry.get("textPayload") == "poison" for entry in entries):
+            raise InvalidArgument("invalid entry")
+        write_entries(entries, **kwargs)
+
+    mocker.patch.object(logging_api, "write_entries", side_effect=write)
+
+
+@pytest.mark.usefixtures("reject_poison")
+def test_drop_rejected_batch(logging_client: Client, logging_api, spill_path, capsys):
+    transport = ResilientBackgroundThreadTransport(
+        logging_client,
+        "python",
+        batch_size=1,
+        initial_backoff=0.001,
+        failure_threshold=1,
+        spill_path=spill_path,
+    )
+    _send(transport, "poison")
+    _send(transport, "a")
+
+    # a permanent error is neither retried, spilled, nor opens the circuit
+    assert _payloads(logging_api) == ["a"]
+    assert transport.circuit_state is CircuitState.CLOSED
+    stats = transport.stats()
+    assert stats["rejected_batches"] == 1
+    assert stats["retries"] == 0
+    assert stats["spilled_entries"] == 0
+    assert "Dropped 1 logs rejected by the API." in capsys.readouterr().err
+    transport.worker.stop()
+
+
+@pytest.mark.usefixtures("reject_poison")
+def test_rejected_batch_does_not_stall_replay(
+    logging_client: Client, logging_api, spill_path: str
+):
+    spill = _SpillFile(spill_path, max_bytes=1024 * 1024)
+    spill.append([{"textPayload": "poison"}, {"textPayload": "spilled"}])
+
+    transport = ResilientBackgroundThreadTransport(
+        logging_client, "python", batch_size=1, spill_path=spill_path
+    )
+    _send(transport, "a")
+
+    assert _payloads(logging_api) == ["spilled", "a"]
+    stats = transport.stats()
+    assert stats["rejected_batches"] == 1
+    assert stats["replayed_entries"] == 1
+    assert stats["spill_bytes"] == 0
+    transport.worker.stop()
@@ -0,0 +1,107 @@
+import logging
+import zlib
+
+import pytest
+from google.cloud.logging_v2.resource import Resource
+
+from fastapi_cloud_logging import FastAPILoggingHandler, TraceSamplingFilter
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import FastAPILoggingFilter
+from fastapi_cloud_logging.request_logging_middleware import (
+    _FASTAPI_REQUEST_CONTEXT,
+    FastAPIRequestContext,
+)
+
+from .conftest import make_record
+
+_TRACE_ID = "105445aa7843bc8bf206b12000100000"
+# value of the trace ID hashed into 0.0 to 1.0
+_TRACE_VALUE = zlib.crc32(_TRACE_ID.encode("utf-8")) / 0x100000000
+
+
+@pytest.fixture
+def request_context():
+    def set_context(sampled: bool = False, trace_id: str = _TRACE_ID):
+        headers = []
+        if trace_id is not None:
+            trace = f"{trace_id}/1;o={int(sampled)}"
+            headers.append((b"x-cloud-trace-context", trace.encode("latin-1")))
+        context = FastAPIRequestContext.from_scope(
+            {"type": "http", "method": "GET", "headers": headers, "path": "/"}
+        )
+        tokens.append(_FASTAPI_REQUEST_CONTEXT.set(context))
+        return context
+
+    tokens = []
+    yield set_context
+    for token in reversed(tokens):
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+
+def test_without_request():
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        assert TraceSamplingFilter(0.0).filter(make_record()) is True
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+
+def test_sampled_flag(request_context):
+    request_context(sampled=True)
+    assert TraceSamplingFilter(0.0).filter(make_record()) is True
+    assert (
+        TraceSamplingFilter(0.0, use_sampled_flag=False).filter(make_record()) is False
+    )
+
+
+def test_trace_id_hash(request_context):
+    context = request_context()
+    assert TraceSamplingFilter(_TRACE_VALUE + 0.01).filter(make_record()) is True
+    assert TraceSamplingFilter(_TRACE_VALUE - 0.01).filter(make_record()) is False
+    assert context.sampling_value == _TRACE_VALUE
+
+
+def test_decided_once_per_request_without_trace(request_context):
+    request_context(trace_id=None)
+    sampling_filter = TraceSamplingFilter(0.5)
+    decisions = {sampling_filter.filter(make_record()) for _ in range(20)}
+    assert len(decisions) == 1
+
+
+def test_rates_by_logger_and_level(request_context):
+    request_context()
+    sampling_filter = TraceSamplingFilter(
+        0.0,
+        logger_rates={"app.db": 1.0},
+        level_rates={logging.WARNING: 1.0, logging.CRITICAL: 0.0},
+    )
+    assert sampling_filter.filter(make_record(name="app")) is False
+    assert sampling_filter.filter(make_record(name="app.db")) is True
+    assert sampling_filter.filter(make_record(name="app.db.pool")) is True
+    assert sampling_filter.filter(make_record(name="app.dbx")) is False
+    assert sampling_filter.filter(make_record(name="app", level=logging.ERROR)) is True
+    assert (
+        sampling_filter.filter(make_record(name="app.db", level=logging.CRITICAL))
+        is False
+    )
+
+
+def test_invalid_rate():
+    with pytest.raises(ValueError):
+        TraceSamplingFilter(1.5)
+    with pytest.raises(ValueError):
+        TraceSamplingFilter(logger_rates={"app": -0.1})
+
+
+def test_dropped_record_is_not_enriched(request_context, mocker):
+    handler = FastAPILoggingHandler(
+        mocker.Mock(project="test-project"),
+        transport=mocker.Mock(),
+        resource=Resource(type="global", labels={}),
+    )
+    handler.filters.insert(0, TraceSamplingFilter(0.0, use_sampled_flag=False))
+    enrich = mocker.spy(FastAPILoggingFilter, "filter")
+    request_context()
+
+    assert handler.handle(make_record()) is False
+    enrich.assert_not_called()
+    handler.transport.send.assert_not_called()
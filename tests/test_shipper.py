@@ -0,0 +1,220 @@
+import atexit
+import datetime
+import functools
+import logging
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import time
+
+import pytest
+from google.cloud.logging import Client
+from google.cloud.logging_v2.resource import Resource
+from pytest_mock import MockerFixture
+
+from fastapi_cloud_logging import FastAPILoggingHandler
+from fastapi_cloud_logging.json_encoder import get_json_encoder
+from fastapi_cloud_logging.transports import LogShipper, UnixSocketTransport
+from fastapi_cloud_logging.transports._helpers import decode_entries, encode_entry
+
+from .conftest import make_record
+
+
+@pytest.fixture
+def socket_path():
+    # tmp_path of pytest can be too long for a Unix socket
+    directory = tempfile.mkdtemp(prefix="shipper")
+    yield os.path.join(directory, "logs.sock")
+    shutil.rmtree(directory)
+
+
+def _wait_for(condition, timeout: float = 5.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.mark.parametrize("encoder", ["json", "orjson"])
+def test_encode_and_decode_entries(encoder: str):
+    json_encoder = get_json_encoder(encoder)
+    entry = {
+        "message": {"text": "Hello", "count": 3},
+        "severity": "WARNING",
+        "timestamp": datetime.datetime(
+            2022, 6, 9, 22, 33, tzinfo=datetime.timezone.utc
+        ),
+        "labels": {"python_logger": "worker_logger"},
+        "resource": Resource(type="global", labels={"project_id": "test-project"}),
+        "trace": None,
+        "log_name": "projects/test-project/logs/python",
+    }
+    data = encode_entry(entry, json_encoder) + encode_entry(entry, json_encoder)
+
+    # the second frame is not complete yet
+    buffer = bytearray(data[:-3])
+    entries, size = decode_entries(buffer, json_encoder)
+    assert entries == [entry]
+    assert size == len(data) // 2
+
+    buffer = bytearray(data)
+    entries, size = decode_entries(buffer, json_encoder)
+    assert entries == [entry, entry]
+    assert size == len(data)
+
+
+def test_ship_entries_of_workers(logging_client: Client, logging_api, socket_path: str):
+    shipper = LogShipper(logging_client, socket_path, max_latency=0.05)
+    shipper.start()
+    workers = [
+        UnixSocketTransport(logging_client, f"worker{index}", socket_path=socket_path)
+        for index in range(2)
+    ]
+    try:
+        for index in range(10):
+            for worker in workers:
+                worker.send(
+                    make_record(f"message {index}", level=logging.WARNING),
+                    f"message {index}",
+                    resource=Resource(type="global", labels={}),
+                    trace="projects/test-project/traces/1234",
+                )
+        for worker in workers:
+            worker.flush()
+        _wait_for(lambda: shipper.stats()["received_entries"] == 20)
+        assert shipper.stats()["connections"] == 2
+    finally:
+        for worker in workers:
+            worker.close()
+        shipper.stop()
+
+    entries = logging_api.entries
+    assert len(entries) == 20
+    # entries of both workers share batches
+    assert len(logging_api.writes) < 20
+    assert {entry["logName"] for entry in entries} == {
+        "projects/test-project/logs/worker0",
+        "projects/test-project/logs/worker1",
+    }
+    entry = entries[0]
+    assert entry["severity"] == 400
+    # the resource of the shipper is written once per batch
+    assert "resource" not in entry
+    assert logging_api.resources[0] == {"type": "global", "labels": {}}
+    assert entry["trace"] == "projects/test-project/traces/1234"
+    assert entry["labels"] == {"python_logger": "test_logger"}
+    assert not os.path.exists(socket_path)
+
+
+def test_reconnect_to_shipper(
+    logging_client: Client, logging_api, socket_path: str, capsys
+):
+    transport = UnixSocketTransport(
+        logging_client, "python", socket_path=socket_path, reconnect_interval=0.01
+    )
+    shipper = LogShipper(logging_client, socket_path, max_latency=0.01)
+    try:
+        transport.send(make_record("before the shipper starts"), "before")
+        _wait_for(lambda: "Failed to connect" in capsys.readouterr().err)
+
+        shipper.start()
+        transport.flush()
+        _wait_for(lambda: len(logging_api.entries) == 1)
+    finally:
+        transport.close()
+        shipper.stop()
+
+    assert logging_api.entries[0]["textPayload"] == "before"
+
+
+def test_close_at_exit(logging_client: Client, socket_path: str, mocker: MockerFixture):
+    register = mocker.patch.object(atexit, "register")
+    transport = UnixSocketTransport(logging_client, "python", socket_path=socket_path)
+    register.assert_called_once_with(transport.close)
+    transport.close()
+
+
+def test_close_without_shipper(logging_client: Client, socket_path: str, capsys):
+    transport = UnixSocketTransport(
+        logging_client, "python", socket_path=socket_path, grace_period=1.0
+    )
+    transport.close()
+    transport.send(make_record("after close"), "after close")
+    transport.flush()
+
+    assert transport.stats()["queued_entries"] == 1
+
+
+def test_handler_with_shipper(logging_client: Client, logging_api, socket_path: str):
+    shipper = LogShipper(logging_client, socket_path, max_latency=0.01)
+    shipper.start()
+    handler = FastAPILoggingHandler(
+        logging_client,
+        transport=functools.partial(UnixSocketTransport, socket_path=socket_path),
+        resource=Resource(type="global", labels={}),
+    )
+    logger = logging.Logger("worker_logger")
+    logger.addHandler(handler)
+    try:
+        logger.error("An error has occurred")
+        handler.flush()
+        _wait_for(lambda: len(logging_api.entries) == 1)
+    finally:
+        handler.transport.close()
+        shipper.stop()
+
+    entry = logging_api.entries[0]
+    assert entry["textPayload"] == "An error has occurred"
+    assert entry["severity"] == 500
+    assert entry["sourceLocation"]["function"] == "test_handler_with_shipper"
+
+
+def test_reject_frame_over_max_size(
+    logging_client: Client, logging_api, socket_path: str, capsys
+):
+    shipper = LogShipper(
+        logging_client, socket_path, max_latency=0.05, max_frame_bytes=1024
+    )
+    shipper.start()
+    json_encoder = get_json_encoder("json")
+    entry = {"message": "valid", "severity": "WARNING", "log_name": "python"}
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(socket_path)
+            # a corrupt length prefix after a valid frame
+            connection.sendall(
+                encode_entry(entry, json_encoder) + struct.pack("!I", 2**31)
+            )
+            _wait_for(lambda: shipper.stats()["rejected_connections"] == 1)
+            assert connection.recv(1) == b""
+        assert shipper.stats()["connections"] == 0
+        assert shipper.stats()["received_entries"] == 1
+    finally:
+        shipper.stop()
+
+    assert [entry["textPayload"] for entry in logging_api.entries] == ["valid"]
+    assert "over max_frame_bytes of 1024" in capsys.readouterr().err
+
+
+def test_drop_entry_over_max_frame_size(
+    logging_client: Client, logging_api, socket_path: str, capsys
+):
+    shipper = LogShipper(logging_client, socket_path, max_latency=0.05)
+    shipper.start()
+    worker = UnixSocketTransport(
+        logging_client, "worker", socket_path=socket_path, max_frame_bytes=1024
+    )
+    try:
+        worker.send(make_record("large"), "x" * 2048)
+        worker.send(make_record("small"), "small")
+        worker.flush()
+        _wait_for(lambda: shipper.stats()["received_entries"] == 1)
+    finally:
+        worker.close()
+        shipper.stop()
+
+    assert [entry["textPayload"] for entry in logging_api.entries] == ["small"]
+    assert worker.stats()["dropped_by_severity"] == {"INFO": 1}
+    assert "over max_frame_bytes of 1024" in capsys.readouterr().err
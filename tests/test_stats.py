@@ -0,0 +1,124 @@
+import asyncio
+import logging
+import threading
+
+import httpx
+import pytest
+from fastapi import FastAPI
+from google.cloud.logging import Client
+from google.cloud.logging_v2.resource import Resource
+
+from fastapi_cloud_logging import FastAPILoggingHandler
+from fastapi_cloud_logging.stats import HandlerStats, create_stats_router
+from fastapi_cloud_logging.transports import AsyncBatchTransport
+
+
+@pytest.fixture
+def resource() -> Resource:
+    return Resource(type="global", labels={})
+
+
+def test_counters_are_summed_across_threads():
+    stats = HandlerStats()
+
+    def record():
+        for _ in range(100):
+            stats.record_filter(10)
+        stats.record_batch(100, 1000)
+
+    threads = [threading.Thread(target=record) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    stats.record_batch(10, 5000, failed=True)
+
+    result = stats.as_dict()
+    assert result["records"] == 400
+    assert result["filter_ns"] == 4000
+    assert result["mean_filter_ns"] == 10
+    assert result["batches"] == 5
+    assert result["mean_batch_size"] == 82
+    assert result["max_batch_size"] == 100
+    assert result["max_flush_ns"] == 5000
+    assert result["api_errors"] == 1
+    assert result["queue_depth"] is None
+
+
+def test_handler_with_background_transport(
+    logging_client: Client, logging_api, resource: Resource
+):
+    logging_api.failures = 1
+    handler = FastAPILoggingHandler(
+        logging_client, resource=resource, collect_stats=True
+    )
+    logger = logging.Logger("stats_logger")
+    logger.addHandler(handler)
+    for index in range(10):
+        logger.info("message %d", index, extra={"extra": {"index": index}})
+    handler.transport.flush()
+    logger.info("after failure")
+    handler.transport.flush()
+    handler.transport.worker.stop(grace_period=1)
+
+    result = handler.stats.as_dict()
+    assert result["records"] == 11
+    assert result["filter_ns"] > 0
+    assert result["sanitize_ns"] > 0
+    assert result["enqueue_ns"] > 0
+    assert result["queue_depth"] == 0
+    assert result["batches"] == 2
+    assert result["api_errors"] == 1
+    assert len(logging_api.entries) == 1
+
+
+def test_handler_without_stats(logging_client: Client, resource: Resource):
+    handler = FastAPILoggingHandler(logging_client, resource=resource)
+    assert handler.stats is None
+    assert handler.transport.worker.handler_stats is None
+    with pytest.raises(ValueError):
+        create_stats_router(handler)
+    handler.transport.worker.stop(grace_period=1)
+
+
+def test_async_transport_stats(logging_client: Client, logging_api, resource: Resource):
+    handler = FastAPILoggingHandler(
+        logging_client,
+        transport=AsyncBatchTransport,
+        resource=resource,
+        collect_stats=True,
+    )
+    logger = logging.Logger("stats_logger")
+    logger.addHandler(handler)
+
+    async def main():
+        for index in range(5):
+            logger.info("message %d", index)
+        depth = handler.stats.as_dict()["queue_depth"]
+        await handler.transport.aclose()
+        return depth
+
+    assert asyncio.run(main()) == 5
+    result = handler.stats.as_dict()
+    assert result["batches"] == 1
+    assert result["mean_batch_size"] == 5
+    assert result["queue_depth"] == 0
+
+
+def test_stats_router(logging_client: Client, resource: Resource):
+    handler = FastAPILoggingHandler(
+        logging_client, resource=resource, collect_stats=True
+    )
+    app = FastAPI()
+    app.include_router(create_stats_router(handler))
+
+    async def main():
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app), base_url="http://testserver"
+        ) as client:
+            return await client.get("/logging/stats")
+
+    response = asyncio.run(main())
+    handler.transport.worker.stop(grace_period=1)
+    assert response.status_code == 200
+    assert response.json()["records"] == 0
@@ -0,0 +1,110 @@
+import io
+import json
+import logging
+import sys
+
+import pytest
+
+from fastapi_cloud_logging import FastAPIStructuredLogHandler
+from fastapi_cloud_logging.request_logging_middleware import (
+    _FASTAPI_REQUEST_CONTEXT,
+    FastAPIRequestContext,
+)
+
+
+@pytest.fixture
+def stream() -> io.StringIO:
+    return io.StringIO()
+
+
+@pytest.fixture
+def logger(stream: io.StringIO) -> logging.Logger:
+    logger = logging.Logger("structured_logger")
+    logger.addHandler(
+        FastAPIStructuredLogHandler(
+            stream=stream, project_id="test-project", labels={"env": "test"}
+        )
+    )
+    return logger
+
+
+def _lines(stream: io.StringIO) -> list:
+    return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+
+def test_without_request(logger: logging.Logger, stream: io.StringIO):
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        logger.info("Hello %s", "Bob")
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+    (line,) = _lines(stream)
+    assert line["message"] == "Hello Bob"
+    assert line["severity"] == "INFO"
+    assert line["logging.googleapis.com/labels"] == {
+        "python_logger": "structured_logger",
+        "env": "test",
+    }
+    assert line["logging.googleapis.com/sourceLocation"]["function"] == (
+        "test_without_request"
+    )
+    assert isinstance(line["timestampSeconds"], int)
+    assert 0 <= line["timestampNanos"] < 10**9
+    assert "httpRequest" not in line
+    assert "logging.googleapis.com/trace" not in line
+
+
+def test_with_request(logger: logging.Logger, stream: io.StringIO):
+    token = _FASTAPI_REQUEST_CONTEXT.set(
+        FastAPIRequestContext(
+            request_method="GET",
+            request_url="https://example.com/api/v1/users/me",
+            content_length=None,
+            user_agent="curl/7.77.0",
+            remote_ip="127.0.0.1",
+            referer=None,
+            protocol="https",
+            cloud_trace_content="105445ab7f43bc8bf206b12000100000/2;o=1",
+        )
+    )
+    try:
+        logger.warning({"user": "Bob", "severity": "ignored"})
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    (line,) = _lines(stream)
+    assert line["user"] == "Bob"
+    assert line["severity"] == "WARNING"
+    assert line["logging.googleapis.com/trace"] == (
+        "projects/test-project/traces/105445ab7f43bc8bf206b12000100000"
+    )
+    assert line["logging.googleapis.com/spanId"] == "2"
+    assert line["logging.googleapis.com/trace_sampled"] is True
+    assert line["httpRequest"]["requestUrl"] == "https://example.com/api/v1/users/me"
+
+
+def test_exception(logger: logging.Logger, stream: io.StringIO):
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logger.exception("An error has occurred")
+    (line,) = _lines(stream)
+    assert line["message"] == "An error has occurred"
+    assert line["severity"] == "ERROR"
+    assert len(line["traceback"]) == 1
+
+
+def test_one_write_per_record(mocker):
+    stream = mocker.Mock(spec=["write", "flush"])
+    handler = FastAPIStructuredLogHandler(stream=stream)
+    logger = logging.Logger("structured_logger")
+    logger.addHandler(handler)
+    logger.info("one")
+    logger.info("two")
+    assert stream.write.call_count == 2
+    assert stream.write.call_args.args[0].endswith("}\n")
+    assert handler.stream is stream
+
+
+def test_default_stream():
+    assert FastAPIStructuredLogHandler().stream is sys.stdout
@@ -0,0 +1,110 @@
+import atexit
+import logging
+import threading
+
+from google.cloud.logging import Client
+from google.cloud.logging_v2.resource import Resource
+from pytest_mock import MockerFixture
+
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import FastAPILoggingHandler
+from fastapi_cloud_logging.transports import SyncBatchTransport
+
+from .conftest import make_record
+
+
+def test_write_on_batch_size(logging_client: Client, logging_api):
+    threads = threading.active_count()
+    transport = SyncBatchTransport(
+        logging_client, "python", batch_size=10, max_latency=60, flush_at_exit=False
+    )
+    for index in range(25):
+        transport.send(make_record(f"message {index}"), f"message {index}")
+
+    assert [len(entries) for entries in logging_api.writes] == [10, 10]
+    # the entries are written without any thread
+    assert threading.active_count() == threads
+    transport.flush()
+    assert [len(entries) for entries in logging_api.writes] == [10, 10, 5]
+    assert [entry["textPayload"] for entry in logging_api.entries] == [
+        f"message {index}" for index in range(25)
+    ]
+
+
+def test_write_on_max_latency(
+    logging_client: Client, logging_api, mocker: MockerFixture
+):
+    monotonic = mocker.patch(
+        "fastapi_cloud_logging.transports.sync_batch.time.monotonic",
+        return_value=100.0,
+    )
+    transport = SyncBatchTransport(
+        logging_client, "python", max_latency=0.5, flush_at_exit=False
+    )
+    transport.send(make_record("first"), "first")
+    monotonic.return_value = 100.2
+    transport.send(make_record("second"), "second")
+    assert logging_api.writes == []
+
+    monotonic.return_value = 100.6
+    transport.send(make_record("third"), "third")
+    assert [len(entries) for entries in logging_api.writes] == [3]
+
+
+def test_send_batch(logging_client: Client, logging_api):
+    transport = SyncBatchTransport(
+        logging_client, "python", batch_size=2, flush_at_exit=False
+    )
+    transport.send_batch(
+        [
+            (make_record(f"message {index}"), f"message {index}", {})
+            for index in range(5)
+        ]
+    )
+
+    assert [len(entries) for entries in logging_api.writes] == [2, 2, 1]
+
+
+def test_flush_at_exit(logging_client: Client, mocker: MockerFixture):
+    register = mocker.patch.object(atexit, "register")
+    transport = SyncBatchTransport(logging_client, "python")
+    register.assert_called_once_with(transport.flush)
+
+
+def test_handler_stats(logging_client: Client, logging_api):
+    handler = FastAPILoggingHandler(
+        logging_client, transport=SyncBatchTransport, collect_stats=True
+    )
+    logger = logging.Logger("sync_logger")
+    logger.addHandler(handler)
+    logger.info("first")
+    logger.info("second")
+
+    stats = handler.stats.as_dict()
+    assert stats["queue_depth"] == 2
+    handler.transport.flush()
+    stats = handler.stats.as_dict()
+    assert stats["queue_depth"] == 0
+    assert stats["batches"] == 1
+    assert len(logging_api.entries) == 2
+
+
+def test_share_default_resource_in_batch(logging_client: Client, logging_api):
+    resource = Resource(type="cloud_run_revision", labels={"service_name": "app"})
+    other = Resource(type="gce_instance", labels={"instance_id": "1"})
+    transport = SyncBatchTransport(
+        logging_client, "python", resource=resource, flush_at_exit=False
+    )
+    transport.send(make_record("default"), "default", resource=resource)
+    transport.send(
+        make_record("copy"), "copy", resource=Resource._from_dict(resource._to_dict())
+    )
+    transport.send(make_record("other"), "other", resource=other)
+    transport.flush()
+
+    # the default resource is written once for the batch, instead of in every entry
+    assert logging_api.resources == [resource._to_dict()]
+    assert [entry.get("resource") for entry in logging_api.entries] == [
+        None,
+        None,
+        other._to_dict(),
+    ]
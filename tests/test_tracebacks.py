@@ -0,0 +1,100 @@
+import sys
+import traceback
+from logging import LogRecord
+
+import pytest
+from pytest_mock import MockerFixture
+
+from fastapi_cloud_logging import tracebacks
+from fastapi_cloud_logging.fastapi_cloud_logging_handler import FastAPILoggingFilter
+from fastapi_cloud_logging.request_logging_middleware import _FASTAPI_REQUEST_CONTEXT
+from fastapi_cloud_logging.tracebacks import exception_fingerprint, format_traceback
+
+
+def _recurse(depth: int):
+    if depth == 0:
+        raise ValueError("invalid")
+    _recurse(depth - 1)
+
+
+def _exc_info(depth: int = 5):
+    try:
+        _recurse(depth)
+    except ValueError:
+        return sys.exc_info()
+
+
+def _other_error():
+    try:
+        raise KeyError("missing")
+    except KeyError:
+        return sys.exc_info()
+
+
+@pytest.mark.parametrize("limit", [1, 3, 100])
+def test_format_traceback(limit: int):
+    _, _, tb = _exc_info()
+    assert format_traceback(tb, limit) == traceback.format_tb(tb)[:limit]
+
+
+def test_format_traceback_is_cached(mocker: MockerFixture):
+    tracebacks._CACHE.clear()
+    format_tb = mocker.spy(traceback, "format_tb")
+
+    first = format_traceback(_exc_info()[2], 3)
+    second = format_traceback(_exc_info()[2], 3)
+    assert first == second
+    assert first is not second
+    assert format_tb.call_count == 1
+
+    # the same frames with another limit are another entry
+    format_traceback(_exc_info()[2], 4)
+    assert format_tb.call_count == 2
+    assert len(tracebacks._CACHE) == 2
+
+
+def test_traceback_cache_is_bounded():
+    cache = tracebacks._TracebackCache(maxsize=2)
+    cache.put(("a",), ("a",))
+    cache.put(("b",), ("b",))
+    assert cache.get(("a",)) == ("a",)
+    cache.put(("c",), ("c",))
+
+    # the least recently used entry is evicted
+    assert cache.get(("b",)) is None
+    assert cache.get(("a",)) == ("a",)
+    assert cache.get(("c",)) == ("c",)
+
+
+def test_exception_fingerprint():
+    error_type, _, tb = _exc_info()
+    fingerprint = exception_fingerprint(error_type, tb)
+
+    assert len(fingerprint) == 16
+    assert exception_fingerprint(*_exc_info()[::2]) == fingerprint
+    assert exception_fingerprint(*_exc_info(depth=4)[::2]) != fingerprint
+    assert exception_fingerprint(*_other_error()[::2]) != fingerprint
+
+
+def test_filter_with_error_fingerprint():
+    logging_filter = FastAPILoggingFilter(traceback_length=2, error_fingerprint=True)
+    exc_info = _exc_info()
+    record = LogRecord(
+        name="some_log",
+        level=40,
+        pathname="tests/test_tracebacks.py",
+        lineno=1,
+        msg="An error has occurred",
+        args=None,
+        exc_info=exc_info,
+    )
+    token = _FASTAPI_REQUEST_CONTEXT.set(None)
+    try:
+        logging_filter.filter(record)
+    finally:
+        _FASTAPI_REQUEST_CONTEXT.reset(token)
+
+    assert record.json_fields == {
+        "traceback": traceback.format_tb(exc_info[2])[:2],
+        "error_fingerprint": exception_fingerprint(exc_info[0], exc_info[2]),
+    }
@@ -1,11 +1,21 @@
 import json
 from dataclasses import dataclass
-from datetime import datetime
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from enum import Enum, IntEnum
 from typing import Any
+from uuid import UUID
 
 import pytest
+from pydantic import BaseModel, Field
 
-from fastapi_cloud_logging.utils import serialize_json
+from fastapi_cloud_logging.utils import (
+    estimate_json_size,
+    register_serializer,
+    sanitize_json,
+    serialize_json,
+    truncate_json,
+)
 
 
 @dataclass
@@ -33,3 +43,159 @@ class DataObject:
 )
 def test_serialize_json(object: Any, expected: str):
     assert json.dumps(object, default=serialize_json) == expected
+
+
+class Color(str, Enum):
+    RED = "red"
+
+
+class Level(IntEnum):
+    HIGH = 3
+
+
+class Plain:
+    pass
+
+
+@pytest.mark.parametrize(
+    "object",
+    [
+        "str",
+        12,
+        1.5,
+        True,
+        None,
+        datetime(2021, 9, 12, 2, 1),
+        ["a", 1, None],
+        ("a", datetime(2022, 6, 12, 22, 33)),
+        {"id": "id123", "name": "John Doe"},
+        {"sign_in_at": datetime(2022, 6, 12, 22, 33), "tags": ("a", "b")},
+        {2: "int", 2.5: "float", True: "bool", None: "none"},
+        {"user": {"groups": [{"id": 1, "joined_at": date(2022, 1, 1)}]}},
+        DataObject(id="id123", created_at=datetime(2022, 6, 9, 22, 33)),
+        {"color": Color.RED, "level": Level.HIGH, "plain": Plain()},
+    ],
+)
+def test_sanitize_json(object: Any):
+    expected = json.loads(json.dumps(object, default=serialize_json))
+    sanitized = sanitize_json(object)
+    assert sanitized == expected
+    assert json.dumps(sanitized) == json.dumps(expected)
+
+
+def test_sanitize_json_keeps_native_containers():
+    flat = {"user_id": "user1234", "count": 3, "ratio": 0.5, "ok": True}
+    assert sanitize_json(flat) is flat
+    nested = {"ids": [1, 2, 3], "user": flat}
+    assert sanitize_json(nested) == nested
+    assert sanitize_json(nested)["user"] is flat
+
+
+def test_sanitize_json_with_invalid_key():
+    with pytest.raises(TypeError):
+        sanitize_json({("a", "b"): 1})
+
+
+class Status(Enum):
+    ACTIVE = "active"
+
+
+class UserModel(BaseModel):
+    user_id: str = Field(alias="userId")
+
+
+@pytest.mark.parametrize(
+    "object, expected",
+    [
+        (date(2022, 6, 12), "2022-06-12"),
+        (time(22, 33), "22:33:00"),
+        (timedelta(minutes=1, milliseconds=500), 60.5),
+        (
+            UUID("12345678-1234-5678-1234-567812345678"),
+            "12345678-1234-5678-1234-567812345678",
+        ),
+        (Decimal("1.10"), "1.10"),
+        (Status.ACTIVE, "active"),
+        (frozenset({"a"}), ["a"]),
+        (b"bytes\xff", "bytes\\xff"),
+        (UserModel(userId="user1234"), {"userId": "user1234"}),
+        (
+            DataObject(id="id123", created_at=datetime(2022, 6, 9, 22, 33)),
+            {"id": "id123", "created_at": datetime(2022, 6, 9, 22, 33)},
+        ),
+        (object(), "object that is failed to serialize"),
+    ],
+)
+def test_serialize_json_converters(object: Any, expected: Any):
+    assert serialize_json(object) == expected
+
+
+def test_register_serializer():
+    class Money:
+        def __init__(self, amount: Decimal, currency: str):
+            self.amount = amount
+            self.currency = currency
+
+    class Yen(Money):
+        pass
+
+    money = Yen(Decimal("100"), "JPY")
+    assert serialize_json(money) == {"amount": Decimal("100"), "currency": "JPY"}
+
+    @register_serializer(Money)
+    def serialize_money(money: Money):
+        return f"{money.amount} {money.currency}"
+
+    assert serialize_json(money) == "100 JPY"
+    assert json.dumps({"price": money}, default=serialize_json) == (
+        '{"price": "100 JPY"}'
+    )
+
+
+@pytest.mark.parametrize(
+    "object",
+    [
+        "message",
+        {"message": "Hello", "user": {"id": "user1234", "tags": ["a", "b"]}},
+        ["alpha", "beta", 1234567, None],
+    ],
+)
+def test_estimate_json_size(object: Any):
+    size = len(json.dumps(object, separators=(",", ":")))
+    assert size * 0.5 <= estimate_json_size(object) <= size * 1.5
+
+
+def test_truncate_json_keeps_small_values():
+    value = {"message": "Hello", "ids": [1, 2, 3]}
+    assert truncate_json(value, 1000) == (value, False)
+    assert truncate_json(value, 1000)[0] is value
+
+
+@pytest.mark.parametrize("max_size", [10, 100, 1000])
+def test_truncate_json(max_size: int):
+    value = {
+        "message": "x" * 5000,
+        "ids": list(range(1000)),
+        "user": {"id": "user1234", "bio": "y" * 5000},
+    }
+    truncated, is_truncated = truncate_json(value, max_size)
+
+    assert is_truncated is True
+    assert estimate_json_size(truncated) <= max_size
+    assert len(json.dumps(truncated)) < max_size * 2
+    # the original value is not modified
+    assert len(value["message"]) == 5000
+    assert len(value["ids"]) == 1000
+
+
+def test_truncate_json_string():
+    truncated, is_truncated = truncate_json("x" * 100, 20)
+    assert truncated == "x" * 15 + "..."
+    assert is_truncated is True
+
+
+def test_truncate_json_keeps_untruncated_items():
+    user = {"id": "user1234"}
+    truncated, _ = truncate_json({"user": user, "bio": "y" * 1000}, 100)
+    assert truncated["user"] is user
+    assert truncated["bio"].endswith("...")